@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 import logging
@@ -5,6 +6,8 @@ import torch
 from tqdm import tqdm
 from omegaconf import OmegaConf
 from ovi.utils.io_utils import save_video
+from ovi.utils.guidance import GuidanceSchedule
+from ovi.modules.lora import resolve_lora_spec
 from ovi.utils.processing_utils import format_prompt_for_filename, validate_and_process_user_prompt
 from ovi.utils.utils import get_arguments
 from ovi.distributed_comms.util import get_world_size, get_local_rank, get_global_rank
@@ -25,6 +28,140 @@ def _init_logging(rank):
         logging.basicConfig(level=logging.ERROR)
 
 
+def load_eval_data(config):
+    """Validate mode/prompt/image inputs of a run config and return [(text_prompt, image_path), ...]."""
+    text_prompt = config.get("text_prompt")
+    image_path = config.get("image_path", None)
+    assert config.get("mode") in ["t2v", "i2v", "t2i2v"], f"Invalid mode {config.get('mode')}, must be one of ['t2v', 'i2v', 't2i2v']"
+    text_prompts, image_paths = validate_and_process_user_prompt(text_prompt, image_path, mode=config.get("mode"))
+    if config.get("mode") != "i2v":
+        logging.info(f"mode: {config.get('mode')}, setting all image_paths to None")
+        image_paths = [None] * len(text_prompts)
+    else:
+        assert all(p is not None and os.path.isfile(p) for p in image_paths), f"In i2v mode, all image paths must be provided.{image_paths}"
+
+    # Load CSV data
+    return list(zip(text_prompts, image_paths))
+
+
+# run config keys that describe one job's inputs / outputs; everything else decides how samples are generated
+SAMPLE_KEYS = ("text_prompt", "image_path", "image_paths", "output_dir", "seed", "each_example_n_times")
+
+
+def sampling_key(config):
+    """Run config without the per-job inputs: jobs with equal keys can share generate_batch calls."""
+    cfg = OmegaConf.to_container(config, resolve=True) if OmegaConf.is_config(config) else dict(config)
+    return json.dumps({k: v for k, v in cfg.items() if k not in SAMPLE_KEYS}, sort_keys=True, default=str)
+
+
+def generate_samples(ovi_engine, config, eval_data, output_dir, global_rank=0, sp_rank=0, progress_callback=None):
+    """
+    Run every (text_prompt, image_path) pair through the engine and save the results. Returns the written mp4 paths.
+    Up to config.batch_size samples (prompts x each_example_n_times) are denoised together via generate_batch.
+    progress_callback(stage, **info) receives the engine stages plus "mux", tagged with sample/num_samples.
+    """
+    job_progress = None
+    if progress_callback is not None:
+        def job_progress(_job, stage, **info):
+            progress_callback(stage, **info)
+    return generate_jobs(ovi_engine, [(config, eval_data, output_dir)], global_rank=global_rank, sp_rank=sp_rank,
+                         progress_callback=job_progress)[0]
+
+
+def generate_jobs(ovi_engine, jobs, global_rank=0, sp_rank=0, progress_callback=None):
+    """
+    Like generate_samples for several jobs [(config, eval_data, output_dir), ...] with the same sampling_key:
+    the samples of all jobs are denoised together (up to batch_size per generate_batch call), every job keeps
+    its own seed, each_example_n_times and output_dir. Returns the written mp4 paths per job.
+    progress_callback(job_index, stage, **info) gets sample/num_samples counted within that job.
+    """
+    config = jobs[0][0]
+    key = sampling_key(config)
+    assert all(sampling_key(c) == key for c, _, _ in jobs[1:]), "generate_jobs needs jobs with the same sampling config"
+
+    batch_size = max(1, int(config.get("batch_size", 1)))
+    video_frame_height_width = config.get("video_frame_height_width", None)
+    solver_name = config.get("solver_name", "unipc")
+    sample_steps = config.get("sample_steps", 50)
+    shift = config.get("shift", 5.0)
+    video_guidance_scale = config.get("video_guidance_scale", 4.0)
+    audio_guidance_scale = config.get("audio_guidance_scale", 3.0)
+    slg_layer = config.get("slg_layer", 11)
+    video_negative_prompt = config.get("video_negative_prompt", "")
+    audio_negative_prompt = config.get("audio_negative_prompt", "")
+    cfg_batch = config.get("cfg_batch", True)
+    guidance = GuidanceSchedule.from_config(config)
+    step_cache_threshold = float(config.get("step_cache_threshold", 0.0))
+    step_cache_warmup = int(config.get("step_cache_warmup", 2))
+    ffn_chunk_size = int(config.get("ffn_chunk_size", 0))
+    lora_dir = config.get("lora_dir") or os.environ.get("OVI_LORA_DIR") or os.path.join(config.get("ckpt_dir", "./ckpts"), "loras")
+    lora = resolve_lora_spec(config.get("lora", None), lora_dir)
+    lora_merge = bool(config.get("lora_merge", False))
+
+    samples = []
+    for job, (job_config, eval_data, _) in enumerate(jobs):
+        n_times = job_config.get("each_example_n_times", 1)
+        seed = job_config.get("seed", 100)
+        job_samples = [
+            {"text_prompt": text_prompt, "image_path": image_path, "seed": seed + idx}
+            for text_prompt, image_path in eval_data
+            for idx in range(n_times)
+        ]
+        for i, sample in enumerate(job_samples):
+            sample.update(job=job, job_sample=i, job_num_samples=len(job_samples))
+        samples += job_samples
+
+    output_paths = [[] for _ in jobs]
+    for start in tqdm(range(0, len(samples), batch_size)):
+        chunk = samples[start:start + batch_size]
+        chunk_progress = None
+        if progress_callback is not None:
+            def chunk_progress(stage, _chunk=chunk, offset=0, **info):
+                # report once per job with samples in the current group (the whole chunk for per-call stages)
+                # "batch" counts the whole group, each job is told only how many of its own samples it holds
+                part = _chunk[offset:offset + info["batch"]] if "batch" in info else _chunk[offset:]
+                first, counts = {}, {}
+                for s in part:
+                    first.setdefault(s["job"], s)
+                    counts[s["job"]] = counts.get(s["job"], 0) + 1
+                for job, sample in first.items():
+                    job_info = dict(info, batch=counts[job]) if "batch" in info else info
+                    progress_callback(job, stage, sample=sample["job_sample"],
+                                      num_samples=sample["job_num_samples"], **job_info)
+
+        results = ovi_engine.generate_batch(chunk,
+                                            video_frame_height_width=video_frame_height_width,
+                                            solver_name=solver_name,
+                                            sample_steps=sample_steps,
+                                            shift=shift,
+                                            video_guidance_scale=video_guidance_scale,
+                                            audio_guidance_scale=audio_guidance_scale,
+                                            slg_layer=slg_layer,
+                                            video_negative_prompt=video_negative_prompt,
+                                            audio_negative_prompt=audio_negative_prompt,
+                                            progress_callback=chunk_progress,
+                                            cfg_batch=cfg_batch,
+                                            guidance=guidance,
+                                            step_cache_threshold=step_cache_threshold,
+                                            step_cache_warmup=step_cache_warmup,
+                                            ffn_chunk_size=ffn_chunk_size,
+                                            lora=lora,
+                                            lora_merge=lora_merge)
+
+        if sp_rank == 0:
+            for sample, (generated_video, generated_audio, generated_image) in zip(chunk, results):
+                if progress_callback is not None:
+                    progress_callback(sample["job"], "mux", sample=sample["job_sample"], num_samples=sample["job_num_samples"])
+                output_dir = jobs[sample["job"]][2]
+                formatted_prompt = format_prompt_for_filename(sample["text_prompt"])
+                output_path = os.path.join(output_dir, f"{formatted_prompt}_{'x'.join(map(str, video_frame_height_width))}_{sample['seed']}_{global_rank}.mp4")
+                save_video(output_path, generated_video, generated_audio, fps=24, sample_rate=16000)
+                if generated_image is not None:
+                    generated_image.save(output_path.replace('.mp4', '.png'))
+                output_paths[sample["job"]].append(output_path)
+    return output_paths
+
+
 def main(config, args): 
 
     world_size = get_world_size()
@@ -56,15 +193,7 @@ def main(config, args):
     target_dtype = torch.bfloat16
 
     # validate inputs before loading model to not waste time if input is not valid
-    text_prompt = config.get("text_prompt")
-    image_path = config.get("image_path", None)
-    assert config.get("mode") in ["t2v", "i2v", "t2i2v"], f"Invalid mode {config.get('mode')}, must be one of ['t2v', 'i2v', 't2i2v']"
-    text_prompts, image_paths = validate_and_process_user_prompt(text_prompt, image_path, mode=config.get("mode"))
-    if config.get("mode") != "i2v":
-        logging.info(f"mode: {config.get('mode')}, setting all image_paths to None")
-        image_paths = [None] * len(text_prompts)
-    else:
-        assert all(p is not None and os.path.isfile(p) for p in image_paths), f"In i2v mode, all image paths must be provided.{image_paths}"
+    all_eval_data = load_eval_data(config)
 
     logging.info("Loading OVI Fusion Engine...")
     ovi_engine = OviFusionEngine(config=config, device=device, target_dtype=target_dtype)
@@ -73,9 +202,6 @@ def main(config, args):
     output_dir = config.get("output_dir", "./outputs")
     os.makedirs(output_dir, exist_ok=True)
 
-    # Load CSV data
-    all_eval_data = list(zip(text_prompts, image_paths))
-
     # Get SP configuration
     use_sp = get_sequence_parallel_state()
     if use_sp:
@@ -108,38 +234,7 @@ def main(config, args):
         # Distribute across SP groups
         this_rank_eval_data = all_eval_data[sp_group_id :: num_sp_groups]
 
-    for _, (text_prompt, image_path) in tqdm(enumerate(this_rank_eval_data)):
-        video_frame_height_width = config.get("video_frame_height_width", None)
-        seed = config.get("seed", 100)
-        solver_name = config.get("solver_name", "unipc")
-        sample_steps = config.get("sample_steps", 50)
-        shift = config.get("shift", 5.0)
-        video_guidance_scale = config.get("video_guidance_scale", 4.0)
-        audio_guidance_scale = config.get("audio_guidance_scale", 3.0)
-        slg_layer = config.get("slg_layer", 11)
-        video_negative_prompt = config.get("video_negative_prompt", "")
-        audio_negative_prompt = config.get("audio_negative_prompt", "")
-        for idx in range(config.get("each_example_n_times", 1)):
-            generated_video, generated_audio, generated_image = ovi_engine.generate(text_prompt=text_prompt,
-                                                                    image_path=image_path,
-                                                                    video_frame_height_width=video_frame_height_width,
-                                                                    seed=seed+idx,
-                                                                    solver_name=solver_name,
-                                                                    sample_steps=sample_steps,
-                                                                    shift=shift,
-                                                                    video_guidance_scale=video_guidance_scale,
-                                                                    audio_guidance_scale=audio_guidance_scale,
-                                                                    slg_layer=slg_layer,
-                                                                    video_negative_prompt=video_negative_prompt,
-                                                                    audio_negative_prompt=audio_negative_prompt)
-            
-            if sp_rank == 0:
-                formatted_prompt = format_prompt_for_filename(text_prompt)
-                output_path = os.path.join(output_dir, f"{formatted_prompt}_{'x'.join(map(str, video_frame_height_width))}_{seed+idx}_{global_rank}.mp4")
-                save_video(output_path, generated_video, generated_audio, fps=24, sample_rate=16000)
-                if generated_image is not None:
-                    generated_image.save(output_path.replace('.mp4', '.png'))
-        
+    generate_samples(ovi_engine, config, this_rank_eval_data, output_dir, global_rank=global_rank, sp_rank=sp_rank)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+"""
+Per-checkpoint model specs (latent lengths, target area, prompt formatter).
+
+Kept free of torch/diffusers imports so the API process can read them (e.g. for job cost
+estimates) without loading the inference stack.
+"""
+import re
+
+NAME_TO_MODEL_SPECS_MAP = {
+    "720x720_5s": {
+        "path": "model.safetensors",
+        "video_latent_length": 31,
+        "audio_latent_length": 157,
+        "video_area": 720 * 720,
+        "formatter": lambda text: re.sub(r"Audio:\s*(.*)", r"<AUDCAP>\1<ENDAUDCAP>", text, flags=re.S)
+    },
+    "960x960_5s": {
+        "path": "model_960x960.safetensors",
+        "video_latent_length": 31,
+        "audio_latent_length": 157,
+        "video_area": 960 * 960,
+        "formatter": lambda text: re.sub(r"<AUDCAP>(.*?)<ENDAUDCAP>", r"Audio: \1", text, flags=re.S)
+    }, 
+    "960x960_10s": {
+        "path": "model_960x960_10s.safetensors",
+        "video_latent_length": 61,
+        "audio_latent_length": 314,
+        "video_area": 960 * 960,
+        "formatter": lambda text: re.sub(r"<AUDCAP>(.*?)<ENDAUDCAP>", r"Audio: \1", text, flags=re.S)
+    },
+    "720x720_3s": {
+        "path": "model.safetensors",          # nutzt das gleiche 720x720 Modell
+        "video_latent_length": 19,            # ~3s Test (31*3/5 ≈ 18.6)
+        "audio_latent_length": 94,            # ~3s Test (157*3/5 ≈ 94.2)
+        "video_area": 720 * 720,
+        "formatter": lambda text: re.sub(r"Audio:\s*(.*)", r"<AUDCAP>\1<ENDAUDCAP>", text, flags=re.S)
+    }
+}
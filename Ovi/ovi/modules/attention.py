@@ -19,13 +19,236 @@ except ModuleNotFoundError:
     FLASH_ATTN_2_AVAILABLE = False
 
 import warnings
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
 
 __all__ = [
     'flash_attention',
     'attention',
     'attention_with_weights',
+    'register_attention_backend',
+    'select_attention_backend',
+    'ATTENTION_BACKENDS',
 ]
 
+# force one backend for every call ("fa3", "fa2", "sdpa", "chunked"); empty = pick per call
+ATTN_BACKEND = os.getenv("OVI_ATTN_BACKEND", "")
+# query rows per chunk of the chunked backend, and the Lq * Lk size above which it replaces SDPA off-GPU
+ATTN_CHUNK_SIZE = int(os.getenv("OVI_ATTN_CHUNK_SIZE", "1024"))
+ATTN_CHUNKED_MIN_ELEMS = int(os.getenv("OVI_ATTN_CHUNKED_MIN_ELEMS", str(1 << 24)))
+
+HALF_DTYPES = (torch.float16, torch.bfloat16)
+
+
+@dataclass
+class AttentionBackend:
+    name: str
+    fn: Callable
+    supports: Callable  # (q, k, v, window_size, dropout_p, version) -> bool
+
+
+ATTENTION_BACKENDS = OrderedDict()  # in order of preference
+
+
+def register_attention_backend(name, supports):
+    """Decorator: register `fn(q, k, v, q_lens, k_lens, **kw)` under `name`, tried in registration order."""
+    def deco(fn):
+        ATTENTION_BACKENDS[name] = AttentionBackend(name, fn, supports)
+        return fn
+    return deco
+
+
+def select_attention_backend(q, k, v, window_size=(-1, -1), dropout_p=0., version=None):
+    if ATTN_BACKEND:
+        backend = ATTENTION_BACKENDS.get(ATTN_BACKEND)
+        if backend is None:
+            raise ValueError(f"OVI_ATTN_BACKEND={ATTN_BACKEND!r} unknown, available: {list(ATTENTION_BACKENDS)}")
+        if not backend.supports(q, k, v, window_size, dropout_p, version):
+            raise RuntimeError(f"Attention backend {ATTN_BACKEND!r} does not support this call "
+                               f"(device={q.device.type}, dtype={q.dtype}, q={tuple(q.shape)}, k={tuple(k.shape)})")
+        return backend
+    for backend in ATTENTION_BACKENDS.values():
+        if backend.supports(q, k, v, window_size, dropout_p, version):
+            return backend
+    raise RuntimeError(f"No attention backend for device={q.device.type}, dtype={q.dtype}, window_size={window_size}")
+
+
+def _varlen_pack(q, k, v, q_lens, k_lens, dtype):
+    # [B, L, N, C] -> packed [sum(L), N, C] + lengths, as expected by the flash-attn varlen kernels
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+
+    def half(x):
+        return x if x.dtype in HALF_DTYPES else x.to(dtype)
+
+    # preprocess query
+    if q_lens is None:
+        q = half(q.flatten(0, 1))
+        q_lens = torch.tensor(
+            [lq] * b, dtype=torch.int32).to(
+                device=q.device, non_blocking=True)
+    else:
+        q = half(torch.cat([u[:v] for u, v in zip(q, q_lens)]))
+
+    # preprocess key, value
+    if k_lens is None:
+        k = half(k.flatten(0, 1))
+        v = half(v.flatten(0, 1))
+        k_lens = torch.tensor(
+            [lk] * b, dtype=torch.int32).to(
+                device=k.device, non_blocking=True)
+    else:
+        k = half(torch.cat([u[:v] for u, v in zip(k, k_lens)]))
+        v = half(torch.cat([u[:v] for u, v in zip(v, k_lens)]))
+
+    q = q.to(v.dtype)
+    k = k.to(v.dtype)
+    cu_seqlens_q = torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
+        0, dtype=torch.int32).to(q.device, non_blocking=True)
+    cu_seqlens_k = torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
+        0, dtype=torch.int32).to(q.device, non_blocking=True)
+    return q, k, v, cu_seqlens_q, cu_seqlens_k
+
+
+def _flash_supports(available):
+    def supports(q, k, v, window_size, dropout_p, version):
+        return available and q.device.type == 'cuda' and q.size(-1) <= 256
+    return supports
+
+
+@register_attention_backend(
+    'fa3',
+    lambda q, k, v, window_size, dropout_p, version: (
+        _flash_supports(FLASH_ATTN_3_AVAILABLE)(q, k, v, window_size, dropout_p, version)
+        # Note: dropout_p, window_size are not supported in FA3 now.
+        and version in (None, 3) and tuple(window_size) == (-1, -1) and dropout_p == 0.))
+def _fa3_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal, window_size, deterministic, dtype):
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+    q, k, v, cu_seqlens_q, cu_seqlens_k = _varlen_pack(q, k, v, q_lens, k_lens, dtype)
+    x = flash_attn_interface.flash_attn_varlen_func(
+        q=q,
+        k=k,
+        v=v,
+        cu_seqlens_q=cu_seqlens_q,
+        cu_seqlens_k=cu_seqlens_k,
+        seqused_q=None,
+        seqused_k=None,
+        max_seqlen_q=lq,
+        max_seqlen_k=lk,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        deterministic=deterministic)
+
+    if isinstance(x, tuple):
+        x = x[0]
+    return x.unflatten(0, (b, lq))
+
+
+@register_attention_backend('fa2', _flash_supports(FLASH_ATTN_2_AVAILABLE))
+def _fa2_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal, window_size, deterministic, dtype):
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+    q, k, v, cu_seqlens_q, cu_seqlens_k = _varlen_pack(q, k, v, q_lens, k_lens, dtype)
+    return flash_attn.flash_attn_varlen_func(
+        q=q,
+        k=k,
+        v=v,
+        cu_seqlens_q=cu_seqlens_q,
+        cu_seqlens_k=cu_seqlens_k,
+        max_seqlen_q=lq,
+        max_seqlen_k=lk,
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic).unflatten(0, (b, lq))
+
+
+def _key_mask(k, k_lens):
+    # [B, 1, 1, Lk] True where the key is a real token (not padding), None if nothing is padded
+    if k_lens is None:
+        return None
+    k_lens = torch.as_tensor(k_lens)
+    if k_lens.device.type == 'cpu' and bool((k_lens >= k.size(1)).all()):
+        return None  # nothing padded (lengths are host-side, no sync): keeps SDPA on its fused kernels
+    k_lens = k_lens.to(k.device)
+    return (torch.arange(k.size(1), device=k.device).unsqueeze(0) < k_lens.unsqueeze(1))[:, None, None, :]
+
+
+def _zero_padded_queries(x, q_lens):
+    # the varlen kernels produce no output for padded query rows; return zeros there instead of garbage
+    if q_lens is None:
+        return x
+    q_lens = torch.as_tensor(q_lens, device=x.device)
+    keep = torch.arange(x.size(1), device=x.device).unsqueeze(0) < q_lens.unsqueeze(1)
+    return x * keep[:, :, None, None].to(x.dtype)
+
+
+def _zero_empty_keys(x, k_lens):
+    # samples with k_lens == 0 attend to nothing: zeros, not the NaN of a softmax over only -inf
+    k_lens = torch.as_tensor(k_lens, device=x.device)
+    return torch.where((k_lens == 0)[:, None, None, None], x.new_zeros(()), x)
+
+
+def _match_heads(q, k, v):
+    # grouped-query attention: Nq must be divisible by Nk
+    if k.size(2) != q.size(2):
+        rep = q.size(2) // k.size(2)
+        k, v = k.repeat_interleave(rep, dim=2), v.repeat_interleave(rep, dim=2)
+    return k, v
+
+
+def _plain_supports(q, k, v, window_size, dropout_p, version):
+    return tuple(window_size) == (-1, -1)
+
+
+@register_attention_backend(
+    'sdpa',
+    lambda q, k, v, window_size, dropout_p, version: (
+        _plain_supports(q, k, v, window_size, dropout_p, version)
+        # off-GPU the masked SDPA path materializes B x N x Lq x Lk scores, large calls go to "chunked"
+        and (q.device.type == 'cuda' or q.size(1) * k.size(1) < ATTN_CHUNKED_MIN_ELEMS)))
+def _sdpa_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal, window_size, deterministic, dtype):
+    import torch.nn.functional as F
+    k, v = _match_heads(q, k, v)
+    compute_dtype = dtype if q.device.type == 'cuda' else torch.float32
+    # [B, L, N, C] -> [B, N, L, C]
+    q_, k_, v_ = (u.transpose(1, 2).to(compute_dtype) for u in (q, k, v))
+    mask = _key_mask(k, k_lens)
+    if causal and mask is not None:
+        # SDPA rejects attn_mask together with is_causal: fold the (top-left aligned) causal mask into the key mask
+        mask = mask & torch.ones(q.size(1), k.size(1), dtype=torch.bool, device=q.device).tril()
+        causal = False
+    x = F.scaled_dot_product_attention(q_, k_, v_, attn_mask=mask, dropout_p=dropout_p,
+                                       is_causal=causal, scale=softmax_scale).transpose(1, 2)
+    if mask is not None:
+        x = _zero_empty_keys(x, k_lens)
+    return _zero_padded_queries(x, q_lens)
+
+
+@register_attention_backend('chunked', lambda q, k, v, window_size, dropout_p, version: (
+    _plain_supports(q, k, v, window_size, dropout_p, version) and dropout_p == 0.))
+def _chunked_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal, window_size, deterministic, dtype):
+    """Exact attention in fp32, ATTN_CHUNK_SIZE query rows at a time: memory O(chunk x Lk) instead of O(Lq x Lk)."""
+    k, v = _match_heads(q, k, v)
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+    scale = softmax_scale if softmax_scale is not None else q.size(-1) ** -0.5
+    mask = _key_mask(k, k_lens)
+    k_ = k.transpose(1, 2).float()                   # B N Lk C
+    v_ = v.transpose(1, 2).float()
+    out = q.new_empty(b, lq, q.size(2), v.size(-1), dtype=torch.float32)
+    for start in range(0, lq, ATTN_CHUNK_SIZE):
+        end = min(start + ATTN_CHUNK_SIZE, lq)
+        q_ = q[:, start:end].transpose(1, 2).float()  # B N c C
+        scores = torch.matmul(q_, k_.transpose(-1, -2)) * scale
+        if mask is not None:
+            scores.masked_fill_(~mask, float('-inf'))
+        if causal:
+            rows = torch.arange(start, end, device=q.device).unsqueeze(1)
+            scores.masked_fill_(torch.arange(lk, device=q.device).unsqueeze(0) > rows, float('-inf'))
+        out[:, start:end] = torch.matmul(scores.softmax(dim=-1), v_).transpose(1, 2)
+    if mask is not None:
+        out = _zero_empty_keys(out, k_lens)
+    return _zero_padded_queries(out, q_lens)
 
 
 def flash_attention(
@@ -55,40 +278,15 @@ def flash_attention(
     window_size:    (left right). If not (-1, -1), apply sliding window local attention.
     deterministic:  bool. If True, slightly slower and uses more memory.
     dtype:          torch.dtype. Apply when dtype of q/k/v is not float16/bfloat16.
-    """
-    half_dtypes = (torch.float16, torch.bfloat16)
-    assert dtype in half_dtypes
-    assert q.device.type == 'cuda' and q.size(-1) <= 256
-
-    # params
-    b, lq, lk, out_dtype = q.size(0), q.size(1), k.size(1), q.dtype
+    version:        3 / 2 to prefer FA3 / skip FA3, None = best available.
 
-    def half(x):
-        return x if x.dtype in half_dtypes else x.to(dtype)
-
-    # preprocess query
-    if q_lens is None:
-        q = half(q.flatten(0, 1))
-        q_lens = torch.tensor(
-            [lq] * b, dtype=torch.int32).to(
-                device=q.device, non_blocking=True)
-    else:
-        q = half(torch.cat([u[:v] for u, v in zip(q, q_lens)]))
-
-    # preprocess key, value
-    if k_lens is None:
-        k = half(k.flatten(0, 1))
-        v = half(v.flatten(0, 1))
-        k_lens = torch.tensor(
-            [lk] * b, dtype=torch.int32).to(
-                device=k.device, non_blocking=True)
-    else:
-        k = half(torch.cat([u[:v] for u, v in zip(k, k_lens)]))
-        v = half(torch.cat([u[:v] for u, v in zip(v, k_lens)]))
-
-    q = q.to(v.dtype)
-    k = k.to(v.dtype)
+    The backend is picked per call from ATTENTION_BACKENDS (device, dtype, shape, window) or forced with
+    OVI_ATTN_BACKEND. All backends honor k_lens (padding is never attended); the sdpa and chunked backends
+    return zeros for padded query rows and for samples with k_lens == 0.
+    """
+    assert dtype in HALF_DTYPES
 
+    out_dtype = q.dtype
     if q_scale is not None:
         q = q * q_scale
 
@@ -97,66 +295,15 @@ def flash_attention(
             'Flash attention 3 is not available, use flash attention 2 instead.'
         )
 
-    # apply attention
+    backend = select_attention_backend(q, k, v, window_size=window_size, dropout_p=dropout_p, version=version)
 
     global PRINTED_ATTN
     if DEBUG_ATTN and not PRINTED_ATTN:
-        backend = "FA3" if ((version is None or version == 3) and FLASH_ATTN_3_AVAILABLE) else ("FA2" if FLASH_ATTN_2_AVAILABLE else "SDPA")
-        print(f"[OVI][ATTN] backend={backend}  FA3={FLASH_ATTN_3_AVAILABLE}  FA2={FLASH_ATTN_2_AVAILABLE}  version={version}")
+        print(f"[OVI][ATTN] backend={backend.name}  FA3={FLASH_ATTN_3_AVAILABLE}  FA2={FLASH_ATTN_2_AVAILABLE}  version={version}")
         PRINTED_ATTN = True
 
-
-
-
-    
-    if (version is None or version == 3) and FLASH_ATTN_3_AVAILABLE:
-        # Note: dropout_p, window_size are not supported in FA3 now.
-        x = flash_attn_interface.flash_attn_varlen_func(
-            q=q,
-            k=k,
-            v=v,
-            cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            seqused_q=None,
-            seqused_k=None,
-            max_seqlen_q=lq,
-            max_seqlen_k=lk,
-            softmax_scale=softmax_scale,
-            causal=causal,
-            deterministic=deterministic)
-            
-        if isinstance(x, tuple):
-            x = x[0]
-        x = x.unflatten(0, (b, lq))
-        
-    else:
-        # Flash-Attn2 optional: SDPA fallback wenn nicht verfügbar
-        if FLASH_ATTN_2_AVAILABLE:
-            x = flash_attn.flash_attn_varlen_func(
-                q=q,
-                k=k,
-                v=v,
-                cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                    0, dtype=torch.int32).to(q.device, non_blocking=True),
-                cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                    0, dtype=torch.int32).to(q.device, non_blocking=True),
-                max_seqlen_q=lq,
-                max_seqlen_k=lk,
-                dropout_p=dropout_p,
-                softmax_scale=softmax_scale,
-                causal=causal,
-                window_size=window_size,
-                deterministic=deterministic).unflatten(0, (b, lq))
-        else:
-            import torch.nn.functional as F
-            # q/k/v: (b*l?, h, d) -> (b, h, l?, d) für SDPA
-            q_ = q.unflatten(0, (b, lq)).permute(0, 2, 1, 3)
-            k_ = k.unflatten(0, (b, lk)).permute(0, 2, 1, 3)
-            v_ = v.unflatten(0, (b, lk)).permute(0, 2, 1, 3)
-            x_ = F.scaled_dot_product_attention(q_, k_, v_, dropout_p=0.0, is_causal=causal)
-            x = x_.permute(0, 2, 1, 3)
+    x = backend.fn(q, k, v, q_lens, k_lens, dropout_p=dropout_p, softmax_scale=softmax_scale, causal=causal,
+                   window_size=window_size, deterministic=deterministic, dtype=dtype)
 
     # output
     return x.type(out_dtype)
@@ -288,35 +435,18 @@ def attention(
     dtype=torch.bfloat16,
     fa_version=None,
 ):
-    if FLASH_ATTN_2_AVAILABLE or FLASH_ATTN_3_AVAILABLE:
-        return flash_attention(
-            q=q,
-            k=k,
-            v=v,
-            q_lens=q_lens,
-            k_lens=k_lens,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            q_scale=q_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic,
-            dtype=dtype,
-            version=fa_version,
-        )
-    else:
-        if q_lens is not None or k_lens is not None:
-            warnings.warn(
-                'Padding mask is disabled when using scaled_dot_product_attention. It can have a significant impact on performance.'
-            )
-        attn_mask = None
-
-        q = q.transpose(1, 2).to(dtype)
-        k = k.transpose(1, 2).to(dtype)
-        v = v.transpose(1, 2).to(dtype)
-
-        out = torch.nn.functional.scaled_dot_product_attention(
-            q, k, v, attn_mask=attn_mask, is_causal=causal, dropout_p=dropout_p)
-
-        out = out.transpose(1, 2).contiguous()
-        return out
+    return flash_attention(
+        q=q,
+        k=k,
+        v=v,
+        q_lens=q_lens,
+        k_lens=k_lens,
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        q_scale=q_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic,
+        dtype=dtype,
+        version=fa_version,
+    )
@@ -1,11 +1,19 @@
 
+import contextlib
 import torch
 import torch.nn as nn
-from ovi.modules.model import WanLayerNorm, WanModel, WanRMSNorm, gradient_checkpointing, rope_apply
+from ovi.modules.model import WanLayerNorm, WanModel, WanRMSNorm, ffn_residual, gradient_checkpointing, rope_apply, timestep_table_lookup
 from ovi.modules.attention import flash_attention
+from ovi.modules.step_cache import StepCache
 from ovi.distributed_comms.communications import all_gather, all_to_all_4D
 from ovi.distributed_comms.parallel_states import nccl_info, get_sequence_parallel_state
 
+
+def _repeat_batch(x, k):
+    # per-sample tensor of the k shared-prefix samples -> both CFG branches; batch-1 tables broadcast as they are
+    return torch.cat([x, x]) if x is not None and x.size(0) == k else x
+
+
 class FusionModel(nn.Module):
     def __init__(self, video_config=None, audio_config=None):
         super().__init__()
@@ -35,6 +43,8 @@ class FusionModel(nn.Module):
                 self.sp_rank = nccl_info.rank_within_group
             self.inject_cross_attention_kv_projections()
 
+        self.step_cache = None
+        self.block_streamer = None  # ovi.utils.block_offload.BlockStreamer, streams block pairs to the GPU
         self.init_weights()
         
     def inject_cross_attention_kv_projections(self):
@@ -61,6 +71,7 @@ class FusionModel(nn.Module):
         freqs
         context
         context_lens
+        e_index
         """
         merged_kwargs = {}
         for key in vid_kwargs:
@@ -140,7 +151,8 @@ class FusionModel(nn.Module):
                                             target_freqs,
                                             context,
                                             context_lens,
-                                            src_e):
+                                            src_e,
+                                            src_e_index=None):
         
         src_seq = src_seq + self.single_fusion_cross_attention_forward(attn_block.cross_attn,
                                                                        attn_block.norm3(src_seq),
@@ -153,10 +165,8 @@ class FusionModel(nn.Module):
                                                                        context=context,
                                                                        context_lens=context_lens
                                                                        )
-        y = attn_block.ffn(attn_block.norm2(src_seq).bfloat16() * (1 + src_e[4].squeeze(2)) + src_e[3].squeeze(2))
-        with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            src_seq = src_seq + y * src_e[5].squeeze(2)
-        return src_seq
+        return ffn_residual(src_seq, attn_block.norm2, attn_block.ffn, src_e, src_e_index,
+                            chunk_size=attn_block.ffn_chunk_size)
         
     def single_fusion_block_forward(self,
                                     vid_block,
@@ -174,35 +184,101 @@ class FusionModel(nn.Module):
                                     audio_grid_sizes,
                                     audio_freqs,
                                     audio_context,
-                                    audio_context_lens
+                                    audio_context_lens,
+                                    vid_e_index=None,
+                                    audio_e_index=None
                                     ):
+        vid, audio, vid_e, audio_e = self.single_fusion_self_attention_forward(
+            vid_block, audio_block, vid, audio,
+            vid_e, vid_seq_lens, vid_grid_sizes, vid_freqs,
+            audio_e, audio_seq_lens, audio_grid_sizes, audio_freqs,
+            vid_e_index, audio_e_index
+        )
+        return self.single_fusion_cross_ffn_forward(
+            vid_block, audio_block, vid, audio,
+            vid_e, vid_seq_lens, vid_grid_sizes, vid_freqs, vid_context, vid_context_lens,
+            audio_e, audio_seq_lens, audio_grid_sizes, audio_freqs, audio_context, audio_context_lens,
+            vid_e_index, audio_e_index
+        )
+
+    def single_fusion_self_attention_forward(self,
+                                             vid_block,
+                                             audio_block,
+                                             vid,
+                                             audio,
+                                             vid_e,
+                                             vid_seq_lens,
+                                             vid_grid_sizes,
+                                             vid_freqs,
+                                             audio_e,
+                                             audio_seq_lens,
+                                             audio_grid_sizes,
+                                             audio_freqs,
+                                             vid_e_index=None,
+                                             audio_e_index=None
+                                             ):
+        """
+        Text-independent half of a fusion block: modulation + self-attention of both towers.
+        Returns the updated (vid, audio) and the 6 modulation chunks of each tower for the second half.
+        """
+        # *_e: [B, U, 6, C] per unique timestep, *_e_index: [B, L] token -> timestep row (None if U == 1)
         ## audio modulation
         assert audio_e.dtype == torch.bfloat16
-        assert len(audio_e.shape) == 4 and audio_e.size(2) == 6 and audio_e.shape[1] == audio.shape[1], f"{audio_e.shape}, {audio.shape}"
+        assert len(audio_e.shape) == 4 and audio_e.size(2) == 6, f"{audio_e.shape}"
+        assert audio_e_index is None or audio_e_index.shape[-1] == audio.shape[1], f"{audio_e_index.shape}, {audio.shape}"
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
             audio_e = audio_block.modulation(audio_e).chunk(6, dim=2)
         assert audio_e[0].dtype == torch.bfloat16
 
         # audio self-attention
         audio_y = audio_block.self_attn(
-            audio_block.norm1(audio).bfloat16() * (1 + audio_e[1].squeeze(2)) + audio_e[0].squeeze(2), audio_seq_lens, audio_grid_sizes,
+            audio_block.norm1(audio).bfloat16() * (1 + timestep_table_lookup(audio_e[1].squeeze(2), audio_e_index))
+            + timestep_table_lookup(audio_e[0].squeeze(2), audio_e_index), audio_seq_lens, audio_grid_sizes,
             audio_freqs)
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            audio = audio + audio_y * audio_e[2].squeeze(2)
+            audio = audio + audio_y * timestep_table_lookup(audio_e[2].squeeze(2), audio_e_index)
 
         ## video modulation
-        assert len(vid_e.shape) == 4 and vid_e.size(2) == 6 and vid_e.shape[1] == vid.shape[1], f"{vid_e.shape}, {vid.shape}"
+        assert len(vid_e.shape) == 4 and vid_e.size(2) == 6, f"{vid_e.shape}"
+        assert vid_e_index is None or vid_e_index.shape[-1] == vid.shape[1], f"{vid_e_index.shape}, {vid.shape}"
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
             vid_e = vid_block.modulation(vid_e).chunk(6, dim=2)
 
         # video self-attention
         vid_y = vid_block.self_attn(
-            vid_block.norm1(vid).bfloat16() * (1 + vid_e[1].squeeze(2)) + vid_e[0].squeeze(2), vid_seq_lens, vid_grid_sizes,
+            vid_block.norm1(vid).bfloat16() * (1 + timestep_table_lookup(vid_e[1].squeeze(2), vid_e_index))
+            + timestep_table_lookup(vid_e[0].squeeze(2), vid_e_index), vid_seq_lens, vid_grid_sizes,
             vid_freqs)
 
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            vid = vid + vid_y * vid_e[2].squeeze(2)
-
+            vid = vid + vid_y * timestep_table_lookup(vid_e[2].squeeze(2), vid_e_index)
+
+        return vid, audio, vid_e, audio_e
+
+    def single_fusion_cross_ffn_forward(self,
+                                        vid_block,
+                                        audio_block,
+                                        vid,
+                                        audio,
+                                        vid_e,
+                                        vid_seq_lens,
+                                        vid_grid_sizes,
+                                        vid_freqs,
+                                        vid_context,
+                                        vid_context_lens,
+                                        audio_e,
+                                        audio_seq_lens,
+                                        audio_grid_sizes,
+                                        audio_freqs,
+                                        audio_context,
+                                        audio_context_lens,
+                                        vid_e_index=None,
+                                        audio_e_index=None
+                                        ):
+        """
+        Second half of a fusion block: text + cross-modal attention and FFN of both towers.
+        vid_e / audio_e are the modulation chunks returned by single_fusion_self_attention_forward.
+        """
         og_audio = audio
 
         # audio cross-attention
@@ -217,7 +293,8 @@ class FusionModel(nn.Module):
             vid_freqs,
             audio_context,
             audio_context_lens,
-            audio_e
+            audio_e,
+            audio_e_index
         )
 
         assert not torch.equal(og_audio, audio), "Audio should be changed after cross-attention!"
@@ -234,7 +311,8 @@ class FusionModel(nn.Module):
             audio_freqs,
             vid_context,
             vid_context_lens,
-            vid_e
+            vid_e,
+            vid_e_index
         )
 
         return vid, audio
@@ -252,8 +330,28 @@ class FusionModel(nn.Module):
         clip_fea_audio=None,
         y=None,
         first_frame_is_clean=False,
-        slg_layer=False
+        slg_layer=False,
+        slg_indices=None,
+        cache_branch=None,
+        neg_vid_context=None,
+        neg_audio_context=None,
+        cfg_batch=True
     ):  
+        """
+        slg_indices: batch indices that get skip-layer guidance (block `slg_layer` is bypassed for them only).
+        None keeps the old behaviour of skipping the block for the whole batch. This lets the
+        conditional and unconditional CFG branches run as one batch of two.
+        cache_branch: name of the sampling branch (e.g. "pos", "neg", "cfg") under which this forward uses
+        the step cache, see `cached_steps`. Ignored when no step cache is active.
+
+        neg_vid_context / neg_audio_context: unconditional contexts for classifier-free guidance. Both branches
+        see the same latents and timestep, so the embeddings, time projection and the self-attention half of the
+        first fusion block are computed once; the branches split at the first text cross-attention. Returns
+        predictions for [conditional..., unconditional...] (2k for k latents) and applies skip-layer guidance to
+        the unconditional branch (slg_indices must be None). cfg_batch=True runs both branches as one batch of 2k,
+        False one after the other to save activation memory; cache_branch is then a (conditional, unconditional)
+        pair of step cache names.
+        """
 
         assert clip_fea is None 
         assert y is None
@@ -262,6 +360,7 @@ class FusionModel(nn.Module):
             assert vid_context is None
             assert vid_seq_len is None
             assert self.audio_model is not None
+            assert neg_audio_context is None
 
             return None, self.audio_model(x=audio, t=t, context=audio_context, seq_len=audio_seq_len, clip_fea=clip_fea_audio, y=None)
         
@@ -270,9 +369,18 @@ class FusionModel(nn.Module):
             assert audio_context is None
             assert audio_seq_len is None
             assert self.video_model is not None
+            assert neg_vid_context is None
 
             return self.video_model(x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean), None
-        
+
+        shared_cfg = neg_vid_context is not None
+        if shared_cfg:
+            assert neg_audio_context is not None and slg_indices is None
+            assert len(neg_vid_context) == len(vid_context) == len(neg_audio_context) == len(audio_context) == len(vid)
+            # one text embedding pass for both branches: contexts are [conditional..., unconditional...]
+            vid_context = list(vid_context) + list(neg_vid_context)
+            audio_context = list(audio_context) + list(neg_audio_context)
+
         vid, vid_e, vid_kwargs = self.video_model.prepare_transformer_block_kwargs(
             x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean
         )
@@ -283,26 +391,130 @@ class FusionModel(nn.Module):
 
         kwargs = self.merge_kwargs(vid_kwargs, audio_kwargs)
 
+        if not shared_cfg:
+            vid, audio = self._forward_blocks(vid, audio, kwargs, slg_layer, slg_indices, cache_branch)
+            vid = self.video_model.post_transformer_block_out(vid, kwargs['vid_grid_sizes'], vid_e, kwargs['vid_e_index'])
+            audio = self.audio_model.post_transformer_block_out(audio, kwargs['audio_grid_sizes'], audio_e, kwargs['audio_e_index'])
+            return vid, audio
+
+        # shared prefix: self-attention half of block 0 on the k latents
+        k = vid.size(0)
+        vid_block, audio_block = self.video_model.blocks[0], self.audio_model.blocks[0]
+        if self.block_streamer is not None:
+            self.block_streamer.fetch(0)
+        vid_sa, audio_sa, vid_mod, audio_mod = self.single_fusion_self_attention_forward(
+            vid_block, audio_block, vid, audio,
+            kwargs['vid_e'], kwargs['vid_seq_lens'], kwargs['vid_grid_sizes'], kwargs['vid_freqs'],
+            kwargs['audio_e'], kwargs['audio_seq_lens'], kwargs['audio_grid_sizes'], kwargs['audio_freqs'],
+            kwargs['vid_e_index'], kwargs['audio_e_index']
+        )
+
+        # branches split at the text cross-attention of block 0
+        # (kwargs, step cache name, slg_layer, slg_indices, block inputs/outputs + modulation, head time embeddings)
+        if cfg_batch:
+            branches = [(self._cfg_branch_kwargs(kwargs, k, None), cache_branch, slg_layer, list(range(k, 2 * k)),
+                         (torch.cat([vid, vid]), torch.cat([audio, audio]), torch.cat([vid_sa, vid_sa]), torch.cat([audio_sa, audio_sa]),
+                          tuple(_repeat_batch(m, k) for m in vid_mod), tuple(_repeat_batch(m, k) for m in audio_mod)),
+                         (_repeat_batch(vid_e, k), _repeat_batch(audio_e, k)))]
+        else:
+            pos_name, neg_name = cache_branch if cache_branch is not None else (None, None)
+            state = (vid, audio, vid_sa, audio_sa, vid_mod, audio_mod)
+            branches = [(self._cfg_branch_kwargs(kwargs, k, 0), pos_name, False, None, state, (vid_e, audio_e)),
+                        (self._cfg_branch_kwargs(kwargs, k, 1), neg_name, slg_layer, None, state, (vid_e, audio_e))]
+
+        # finish block 0 for every branch while it is resident, then run the rest of the stack per branch
+        firsts = []
+        for branch_kwargs, _, _, _, (vid_in, audio_in, v, a, v_mod, a_mod), _ in branches:
+            v, a = self.single_fusion_cross_ffn_forward(
+                vid_block, audio_block, v, a,
+                v_mod, branch_kwargs['vid_seq_lens'], branch_kwargs['vid_grid_sizes'], branch_kwargs['vid_freqs'],
+                branch_kwargs['vid_context'], branch_kwargs['vid_context_lens'],
+                a_mod, branch_kwargs['audio_seq_lens'], branch_kwargs['audio_grid_sizes'], branch_kwargs['audio_freqs'],
+                branch_kwargs['audio_context'], branch_kwargs['audio_context_lens'],
+                branch_kwargs['vid_e_index'], branch_kwargs['audio_e_index']
+            )
+            firsts.append((vid_in, audio_in, v, a))
+        if self.block_streamer is not None:
+            self.block_streamer.release(0)
+
+        vid_out, audio_out = [], []
+        for (branch_kwargs, name, branch_slg_layer, branch_slg_indices, _, (v_e, a_e)), first in zip(branches, firsts):
+            v, a = self._forward_blocks(first[0], first[1], branch_kwargs, branch_slg_layer, branch_slg_indices, name,
+                                        first_block_out=first)
+            vid_out += self.video_model.post_transformer_block_out(v, branch_kwargs['vid_grid_sizes'], v_e, branch_kwargs['vid_e_index'])
+            audio_out += self.audio_model.post_transformer_block_out(a, branch_kwargs['audio_grid_sizes'], a_e, branch_kwargs['audio_e_index'])
+
+        return vid_out, audio_out
+
+    def _cfg_branch_kwargs(self, kwargs, k, branch):
+        """
+        Block kwargs for the CFG branches from the shared-prefix kwargs, whose contexts hold
+        [conditional..., unconditional...]. branch=None: both branches as one batch of 2k, else 0 / 1.
+        """
+        out = {}
+        for key, value in kwargs.items():
+            is_context = key.endswith("_context") or key.endswith("_context_lens")
+            if branch is None:
+                out[key] = value if is_context or key.endswith("_freqs") else _repeat_batch(value, k)
+            elif is_context and value is not None:
+                out[key] = value[branch * k:(branch + 1) * k]
+            else:
+                out[key] = value
+        return out
+
+    def _forward_blocks(self, vid, audio, kwargs, slg_layer=False, slg_indices=None, cache_branch=None, first_block_out=None):
+        """
+        Runs the fusion blocks on prepared tokens. first_block_out=(vid_in, audio_in, vid, audio) hands over an
+        already computed block 0 (shared CFG prefix); the loop then continues with block 1.
+        """
+        slg_mask = None
+        if slg_layer > 0 and slg_indices is not None and len(slg_indices) < vid.size(0):
+            slg_mask = torch.zeros(vid.size(0), 1, 1, dtype=torch.bool, device=vid.device)
+            slg_mask[list(slg_indices)] = True
+
+        step_cache = self.step_cache if cache_branch is not None else None
+        cached = None
+
         for i in range(self.num_blocks):
             """
             1 fusion block refers to 1 audio block with 1 video block.
             """
-            if slg_layer > 0 and i == slg_layer:
+            if slg_layer > 0 and i == slg_layer and slg_mask is None:
                 continue
-            vid_block = self.video_model.blocks[i]
-            audio_block = self.audio_model.blocks[i]
-            vid, audio = gradient_checkpointing(
-                    enabled=(self.training and self.gradient_checkpointing),
-                    module=self.single_fusion_block_forward,
-                    vid_block=vid_block,
-                    audio_block=audio_block,
-                    vid=vid,
-                    audio=audio,
-                    **kwargs
-                )
-
-        vid = self.video_model.post_transformer_block_out(vid, vid_kwargs['grid_sizes'], vid_e)
-        audio = self.audio_model.post_transformer_block_out(audio, audio_kwargs['grid_sizes'], audio_e)
+            if i == 0 and first_block_out is not None:
+                vid_in, audio_in, vid, audio = first_block_out
+            else:
+                vid_block = self.video_model.blocks[i]
+                audio_block = self.audio_model.blocks[i]
+                if self.block_streamer is not None:
+                    self.block_streamer.fetch(i)
+                vid_in, audio_in = vid, audio
+                vid, audio = gradient_checkpointing(
+                        enabled=(self.training and self.gradient_checkpointing),
+                        module=self.single_fusion_block_forward,
+                        vid_block=vid_block,
+                        audio_block=audio_block,
+                        vid=vid,
+                        audio=audio,
+                        **kwargs
+                    )
+                if self.block_streamer is not None:
+                    self.block_streamer.release(i)
+            if slg_mask is not None and i == slg_layer:
+                # skip-layer guidance for the selected samples only: drop this block's update
+                vid = torch.where(slg_mask, vid_in, vid)
+                audio = torch.where(slg_mask, audio_in, audio)
+            if step_cache is not None and i == 0:
+                # little change in the first block since the last full step -> reuse the rest of the stack
+                first_residuals = (vid - vid_in, audio - audio_in)
+                cached = step_cache.lookup(cache_branch, first_residuals, reduce_fn=self._sp_max if self.use_sp else None)
+                if cached is not None:
+                    vid, audio = vid + cached[0], audio + cached[1]
+                    break
+                vid_first, audio_first = vid, audio
+
+        if step_cache is not None and cached is None:
+            step_cache.store(cache_branch, first_residuals, (vid - vid_first, audio - audio_first))
 
         return vid, audio
 
@@ -318,7 +530,34 @@ class FusionModel(nn.Module):
                 with torch.no_grad():
                     mod.weight.div_(10.0)
 
-    
+
+    def set_ffn_chunk_size(self, chunk_size):
+        for m in (self.video_model, self.audio_model):
+            if m is not None:
+                m.set_ffn_chunk_size(chunk_size)
+
+    def _sp_max(self, x):
+        # every rank only sees its sequence shard, the skip decision has to be the same everywhere
+        return all_gather(x.reshape(1), dim=0).max()
+
+    @contextlib.contextmanager
+    def cached_steps(self, threshold, warmup_steps=2):
+        """Skip blocks 1..N on steps whose first-block residual barely changed, see StepCache."""
+        self.step_cache = StepCache(threshold, warmup_steps=warmup_steps)
+        try:
+            yield self.step_cache
+        finally:
+            self.step_cache = None
+
+    @contextlib.contextmanager
+    def cached_context(self):
+        """Per-generation text context cache for both towers, see WanModel.cached_context."""
+        with contextlib.ExitStack() as stack:
+            for m in (self.video_model, self.audio_model):
+                if m is not None:
+                    stack.enter_context(m.cached_context())
+            yield
+
     def set_rope_params(self):
         self.video_model.set_rope_params()
         self.audio_model.set_rope_params()
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Runtime LoRA adapters for FusionModel.
+
+Adapters target the attention (self_attn / cross_attn incl. k_img, v_img, k_fusion, v_fusion) and FFN
+linears of both towers' blocks. They are applied either through forward hooks (x @ A^T @ B^T added to the
+base output, switchable between jobs without touching the base weights) or merged into the bf16 base
+weights (no per-step overhead; switching restores the touched weights from the base checkpoint).
+"""
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from safetensors import safe_open
+from safetensors.torch import load_file
+
+from ovi.modules.quant import QuantLinear
+
+__all__ = [
+    'LoRAManager',
+    'resolve_lora_spec',
+]
+
+# linears an adapter may target, matched against the FusionModel module name
+LORA_TARGET_RE = re.compile(
+    r"\.blocks\.\d+\.(self_attn\.(q|k|v|o)|cross_attn\.(q|k|v|o|k_img|v_img|k_fusion|v_fusion)|ffn\.(0|2))$")
+
+# prefixes added by common trainers / converters in front of the FusionModel module names
+_KEY_PREFIXES = ("model.diffusion_model.", "diffusion_model.", "base_model.model.", "transformer.", "model.")
+_DOWN_SUFFIXES = (".lora_A.weight", ".lora_down.weight")
+_UP_SUFFIXES = (".lora_B.weight", ".lora_up.weight")
+
+
+def resolve_lora_spec(spec, lora_dir):
+    """
+    Run config `lora` -> [(path, scale), ...].
+    spec: None | "name" | {"name": ..., "scale": ...} | list of those. Names without a directory are looked up in
+    lora_dir, ".safetensors" is appended when missing.
+    """
+    if not spec:
+        return []
+    if isinstance(spec, (str, Mapping)):
+        spec = [spec]
+    out = []
+    for entry in spec:
+        if isinstance(entry, Mapping):
+            name, scale = entry["name"], float(entry.get("scale", 1.0))
+        else:
+            name, scale = str(entry), 1.0
+        path = name if os.path.isabs(name) else os.path.join(lora_dir, name)
+        if not path.endswith(".safetensors"):
+            path += ".safetensors"
+        out.append((path, scale))
+    return out
+
+
+def _lora_forward_hook(module, inputs, output):
+    x = inputs[0]
+    for down, up, scale in module._lora_layers:
+        output = output + (F.linear(F.linear(x.to(down.dtype), down), up) * scale).to(output.dtype)
+    return output
+
+
+class LoRAManager:
+    """
+    Loads, caches and applies LoRA adapters on a FusionModel.
+
+    set_adapters(spec, merge) is called per job; it is a no-op when the adapters and mode did not change.
+    Loaded adapters are kept on `device` in an LRU of `max_cached` files (keyed by path + mtime).
+    """
+
+    def __init__(self, model, device, max_cached=4, base_checkpoint=None, dtype=torch.bfloat16):
+        self.model = model
+        self.device = torch.device("cuda", device) if isinstance(device, int) else torch.device(device)
+        self.max_cached = max_cached
+        self.base_checkpoint = base_checkpoint
+        self.dtype = dtype
+        self.targets = {name: m for name, m in model.named_modules()
+                        if isinstance(m, (nn.Linear, QuantLinear)) and LORA_TARGET_RE.search(f".{name}")}
+        self._cache = OrderedDict()
+        self._hooks = []
+        self._hooked = []
+        self._merged = []
+        self._state = ((), False)
+
+    def load(self, path):
+        """{module name: (down [r, in], up [out, r], alpha / r)} for the adapter file, LRU cached."""
+        key = (os.path.realpath(path), os.stat(path).st_mtime_ns)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        sd = load_file(path, device="cpu")
+        layers, unknown = {}, []
+        for k, down in sd.items():
+            suffix = next((s for s in _DOWN_SUFFIXES if k.endswith(s)), None)
+            if suffix is None:
+                continue
+            base = k[:-len(suffix)]
+            up = sd[base + _UP_SUFFIXES[_DOWN_SUFFIXES.index(suffix)]]
+            name = base
+            for prefix in _KEY_PREFIXES:
+                if name.startswith(prefix) and name not in self.targets:
+                    name = name[len(prefix):]
+            if name not in self.targets:
+                unknown.append(base)
+                continue
+            target = self.targets[name]
+            rank = down.shape[0]
+            assert down.shape == (rank, target.in_features) and up.shape == (target.out_features, rank), \
+                f"{path}: {base} has shapes {tuple(down.shape)} / {tuple(up.shape)}, expected (r, {target.in_features}) / ({target.out_features}, r)"
+            alpha = sd.get(base + ".alpha")
+            factor = float(alpha) / rank if alpha is not None else 1.0
+            layers[name] = (down.to(self.device, self.dtype), up.to(self.device, self.dtype), factor)
+        if unknown or not layers:
+            raise ValueError(f"{path}: {len(unknown)} LoRA layers do not match FusionModel linears "
+                             f"(e.g. {unknown[:3]}), {len(layers)} matched")
+
+        self._cache[key] = layers
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return layers
+
+    def set_adapters(self, spec, merge=False):
+        """spec: [(path, scale), ...] from resolve_lora_spec, empty removes all adapters."""
+        # file mtimes are part of the state: an adapter rewritten on disk gets reloaded
+        state = (tuple((path, scale, os.stat(path).st_mtime_ns) for path, scale in spec), bool(merge) and bool(spec))
+        if state == self._state:
+            return
+        t0 = time.perf_counter()
+        weights_changed = bool(self._merged)
+        self._clear()
+        if spec:
+            adapters = [(self.load(path), scale) for path, scale in spec]
+            if merge:
+                self._merge(adapters)
+                weights_changed = True
+            else:
+                self._attach(adapters)
+        streamer = getattr(self.model, "block_streamer", None)
+        if weights_changed and streamer is not None:
+            # device copies of blocks still resident from the last generation predate the merge / restore
+            streamer.reset()
+        self._state = state
+        logging.info(f"LoRA: {[f'{os.path.basename(p)}@{s}' for p, s in spec] or 'none'} "
+                     f"({'merged' if state[1] else 'runtime'}) in {time.perf_counter() - t0:.2f}s")
+
+    def _attach(self, adapters):
+        per_module = {}
+        for layers, scale in adapters:
+            for name, (down, up, factor) in layers.items():
+                per_module.setdefault(name, []).append((down, up, scale * factor))
+        for name, lora_layers in per_module.items():
+            module = self.targets[name]
+            module._lora_layers = lora_layers
+            self._hooks.append(module.register_forward_hook(_lora_forward_hook))
+            self._hooked.append(module)
+
+    @torch.no_grad()
+    def _merge(self, adapters):
+        assert self.base_checkpoint is not None, "Merging needs the base checkpoint to restore the weights afterwards."
+        names = sorted({name for layers, _ in adapters for name in layers})
+        for name in names:
+            module = self.targets[name]
+            if type(module) is not nn.Linear or module.weight.dtype not in (torch.bfloat16, torch.float16, torch.float32):
+                raise ValueError(f"LoRA merge needs plain bf16/fp16/fp32 linears, {name} is {type(module).__name__} "
+                                 f"with {module.weight.dtype}; use lora_merge: False")
+        for name in names:
+            w = self.model.get_submodule(name).weight
+            delta = 0
+            for layers, scale in adapters:
+                if name in layers:
+                    down, up, factor = layers[name]
+                    delta = delta + (up.float() @ down.float()) * (scale * factor)
+            # in place, so the host copies a BlockStreamer streams from see the merged weights too
+            w.data.copy_((w.data.float() + delta.to(w.device)).to(w.dtype))
+            self._merged.append(name)
+
+    @torch.no_grad()
+    def _clear(self):
+        for h in self._hooks:
+            h.remove()
+        for module in self._hooked:
+            del module._lora_layers
+        self._hooks, self._hooked = [], []
+
+        if self._merged:
+            # exact restore of the touched base weights, only those tensors are read from the checkpoint
+            with safe_open(self.base_checkpoint, framework="pt", device="cpu") as f:
+                for name in self._merged:
+                    w = self.model.get_submodule(name).weight
+                    w.data.copy_(f.get_tensor(f"{name}.weight").to(w.dtype))
+            self._merged = []
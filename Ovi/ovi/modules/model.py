@@ -1,5 +1,8 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import contextlib
 import math
+import os
+from collections import OrderedDict
 
 import torch
 import torch.amp as amp
@@ -21,6 +24,83 @@ def gradient_checkpointing(module: nn.Module, *args, enabled: bool, **kwargs):
         return module(*args, **kwargs)
 
 
+class ContextCache:
+    r"""
+    Step-invariant text context work of one generation: the `text_embedding` output per context list and
+    the cross-attention K/V per (block, context). Entries are keyed by tensor identity (data_ptr + shape)
+    and keep their source tensors alive, so a new prompt always misses. Use one cache per generation,
+    see `WanModel.cached_context`.
+    """
+
+    def __init__(self):
+        self._store = {}
+
+    @staticmethod
+    def tensor_key(tensors):
+        return tuple((u.data_ptr(), tuple(u.shape)) for u in tensors)
+
+    def get(self, key, fn, refs):
+        hit = self._store.get(key)
+        if hit is None:
+            hit = self._store[key] = (fn(), refs)
+        return hit[0]
+
+    def __len__(self):
+        return len(self._store)
+
+
+def timestep_table_lookup(table, index):
+    r"""
+    Per-token view of a per-timestep table.
+
+    Args:
+        table(Tensor): Shape [B, U, ...], one entry per unique timestep (B may be 1)
+        index(Tensor): Shape [B, L], position of each token's timestep in `table`, or None when U == 1
+
+    Returns [B, L, ...], or `table` itself when index is None (broadcasts over L).
+    """
+    if index is None:
+        return table
+    batch = torch.arange(table.size(0), device=index.device).unsqueeze(1)
+    return table[batch, index]
+
+
+def ffn_residual(x, norm, ffn, e, e_index=None, chunk_size=0):
+    r"""
+    x + ffn(norm(x) * (1 + e[4]) + e[3]) * e[5], the modulated FFN half of a block.
+
+    Args:
+        e(tuple): the 6 modulation chunks [B, U, 1, C] per unique timestep
+        e_index(Tensor): token -> timestep index [B, L] or None, see timestep_table_lookup
+        chunk_size(int): > 0 runs norm / modulation / FFN / residual on `chunk_size` tokens at a time, so the
+            [B, L, ffn_dim] hidden activation only exists for one chunk. Without autograd (inference) the result
+            is added into x in place; with autograd enabled (training / gradient checkpointing recompute) the
+            chunks are summed out of place and concatenated. Norm, modulation and FFN are per token, the result
+            is the same as the unchunked path.
+    """
+    if not chunk_size or x.size(1) <= chunk_size:
+        y = ffn(norm(x).bfloat16() * (1 + timestep_table_lookup(e[4].squeeze(2), e_index))
+                + timestep_table_lookup(e[3].squeeze(2), e_index))
+        with amp.autocast('cuda', dtype=torch.bfloat16):
+            return x + y * timestep_table_lookup(e[5].squeeze(2), e_index)
+
+    inplace = not torch.is_grad_enabled()
+    out = []
+    for start in range(0, x.size(1), chunk_size):
+        sl = slice(start, start + chunk_size)
+        idx = e_index[:, sl] if e_index is not None else None
+        x_c = x[:, sl]
+        y = ffn(norm(x_c).bfloat16() * (1 + timestep_table_lookup(e[4].squeeze(2), idx))
+                + timestep_table_lookup(e[3].squeeze(2), idx))
+        with amp.autocast('cuda', dtype=torch.bfloat16):
+            y = y * timestep_table_lookup(e[5].squeeze(2), idx)
+            if inplace:
+                x_c.add_(y)
+            else:
+                out.append(x_c + y)
+    return x if inplace else torch.cat(out, dim=1)
+
+
 def sinusoidal_embedding_1d(dim, position):
     # preprocess
     assert dim % 2 == 0
@@ -44,6 +124,20 @@ def rope_params(max_seq_len, dim, theta=10000, freqs_scaling=1.0):
     freqs = torch.polar(torch.ones_like(freqs), freqs)
     return freqs
 
+
+def video_rope_freqs(d):
+    # per-head frequencies of the video tower: temporal, height and width parts of the 3D grid
+    return torch.cat([
+        rope_params(1024, d - 4 * (d // 6)),
+        rope_params(1024, 2 * (d // 6)),
+        rope_params(1024, 2 * (d // 6))
+    ], dim=1)
+
+
+def audio_rope_freqs(d, freqs_scaling=1.0):
+    # per-head frequencies of the audio tower: 1D positions only
+    return rope_params(1024, d - 4 * (d // 6), freqs_scaling=freqs_scaling)
+
 @amp.autocast('cuda', enabled=False)
 def rope_apply_1d(x, grid_sizes, freqs):
     n, c = x.size(2), x.size(3) // 2 ## b l h d
@@ -100,13 +194,88 @@ def rope_apply_3d(x, grid_sizes, freqs):
     return torch.stack(output).bfloat16()
 
 @amp.autocast('cuda', enabled=False)
-def rope_apply(x, grid_sizes, freqs):
+def rope_apply_complex(x, grid_sizes, freqs):
+    # reference implementation: per sample, float64 complex multiply
     x_ndim = grid_sizes.shape[-1]
     if x_ndim == 3:
         return rope_apply_3d(x, grid_sizes, freqs)
     else:
         return rope_apply_1d(x, grid_sizes, freqs)
 
+
+# real (fp32 cos/sin, default) | real_bf16 | complex (float64 reference path above)
+ROPE_IMPL = os.environ.get("OVI_ROPE_IMPL", "real")
+_ROPE_TABLES = OrderedDict()
+_ROPE_TABLES_MAX = 64
+
+
+@amp.autocast('cuda', enabled=False)
+def rope_table(grid, seq_len, freqs, c, dtype=torch.float32):
+    """
+    cos / sin tables of shape [seq_len, 1, c] for one grid, (F, H, W) or (L,). Tokens past the grid and
+    rotary dims not covered by `freqs` get the identity rotation (cos 1, sin 0), so they pass through.
+    Cached per (freqs, grid, seq_len, dtype); the entry keeps `freqs` alive so its data_ptr stays unique.
+    """
+    key = (freqs.data_ptr(), tuple(freqs.shape), grid, seq_len, c, dtype)
+    hit = _ROPE_TABLES.get(key)
+    if hit is not None:
+        _ROPE_TABLES.move_to_end(key)
+        return hit[0], hit[1]
+
+    if len(grid) == 3:
+        f, h, w = grid
+        split = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+        angles = torch.cat([
+            split[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
+            split[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+            split[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
+        ],
+                           dim=-1).reshape(f * h * w, -1)
+    else:
+        angles = freqs[:grid[0]]  # [l, c_rope], c_rope <= c
+    n_tok, c_rope = angles.shape
+
+    cos = torch.ones(seq_len, c, dtype=torch.float64, device=freqs.device)
+    sin = torch.zeros(seq_len, c, dtype=torch.float64, device=freqs.device)
+    cos[:n_tok, :c_rope] = angles.real
+    sin[:n_tok, :c_rope] = angles.imag
+    cos, sin = cos.to(dtype).unsqueeze(1), sin.to(dtype).unsqueeze(1)
+
+    _ROPE_TABLES[key] = (cos, sin, freqs)
+    while len(_ROPE_TABLES) > _ROPE_TABLES_MAX:
+        _ROPE_TABLES.popitem(last=False)
+    return cos, sin
+
+
+@amp.autocast('cuda', enabled=False)
+def rope_apply_real(x, grid_sizes, freqs, dtype=torch.float32):
+    """
+    Same rotation as rope_apply_complex on interleaved (real, imag) pairs, as one batched elementwise op
+    with cached cos/sin tables. x: [B, L, N, D], returns bfloat16.
+    """
+    b, seq_len, n, d = x.shape
+    c = d // 2
+    grids = [tuple(g) for g in grid_sizes.tolist()]
+    if all(g == grids[0] for g in grids):
+        # batches are grouped by shape, so this is the normal case: one table broadcast over the batch
+        cos, sin = rope_table(grids[0], seq_len, freqs, c, dtype)
+        cos, sin = cos.unsqueeze(0), sin.unsqueeze(0)
+    else:
+        tables = [rope_table(g, seq_len, freqs, c, dtype) for g in grids]
+        cos, sin = torch.stack([t[0] for t in tables]), torch.stack([t[1] for t in tables])
+
+    x = x.to(dtype).reshape(b, seq_len, n, c, 2)
+    x_re, x_im = x[..., 0], x[..., 1]
+    x = torch.stack([x_re * cos - x_im * sin, x_re * sin + x_im * cos], dim=-1).flatten(3)
+    return x.bfloat16()
+
+
+@amp.autocast('cuda', enabled=False)
+def rope_apply(x, grid_sizes, freqs):
+    if ROPE_IMPL == "complex":
+        return rope_apply_complex(x, grid_sizes, freqs)
+    return rope_apply_real(x, grid_sizes, freqs, dtype=torch.bfloat16 if ROPE_IMPL == "real_bf16" else torch.float32)
+
 class ChannelLastConv1d(nn.Conv1d):
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
@@ -266,13 +435,24 @@ class WanSelfAttention(nn.Module):
 
 
 class WanT2VCrossAttention(WanSelfAttention):
+    context_cache = None  # set by WanModel.cached_context
+
+    def context_kv(self, context):
+        b, n, d = context.size(0), self.num_heads, self.head_dim
+
+        def kv():
+            return self.norm_k(self.k(context)).view(b, -1, n, d), self.v(context).view(b, -1, n, d)
+
+        if self.context_cache is None:
+            return kv()
+        return self.context_cache.get(("kv", id(self)) + ContextCache.tensor_key([context]), kv, context)
+
     def qkv_fn(self, x, context):
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        k, v = self.context_kv(context)
 
         return q, k, v
 
@@ -295,6 +475,7 @@ class WanT2VCrossAttention(WanSelfAttention):
 
 
 class WanI2VCrossAttention(WanSelfAttention):
+    context_cache = None  # set by WanModel.cached_context
 
     def __init__(self,
                  dim,
@@ -311,17 +492,28 @@ class WanI2VCrossAttention(WanSelfAttention):
         self.norm_k_img = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.additional_emb_length = additional_emb_length
 
+    def context_kv(self, full_context):
+        b, n, d = full_context.size(0), self.num_heads, self.head_dim
+
+        def kv():
+            context_img = full_context[:, : self.additional_emb_length]
+            context = full_context[:, self.additional_emb_length :]
+            k = self.norm_k(self.k(context)).view(b, -1, n, d)
+            v = self.v(context).view(b, -1, n, d)
+            k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
+            v_img = self.v_img(context_img).view(b, -1, n, d)
+            return k, v, k_img, v_img
+
+        if self.context_cache is None:
+            return kv()
+        return self.context_cache.get(("kv", id(self)) + ContextCache.tensor_key([full_context]), kv, full_context)
+
     def qkv_fn(self, x, context):
-        context_img = context[:, : self.additional_emb_length]
-        context = context[:, self.additional_emb_length :]
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
-        k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
-        v_img = self.v_img(context_img).view(b, -1, n, d)
+        k, v, k_img, v_img = self.context_kv(context)
 
         return q, k, v, k_img, v_img
 
@@ -425,6 +617,7 @@ class WanAttentionBlock(nn.Module):
         # self.modulation = nn.Parameter(torch.randn(1, 6, dim) / dim**0.5)
         # self.modulation = nn.Parameter(torch.randn(1, 6, dim) / dim**0.5)
         self.modulation = ModulationAdd(dim, 6)
+        self.ffn_chunk_size = 0  # see ffn_residual / WanModel.set_ffn_chunk_size
 
 
     def forward(
@@ -436,36 +629,39 @@ class WanAttentionBlock(nn.Module):
         freqs,
         context,
         context_lens,
+        e_index=None,
     ):
         r"""
         Args:
             x(Tensor): Shape [B, L, C]
-            e(Tensor): Shape [B, L1, 6, C]
+            e(Tensor): Shape [B, U, 6, C], time conditioning per unique timestep
             seq_lens(Tensor): Shape [B], length of each sequence in batch
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
             freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            e_index(Tensor): Shape [B, L], timestep of each token as index into e, None if U == 1
         """
         assert e.dtype == torch.bfloat16
-        assert len(e.shape) == 4 and e.size(2) == 6 and e.shape[1] == x.shape[1], f"{e.shape}, {x.shape}"
+        assert len(e.shape) == 4 and e.size(2) == 6, f"{e.shape}"
+        assert e_index is None or e_index.shape[-1] == x.shape[1], f"{e_index.shape}, {x.shape}"
         with amp.autocast('cuda', dtype=torch.bfloat16):
             e = self.modulation(e).chunk(6, dim=2)
         assert e[0].dtype == torch.bfloat16
 
+        def mod(i):
+            # modulation term i per token, only materialized for the op that uses it
+            return timestep_table_lookup(e[i].squeeze(2), e_index)
+
         # self-attention
         y = self.self_attn(
-            self.norm1(x).bfloat16() * (1 + e[1].squeeze(2)) + e[0].squeeze(2),
+            self.norm1(x).bfloat16() * (1 + mod(1)) + mod(0),
             seq_lens, grid_sizes, freqs)
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            x = x + y * e[2].squeeze(2)
+            x = x + y * mod(2)
 
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
             x = x + self.cross_attn(self.norm3(x), context, context_lens)
-            y = self.ffn(
-                self.norm2(x).bfloat16() * (1 + e[4].squeeze(2)) + e[3].squeeze(2))
-            with amp.autocast('cuda', dtype=torch.bfloat16):
-                x = x + y * e[5].squeeze(2)
-            return x
+            return ffn_residual(x, self.norm2, self.ffn, e, e_index, chunk_size=self.ffn_chunk_size)
 
         x = cross_attn_ffn(x, context, context_lens, e)
         return x
@@ -488,16 +684,18 @@ class Head(nn.Module):
         # modulation
         self.modulation = nn.Parameter(torch.randn(1, 2, dim) / dim**0.5)
 
-    def forward(self, x, e):
+    def forward(self, x, e, e_index=None):
         r"""
         Args:
             x(Tensor): Shape [B, L1, C]
-            e(Tensor): Shape [B, L, C]
+            e(Tensor): Shape [B, U, C], per unique timestep
+            e_index(Tensor): Shape [B, L1] index into e per token, None if U == 1
         """
         assert e.dtype == torch.bfloat16
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            e = (self.modulation.bfloat16().unsqueeze(0) + e.unsqueeze(2)).chunk(2, dim=2) # 1 1 2 D, B L 1 D -> B L 2 D -> 2 * (B L 1 D)
-            x = (self.head(self.norm(x) * (1 + e[1].squeeze(2)) + e[0].squeeze(2)))
+            e = (self.modulation.bfloat16().unsqueeze(0) + e.unsqueeze(2)).chunk(2, dim=2) # 1 1 2 D, B U 1 D -> B U 2 D -> 2 * (B U 1 D)
+            shift, scale = (timestep_table_lookup(u.squeeze(2), e_index) for u in e)
+            x = (self.head(self.norm(x) * (1 + scale) + shift))
         return x
 
 
@@ -665,6 +863,29 @@ class WanModel(ModelMixin, ConfigMixin):
         self.init_weights()
 
         self.gradient_checkpointing = False
+        self.context_cache = None
+
+    def set_ffn_chunk_size(self, chunk_size):
+        """Tokens per FFN chunk in every block, 0 = whole sequence at once."""
+        for block in self.blocks:
+            block.ffn_chunk_size = int(chunk_size or 0)
+
+    def set_context_cache(self, cache):
+        self.context_cache = cache
+        for block in self.blocks:
+            block.cross_attn.context_cache = cache
+
+    @contextlib.contextmanager
+    def cached_context(self):
+        """
+        Reuse the text embedding and per-block cross-attention K/V across the forwards inside this block
+        (the denoising steps of one generation). Prompts must not change while it is active.
+        """
+        self.set_context_cache(ContextCache())
+        try:
+            yield self.context_cache
+        finally:
+            self.set_context_cache(None)
 
     def set_rope_params(self):
         # buffers (don't use register_buffer otherwise dtype will be changed in to())
@@ -676,14 +897,9 @@ class WanModel(ModelMixin, ConfigMixin):
         if self.is_audio_type:
             ## to be determined
             # self.freqs = rope_params(1024, d, freqs_scaling=temporal_rope_scaling_factor)
-            self.freqs = rope_params(1024, d - 4 * (d // 6), freqs_scaling=self.temporal_rope_scaling_factor)
+            self.freqs = audio_rope_freqs(d, freqs_scaling=self.temporal_rope_scaling_factor)
         else:
-            self.freqs = torch.cat([
-                rope_params(1024, d - 4 * (d // 6)),
-                rope_params(1024, 2 * (d // 6)),
-                rope_params(1024, 2 * (d // 6))
-            ],
-                                dim=1)
+            self.freqs = video_rope_freqs(d)
 
 
     def set_gradient_checkpointing(self, enable: bool):
@@ -730,23 +946,29 @@ class WanModel(ModelMixin, ConfigMixin):
                       dim=1) for u in x
         ]) # single [B, L, C]
 
-        # time embeddings
+        # time embeddings: only the distinct timesteps are embedded, t_index maps every token to its row
+        t_index = None
         if t.dim() == 1:
             if first_frame_is_clean:
-                t = torch.ones((t.size(0), seq_len), device=t.device, dtype=t.dtype) * t.unsqueeze(1)
-                _first_images_seq_len = grid_sizes[:, 1:].prod(-1)
-                for i in range(t.size(0)):
-                    t[i, :_first_images_seq_len[i]] = 0
-                # print(f"zeroing out first {_first_images_seq_len} from t: {t.shape}, {t}")
+                # two timesteps per sample: 0 for the clean first frame, t for everything else
+                _first_images_seq_len = grid_sizes[:t.size(0), 1:].prod(-1).to(t.device)
+                t_index = (torch.arange(seq_len, device=t.device).unsqueeze(0) >= _first_images_seq_len.unsqueeze(1)).long()
+                t = torch.stack([torch.zeros_like(t), t], dim=1) # [B, 2]
             else:
-                t = t.unsqueeze(1).expand(t.size(0), seq_len)
+                t = t.unsqueeze(1) # [B, 1]
+        else:
+            # explicit per-token timesteps [B, seq_len]
+            t, t_index = torch.unique(t, return_inverse=True)
+            t = t.unsqueeze(0) # [1, U]
+            if t.size(1) == 1:
+                t_index = None
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            bt = t.size(0)
+            bt, nt = t.shape
             t = t.flatten()
             e = self.time_embedding(
                 sinusoidal_embedding_1d(self.freq_dim,
-                                        t).unflatten(0, (bt, seq_len)).bfloat16())
-            e0 = self.time_projection(e).unflatten(2, (6, self.dim)) # [1, 26784, 6, 3072] - B, seq_len, 6, dim
+                                        t).unflatten(0, (bt, nt)).bfloat16())
+            e0 = self.time_projection(e).unflatten(2, (6, self.dim)) # [1, 2, 6, 3072] - B, unique timesteps, 6, dim
             assert e.dtype == torch.bfloat16 and e0.dtype == torch.bfloat16
 
         
@@ -762,31 +984,30 @@ class WanModel(ModelMixin, ConfigMixin):
                     dtype=x.dtype
                 )
                 x = torch.cat([x, padding], dim=1)
-                e_padding = torch.zeros(
-                    e.shape[0], pad_size, e.shape[2],
-                    device=e.device,
-                    dtype=e.dtype
-                )
-                e = torch.cat([e, e_padding], dim=1)
-                e0_padding = torch.zeros(
-                    e0.shape[0], pad_size, e0.shape[2], e0.shape[3],
-                    device=e0.device,
-                    dtype=e0.dtype
-                )
-                e0 = torch.cat([e0, e0_padding], dim=1)
+                if t_index is not None:
+                    # padded tokens are masked out of attention, any table row will do
+                    t_index = torch.cat([t_index, t_index.new_zeros(t_index.shape[0], pad_size)], dim=1)
 
+            # e / e0 are per timestep, not per token: only x and the token index get sharded
             x = torch.chunk(x, self.sp_size, dim=1)[self.sp_rank]
-            e = torch.chunk(e, self.sp_size, dim=1)[self.sp_rank]
-            e0 = torch.chunk(e0, self.sp_size, dim=1)[self.sp_rank] 
+            if t_index is not None:
+                t_index = torch.chunk(t_index, self.sp_size, dim=1)[self.sp_rank]
             
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
+
+        def embed_text():
+            return self.text_embedding(
+                torch.stack([
+                    torch.cat(
+                        [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
+                    for u in context
+                ]))
+
+        if self.context_cache is None:
+            context = embed_text()
+        else:
+            context = self.context_cache.get(("text", id(self)) + ContextCache.tensor_key(context), embed_text, tuple(context))
 
         if clip_fea is not None:
             context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
@@ -799,13 +1020,14 @@ class WanModel(ModelMixin, ConfigMixin):
             grid_sizes=grid_sizes,
             freqs=self.freqs,
             context=context,
-            context_lens=context_lens)
+            context_lens=context_lens,
+            e_index=t_index)
 
         return x, e, kwargs
         
-    def post_transformer_block_out(self, x, grid_sizes, e):
+    def post_transformer_block_out(self, x, grid_sizes, e, e_index=None):
         # head
-        x = self.head(x, e)
+        x = self.head(x, e, e_index)
         if self.use_sp: 
             x = all_gather(x, dim=1)
         # unpatchify
@@ -875,7 +1097,7 @@ class WanModel(ModelMixin, ConfigMixin):
                     **kwargs
                 )
 
-        return self.post_transformer_block_out(x, kwargs['grid_sizes'], e)
+        return self.post_transformer_block_out(x, kwargs['grid_sizes'], e, kwargs['e_index'])
 
     def unpatchify(self, x, grid_sizes):
         r"""
@@ -0,0 +1,198 @@
+"""
+Weight-only quantized Linear layers for the fusion blocks.
+
+Weights are stored quantized (int8, packed int4 or fp8 e4m3) with symmetric per-output-channel
+or per-group scales and dequantized to the activation dtype inside forward. Pre-quantized
+checkpoints are written by tools/quantize_checkpoint.py and loaded straight into a meta-initialized
+model (see replace_linear_layers), so the bf16 weights never have to be materialized.
+"""
+import json
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from safetensors import safe_open
+
+__all__ = [
+    'QUANT_FORMATS',
+    'QuantLinear',
+    'quantize_weight',
+    'dequantize_weight',
+    'replace_linear_layers',
+    'quant_checkpoint_name',
+    'read_quant_metadata',
+]
+
+QUANT_FORMATS = ("int8", "int4", "fp8")
+
+# 0 = one scale per output channel
+DEFAULT_GROUP_SIZE = {"int8": 0, "int4": 128, "fp8": 0}
+
+_QMAX = {"int8": 127.0, "int4": 7.0, "fp8": 448.0}
+
+
+def _check_format(fmt, group_size, in_features):
+    if fmt not in QUANT_FORMATS:
+        raise ValueError(f"Unknown quant format {fmt!r}, expected one of {QUANT_FORMATS}")
+    if group_size and in_features % group_size:
+        raise ValueError(f"in_features={in_features} is not divisible by group_size={group_size}")
+    if fmt == "int4" and in_features % 2:
+        raise ValueError(f"int4 packs two weights per byte, in_features={in_features} must be even")
+
+
+def _qweight_shape(fmt, out_features, in_features):
+    return (out_features, in_features // 2) if fmt == "int4" else (out_features, in_features)
+
+
+def _qweight_dtype(fmt):
+    return {"int8": torch.int8, "int4": torch.uint8, "fp8": torch.float8_e4m3fn}[fmt]
+
+
+def quantize_weight(weight, fmt, group_size=0):
+    """
+    weight: [out, in] float tensor.
+    Returns (qweight, scale) with qweight as stored by QuantLinear and scale [out, n_groups] float32.
+    """
+    out_features, in_features = weight.shape
+    _check_format(fmt, group_size, in_features)
+    n_groups = in_features // group_size if group_size else 1
+
+    w = weight.float().view(out_features, n_groups, -1)
+    scale = w.abs().amax(dim=-1, keepdim=True).clamp_min(1e-8) / _QMAX[fmt]
+    w = w / scale
+    if fmt == "fp8":
+        q = w.view(out_features, in_features).to(torch.float8_e4m3fn)
+    elif fmt == "int8":
+        q = w.round().clamp(-127, 127).view(out_features, in_features).to(torch.int8)
+    else:
+        # two signed 4-bit values per byte, offset by 8: even columns in the low nibble
+        u = (w.round().clamp(-8, 7) + 8).view(out_features, in_features).to(torch.uint8)
+        q = u[:, 0::2] | (u[:, 1::2] << 4)
+    return q.contiguous(), scale.squeeze(-1).contiguous()
+
+
+def dequantize_weight(qweight, scale, fmt, dtype=torch.bfloat16):
+    """Inverse of quantize_weight: [out, in] tensor in `dtype`."""
+    if fmt == "int4":
+        q = torch.stack([(qweight & 0x0F), (qweight >> 4)], dim=-1).flatten(1).to(dtype) - 8
+    else:
+        q = qweight.to(dtype)
+    out_features, n_groups = scale.shape
+    return (q.view(out_features, n_groups, -1) * scale.to(dtype).unsqueeze(-1)).view(out_features, -1)
+
+
+class QuantLinear(nn.Module):
+    """
+    Drop-in for nn.Linear with a weight-only quantized weight.
+
+    State dict: `qweight` (int8 [out, in] | uint8 [out, in/2] | float8_e4m3fn [out, in]), `scale`
+    (float32 [out, in/group_size], or [out, 1] per channel) and the unquantized `bias`.
+    """
+
+    def __init__(self, in_features, out_features, bias=True, fmt="int8", group_size=None, device=None, dtype=torch.bfloat16):
+        super().__init__()
+        group_size = DEFAULT_GROUP_SIZE[fmt] if group_size is None else group_size
+        _check_format(fmt, group_size, in_features)
+        self.in_features = in_features
+        self.out_features = out_features
+        self.fmt = fmt
+        self.group_size = group_size
+        n_groups = in_features // group_size if group_size else 1
+        self.register_buffer("qweight", torch.empty(_qweight_shape(fmt, out_features, in_features),
+                                                    dtype=_qweight_dtype(fmt), device=device))
+        self.register_buffer("scale", torch.empty(out_features, n_groups, dtype=torch.float32, device=device))
+        self.bias = nn.Parameter(torch.empty(out_features, dtype=dtype, device=device)) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear, fmt="int8", group_size=None):
+        m = cls(linear.in_features, linear.out_features, linear.bias is not None, fmt, group_size,
+                device=linear.weight.device, dtype=linear.weight.dtype)
+        with torch.no_grad():
+            q, s = quantize_weight(linear.weight, fmt, m.group_size)
+            m.qweight.copy_(q)
+            m.scale.copy_(s)
+            if linear.bias is not None:
+                m.bias.copy_(linear.bias)
+        return m
+
+    @property
+    def weight(self):
+        return self.dequantize(self.bias.dtype if self.bias is not None else torch.bfloat16)
+
+    def dequantize(self, dtype):
+        return dequantize_weight(self.qweight, self.scale, self.fmt, dtype)
+
+    def _apply(self, fn, *args, **kwargs):
+        # model.to(dtype=...) / .bfloat16() must not touch the quantized storage: casting and casting back
+        # would round the fp32 scales through bf16. fn is probed on an empty tensor; when it would change the
+        # dtype, qweight / scale only follow the device, otherwise (device moves, to_empty, ...) fn is applied.
+        buffers = {name: buf for name, buf in self._buffers.items() if buf is not None}
+        for name in buffers:
+            self._buffers[name] = None
+        super()._apply(fn, *args, **kwargs)
+        for name, buf in buffers.items():
+            probe = fn(torch.empty(0, dtype=buf.dtype, device=buf.device))
+            if probe.dtype == buf.dtype:
+                buf = fn(buf)
+            elif buf.is_meta:
+                buf = torch.empty_like(buf, device=probe.device)
+            else:
+                buf = buf.to(probe.device)
+            self._buffers[name] = buf
+        return self
+
+    def forward(self, x):
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        return F.linear(x, self.dequantize(x.dtype), bias)
+
+    def extra_repr(self):
+        return (f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}, "
+                f"fmt={self.fmt}, group_size={self.group_size}")
+
+
+def default_quant_filter(name, module):
+    # only the transformer blocks: embeddings, time projection and heads stay in bf16
+    return ".blocks." in f".{name}."
+
+
+def replace_linear_layers(model, fmt, group_size=None, filter_fn=default_quant_filter, quantize=False):
+    """
+    Swap the selected nn.Linear modules of `model` for QuantLinear in place. quantize=False creates empty
+    layers on the linear's device (e.g. meta, to be filled by load_state_dict(..., assign=True)),
+    quantize=True quantizes the existing weights. Returns the names of the replaced modules.
+    """
+    replaced = []
+    for parent_name, parent in list(model.named_modules()):
+        for child_name, child in list(parent.named_children()):
+            name = f"{parent_name}.{child_name}" if parent_name else child_name
+            if type(child) is not nn.Linear or not filter_fn(name, child):
+                continue
+            if quantize:
+                new = QuantLinear.from_linear(child, fmt, group_size)
+            else:
+                new = QuantLinear(child.in_features, child.out_features, child.bias is not None, fmt, group_size,
+                                  device=child.weight.device, dtype=torch.bfloat16)
+            setattr(parent, child_name, new)
+            replaced.append(name)
+    return replaced
+
+
+def quant_checkpoint_name(basename, fmt, group_size=None):
+    """model_960x960.safetensors -> model_960x960_int4_g128.safetensors"""
+    group_size = DEFAULT_GROUP_SIZE[fmt] if group_size is None else group_size
+    stem = os.path.splitext(basename)[0]
+    return f"{stem}_{fmt}{f'_g{group_size}' if group_size else ''}.safetensors"
+
+
+def read_quant_metadata(path):
+    """Quantization metadata written by tools/quantize_checkpoint.py ({} for plain checkpoints)."""
+    with safe_open(path, framework="pt", device="cpu") as f:
+        meta = f.metadata() or {}
+    if "quant_format" not in meta:
+        return {}
+    return {
+        "quant_format": meta["quant_format"],
+        "quant_group_size": int(meta["quant_group_size"]),
+        "quantized_modules": json.loads(meta.get("quantized_modules", "[]")),
+    }
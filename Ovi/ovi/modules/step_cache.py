@@ -0,0 +1,81 @@
+import logging
+from collections import defaultdict
+
+
+class _BranchState:
+    def __init__(self):
+        self.calls = 0
+        self.first_residuals = None  # first fusion block residual (video, audio) of the last full forward
+        self.residuals = None        # blocks 1.. residual (video, audio) of the last full forward
+        self.skipped = 0
+
+
+class StepCache:
+    """
+    First-block residual cache across denoising steps (FBCache / TeaCache style).
+
+    Every forward runs the first fusion block. Its residual (output - input) is compared, per modality, with
+    the first-block residual of the last fully computed step of the same branch:
+
+        rel_l1 = mean(|r - r_prev|) / mean(|r_prev|)
+
+    If the larger of the video and audio changes is below `threshold`, the remaining blocks are skipped and
+    the residual they produced last time is added instead (separately for video and audio). Branches (e.g. the
+    CFG conditional / unconditional passes, or the batched pair) keep separate state, and each branch always
+    computes its first `warmup_steps` forwards in full.
+    """
+
+    def __init__(self, threshold, warmup_steps=2):
+        self.threshold = threshold
+        self.warmup_steps = warmup_steps
+        self._branches = defaultdict(_BranchState)
+
+    @staticmethod
+    def _branch_key(branch, tensors):
+        return (branch,) + tuple(tuple(u.shape) for u in tensors)
+
+    @staticmethod
+    def rel_l1(cur, prev):
+        return (cur - prev).abs().mean() / prev.abs().mean().clamp_min(1e-6)
+
+    def lookup(self, branch, first_residuals, reduce_fn=None):
+        """
+        first_residuals: (video, audio) residual of the first block in this forward.
+        Returns the cached (video, audio) residual of the remaining blocks if they can be skipped, else None.
+        reduce_fn optionally combines the change estimate across ranks (sequence parallel).
+        """
+        state = self._branches[self._branch_key(branch, first_residuals)]
+        state.calls += 1
+        if state.residuals is None or state.calls <= self.warmup_steps:
+            return None
+
+        change = max(self.rel_l1(cur.float(), prev.float()) for cur, prev in zip(first_residuals, state.first_residuals))
+        if reduce_fn is not None:
+            change = reduce_fn(change)
+        if change.item() >= self.threshold:
+            return None
+        state.skipped += 1
+        return state.residuals
+
+    def store(self, branch, first_residuals, residuals):
+        state = self._branches[self._branch_key(branch, first_residuals)]
+        state.first_residuals = first_residuals
+        state.residuals = residuals
+
+    def report(self):
+        """{"forwards": n, "skipped": n, "branches": {branch: {"forwards", "skipped"}}}"""
+        branches = {}
+        for key, state in self._branches.items():
+            b = branches.setdefault(key[0], {"forwards": 0, "skipped": 0})
+            b["forwards"] += state.calls
+            b["skipped"] += state.skipped
+        return {
+            "forwards": sum(b["forwards"] for b in branches.values()),
+            "skipped": sum(b["skipped"] for b in branches.values()),
+            "branches": branches,
+        }
+
+    def log_report(self):
+        r = self.report()
+        logging.info(f"Step cache (threshold {self.threshold}): skipped blocks 1..N on {r['skipped']}/{r['forwards']} forwards "
+                     + ", ".join(f"{name}: {b['skipped']}/{b['forwards']}" for name, b in r["branches"].items()))
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 import uuid
@@ -11,54 +12,20 @@ from diffusers import FluxPipeline
 from tqdm import tqdm
 from ovi.distributed_comms.parallel_states import get_sequence_parallel_state, nccl_info
 from ovi.utils.model_loading_utils import init_fusion_score_model_ovi, init_text_model, init_mmaudio_vae, init_wan_vae_2_2, load_fusion_checkpoint
-from ovi.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
-from diffusers import FlowMatchEulerDiscreteScheduler
-from ovi.utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
-                               get_sampling_sigmas, retrieve_timesteps)
+from ovi.utils.scheduler_utils import MultiStreamScheduler, SchedulerFactory
+from ovi.utils.guidance import GuidanceSchedule
+from ovi.utils.block_offload import BlockStreamer
 import traceback
 from omegaconf import OmegaConf
 from ovi.utils.processing_utils import clean_text, preprocess_image_tensor, snap_hw_to_multiple_of_32, scale_hw_to_area_divisible
-import re
 from optimum.quanto import freeze, qint8, quantize
+from ovi.model_specs import NAME_TO_MODEL_SPECS_MAP
+from ovi.modules.lora import LoRAManager
+from ovi.modules.quant import QUANT_FORMATS, quant_checkpoint_name, read_quant_metadata, replace_linear_layers
+from ovi.utils.text_embedding_cache import TextEmbeddingCache, checkpoint_namespace
 
 DEFAULT_CONFIG = OmegaConf.load('ovi/configs/inference/inference_fusion.yaml')
 
-NAME_TO_MODEL_SPECS_MAP = {
-    "720x720_5s": {
-        "path": "model.safetensors",
-        "video_latent_length": 31,
-        "audio_latent_length": 157,
-        "video_area": 720 * 720,
-        "formatter": lambda text: re.sub(r"Audio:\s*(.*)", r"<AUDCAP>\1<ENDAUDCAP>", text, flags=re.S)
-    },
-    "960x960_5s": {
-        "path": "model_960x960.safetensors",
-        "video_latent_length": 31,
-        "audio_latent_length": 157,
-        "video_area": 960 * 960,
-        "formatter": lambda text: re.sub(r"<AUDCAP>(.*?)<ENDAUDCAP>", r"Audio: \1", text, flags=re.S)
-    }, 
-    "960x960_10s": {
-        "path": "model_960x960_10s.safetensors",
-        "video_latent_length": 61,
-        "audio_latent_length": 314,
-        "video_area": 960 * 960,
-        "formatter": lambda text: re.sub(r"<AUDCAP>(.*?)<ENDAUDCAP>", r"Audio: \1", text, flags=re.S)
-    },
-    "720x720_3s": {
-        "path": "model.safetensors",          # nutzt das gleiche 720x720 Modell
-        "video_latent_length": 19,            # ~3s Test (31*3/5 ≈ 18.6)
-        "audio_latent_length": 94,            # ~3s Test (157*3/5 ≈ 94.2)
-        "video_area": 720 * 720,
-        "formatter": lambda text: re.sub(r"Audio:\s*(.*)", r"<AUDCAP>\1<ENDAUDCAP>", text, flags=re.S)
-    }
-
-
-
-
-}
-
-
 
 class OviFusionEngine:
     def __init__(self, config=DEFAULT_CONFIG, device=0, target_dtype=torch.bfloat16):
@@ -69,11 +36,22 @@ class OviFusionEngine:
         self.cpu_offload = config.get("cpu_offload", False) or config.get("mode") == "t2i2v"
         if self.cpu_offload:
             logging.info("CPU offloading is enabled. Initializing all models aside from VAEs on CPU")
+        # block streaming: fusion blocks stay in pinned host memory and are prefetched block by block while denoising
+        self.block_offload = config.get("block_offload", False)
+        fusion_on_cpu = self.cpu_offload or self.block_offload
 
         model, video_config, audio_config = init_fusion_score_model_ovi(rank=device, meta_init=meta_init)
 
         fp8 = config.get("fp8", False)
         int8 = config.get("qint8", False)
+        # in-repo weight-only quantization (ovi.modules.quant), loaded pre-quantized from tools/quantize_checkpoint.py
+        quant = config.get("quant", None)
+        quant_group_size = config.get("quant_group_size", None)
+        assert not (int8 and self.block_offload), "block_offload streams plain tensors and does not support qint8 quantized weights."
+        if quant:
+            assert quant in QUANT_FORMATS, f"quant must be one of {QUANT_FORMATS}, got {quant}"
+            assert not fp8 and not int8, "quant replaces the fp8 checkpoint and qint8 paths, enable only one of them."
+            assert meta_init, "Pre-quantized checkpoints are loaded into a meta-initialized model."
         if fp8:
             assert not config.get("mode") == "t2i2v", "Image generation with FluxPipeline is not supported with fp8 quantization. This is because if you are unable to run the bf16 model, you likely cannot run image gen model"
 
@@ -81,7 +59,7 @@ class OviFusionEngine:
             if not fp8:
                 model = model.to(dtype=target_dtype)
             model = (
-                model.to(device=device if not self.cpu_offload else "cpu")
+                model.to(device=device if not fusion_on_cpu else "cpu")
                 .eval()
             )
 
@@ -95,12 +73,23 @@ class OviFusionEngine:
         vae_model_audio.requires_grad_(False).eval()
         self.vae_model_audio = vae_model_audio.bfloat16()
 
-        # Load T5 text model
-        self.text_model = init_text_model(config.ckpt_dir, rank=device, cpu_offload=self.cpu_offload)
+        # T5 text model is loaded lazily on the first embedding cache miss (see text_model / encode_text)
         if config.get("shard_text_model", False):
             raise NotImplementedError("Sharding text model is not implemented yet.")
-        if self.cpu_offload:
-            self.offload_to_cpu(self.text_model.model)
+        self._ckpt_dir = config.ckpt_dir
+        self.context_cache = config.get("context_cache", True)
+        self.scheduler_factory = SchedulerFactory()
+        self._text_model = None
+        text_cache_dir = config.get("text_cache_dir", os.environ.get("OVI_TEXT_CACHE_DIR"))
+        if text_cache_dir is None:
+            text_cache_dir = os.path.join(config.ckpt_dir, "t5_embedding_cache")
+        self.text_cache = TextEmbeddingCache(
+            checkpoint_namespace(os.path.join(config.ckpt_dir, "Wan2.2-TI2V-5B", "models_t5_umt5-xxl-enc-bf16.pth"), text_len=512),
+            max_items=config.get("text_cache_size", 128),
+            cache_dir=text_cache_dir,
+            **({"max_disk_bytes": int(float(config.get("text_cache_max_gb")) * 1024 ** 3)}
+               if config.get("text_cache_max_gb") is not None else {}),
+        )
 
         # Find fusion ckpt in the same dir used by other components
         model_name = config.get("model_name", "960x960_5s")
@@ -112,6 +101,8 @@ class OviFusionEngine:
             assert model_name in ["720x720_5s", "720x720_3s"], "FP8 quantization is only supported for 720x720 models currently."
 
             basename = "model_fp8_e4m3fn.safetensors"
+        if quant:
+            basename = quant_checkpoint_name(basename, quant, quant_group_size)
   
 
 
@@ -123,19 +114,32 @@ class OviFusionEngine:
         )
 
         if not os.path.exists(checkpoint_path):
+            if quant:
+                raise RuntimeError(f"Quantized fusion checkpoint {checkpoint_path} not found, create it with "
+                                   f"`python tools/quantize_checkpoint.py --model-name {model_name} --format {quant}`")
             raise RuntimeError(f"REQUIRED fusion checkpoint not found in {config.ckpt_dir}, please download...")
 
+        if quant:
+            quant_meta = read_quant_metadata(checkpoint_path)
+            assert quant_meta.get("quant_format") == quant, f"{checkpoint_path} is not a {quant} checkpoint: {quant_meta}"
+            # empty QuantLinear layers on meta, the checkpoint tensors are assigned as they are (no bf16 intermediate)
+            replace_linear_layers(model, quant, quant_meta["quant_group_size"])
+
         load_fusion_checkpoint(model, checkpoint_path=checkpoint_path, from_meta=meta_init)
 
         if meta_init:
-            if not fp8:
+            if not fp8 and not quant:
                 model = model.to(dtype=target_dtype)
-            model = model.to(device=device if not self.cpu_offload else "cpu").eval()
+            model = model.to(device=device if not fusion_on_cpu else "cpu").eval()
             model.set_rope_params()
         self.model = model
+        if self.block_offload:
+            self.model.block_streamer = BlockStreamer(self.model, device, prefetch=config.get("block_prefetch", 1))
         if int8:
             quantize(self.model, qint8)
             freeze(self.model)
+        # per-job LoRA adapters (generate_batch(lora=...)), kept on the GPU in a small LRU
+        self.lora = LoRAManager(self.model, device, max_cached=config.get("lora_cache_size", 4), base_checkpoint=checkpoint_path)
 
         ## Load t2i as part of pipeline
         self.image_model = None
@@ -154,7 +158,37 @@ class OviFusionEngine:
         self.target_area = model_specs["video_area"]
 
 
-        logging.info(f"OVI Fusion Engine initialized, cpu_offload={self.cpu_offload}. GPU VRAM allocated: {torch.cuda.memory_allocated(device)/1e9:.2f} GB, reserved: {torch.cuda.memory_reserved(device)/1e9:.2f} GB")
+        logging.info(f"OVI Fusion Engine initialized, cpu_offload={self.cpu_offload}, block_offload={self.block_offload}, quant={quant}. GPU VRAM allocated: {torch.cuda.memory_allocated(device)/1e9:.2f} GB, reserved: {torch.cuda.memory_reserved(device)/1e9:.2f} GB")
+
+    @property
+    def text_model(self):
+        if self._text_model is None:
+            logging.info("Loading T5 text model...")
+            self._text_model = init_text_model(self._ckpt_dir, rank=self.device, cpu_offload=self.cpu_offload)
+            if self.cpu_offload:
+                self.offload_to_cpu(self._text_model.model)
+        return self._text_model
+
+    @torch.inference_mode()
+    def encode_text(self, texts):
+        """
+        T5 embeddings for `texts`, served from self.text_cache where possible.
+        Only cache misses run through T5; on a full hit T5 is neither loaded nor moved to the GPU.
+        """
+        embeddings = [self.text_cache.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, emb in zip(texts, embeddings) if emb is None))
+        if missing:
+            if self.cpu_offload:
+                self.text_model.model = self.text_model.model.to(self.device)
+            encoded = dict(zip(missing, self.text_model(missing, self.text_model.device)))
+            if self.cpu_offload:
+                self.offload_to_cpu(self.text_model.model)
+            for t, emb in encoded.items():
+                self.text_cache.put(t, emb)
+            embeddings = [encoded[t] if emb is None else emb for t, emb in zip(texts, embeddings)]
+        else:
+            logging.info(f"T5 embedding cache hit for all {len(texts)} texts")
+        return [emb.to(self.target_dtype).to(self.device) for emb in embeddings]
 
     @torch.inference_mode()
     def generate(self,
@@ -169,20 +203,106 @@ class OviFusionEngine:
                     audio_guidance_scale=4.0,
                     slg_layer=9,
                     video_negative_prompt="",
-                    audio_negative_prompt=""
+                    audio_negative_prompt="",
+                    progress_callback=None,
+                    cfg_batch=True,
+                    guidance=None,
+                    step_cache_threshold=0.0,
+                    step_cache_warmup=2,
+                    ffn_chunk_size=0,
+                    lora=None,
+                    lora_merge=False
                 ):
+        """
+        progress_callback: optional callable(stage, **info), called at stage boundaries
+            ("text-encode", "vae-encode", "denoise" per step with step/total, "decode").
+        cfg_batch: run the conditional and unconditional pass as one batched forward (needs more
+            activation memory); False runs them one after the other.
+        guidance: optional GuidanceSchedule (scale curve, sigma interval, adaptive skipping of the
+            unconditional pass); None applies the guidance scales on every step.
+        step_cache_threshold: > 0 skips fusion blocks 1..N on steps whose first-block residual changed less
+            than this (relative L1) since the last full step, see StepCache. The first `step_cache_warmup`
+            forwards of every CFG branch always run in full.
+        ffn_chunk_size: > 0 runs every block's FFN (with its norm / modulation / residual) over this many
+            tokens at a time to cut peak activation memory; the denoise peak VRAM is logged per group.
+        lora: [(adapter path, scale), ...] (see resolve_lora_spec) active for this call, None / [] removes
+            adapters of earlier calls. lora_merge merges them into the base weights instead of hooking the
+            linears (no per-step cost, slower to switch).
+        """
+        try:
+            return self.generate_batch(
+                [{"text_prompt": text_prompt, "image_path": image_path, "seed": seed}],
+                video_frame_height_width=video_frame_height_width,
+                solver_name=solver_name,
+                sample_steps=sample_steps,
+                shift=shift,
+                video_guidance_scale=video_guidance_scale,
+                audio_guidance_scale=audio_guidance_scale,
+                slg_layer=slg_layer,
+                video_negative_prompt=video_negative_prompt,
+                audio_negative_prompt=audio_negative_prompt,
+                progress_callback=progress_callback,
+                cfg_batch=cfg_batch,
+                guidance=guidance,
+                step_cache_threshold=step_cache_threshold,
+                step_cache_warmup=step_cache_warmup,
+                ffn_chunk_size=ffn_chunk_size,
+                lora=lora,
+                lora_merge=lora_merge,
+            )[0]
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            return None
+
+    @torch.inference_mode()
+    def generate_batch(self,
+                    samples,
+                    video_frame_height_width=None,
+                    solver_name="unipc",
+                    sample_steps=50,
+                    shift=5.0,
+                    video_guidance_scale=5.0,
+                    audio_guidance_scale=4.0,
+                    slg_layer=9,
+                    video_negative_prompt="",
+                    audio_negative_prompt="",
+                    progress_callback=None,
+                    cfg_batch=True,
+                    guidance=None,
+                    step_cache_threshold=0.0,
+                    step_cache_warmup=2,
+                    ffn_chunk_size=0,
+                    lora=None,
+                    lora_merge=False
+                ):
+        """
+        Denoise several samples in the same forward passes.
+
+        samples: list of dicts with "text_prompt", optional "image_path" and "seed".
+        Samples are grouped by latent shape and conditioning (i2v keeps the clean first frame), every
+        group is denoised and VAE-decoded as one batch. Returns [(video, audio, image), ...] in input order.
+        progress_callback additionally gets batch=<group size> and offset=<samples in earlier groups>.
+        """
+        def _progress(stage, **info):
+            if progress_callback is not None:
+                progress_callback(stage, **info)
 
         params = {
-            "Text Prompt": text_prompt,
-            "Image Path": image_path if image_path else "None (T2V mode)",
+            "Samples": len(samples),
+            "Text Prompts": [s.get("text_prompt") for s in samples],
+            "Image Paths": [s.get("image_path") or "None (T2V mode)" for s in samples],
             "Frame Height Width": video_frame_height_width,
-            "Seed": seed,
+            "Seeds": [s.get("seed", 100) for s in samples],
             "Solver": solver_name,
             "Sample Steps": sample_steps,
             "Shift": shift,
             "Video Guidance Scale": video_guidance_scale,
             "Audio Guidance Scale": audio_guidance_scale,
             "SLG Layer": slg_layer,
+            "Guidance Schedule": guidance,
+            "Step Cache Threshold": step_cache_threshold,
+            "FFN Chunk Size": ffn_chunk_size or "off",
+            "LoRA": [f"{os.path.basename(path)}@{scale}" for path, scale in lora or []] or "none",
             "Video Negative Prompt": video_negative_prompt,
             "Audio Negative Prompt": audio_negative_prompt,
         }
@@ -191,185 +311,293 @@ class OviFusionEngine:
         logging.info("\n========== Generation Parameters ==========\n"
                     f"{pretty}\n"
                     "==========================================")
-        try:
-            scheduler_video, timesteps_video = self.get_scheduler_time_steps(
-                sampling_steps=sample_steps,
-                device=self.device,
-                solver_name=solver_name,
-                shift=shift
-            )
-            scheduler_audio, timesteps_audio = self.get_scheduler_time_steps(
-                sampling_steps=sample_steps,
-                device=self.device,
-                solver_name=solver_name,
-                shift=shift
-            )
 
-            is_t2v = image_path is None
-            is_i2v = not is_t2v
+        prepared = [self._prepare_sample(s.get("text_prompt"), s.get("image_path"), video_frame_height_width, s.get("seed", 100))
+                    for s in samples]
 
-            first_frame = None
-            image = None
+        _progress("text-encode")
+        text_embeddings = self.encode_text([p["text_prompt"] for p in prepared] + [video_negative_prompt, audio_negative_prompt])
 
-            # text and image checks
-            formatted_text_prompt = self.text_formatter(text_prompt)
-            if formatted_text_prompt != text_prompt:
-                logging.info(f"Wrong audio description format detected! Please use <AUDCAP>...<ENDAUDCAP> tags for 720x720_5s model and Audio: ... for 960x960 models.\n \
-                             Original prompt: {text_prompt}\nFormatted prompt: {formatted_text_prompt}")
-                text_prompt = formatted_text_prompt
+        # Split embeddings: audio and video share the positive prompt
+        text_embeddings_video_neg = text_embeddings[-2]
+        text_embeddings_audio_neg = text_embeddings[-1]
+        for p, emb in zip(prepared, text_embeddings):
+            p["text_embedding"] = emb
 
-            if is_i2v and not self.image_model:
-                # Load first frame from path
-                first_frame = preprocess_image_tensor(image_path, self.device, self.target_dtype, resize_total_area=self.target_area)
-            else:
-                assert video_frame_height_width is not None, f"If mode=t2v or t2i2v, video_frame_height_width must be provided."
-
-                # input resolution should be at least 0.9x of video area of model spec
-                input_area = video_frame_height_width[0] * video_frame_height_width[1]
-                if input_area < 0.9 * self.target_area or input_area > 1.1 * self.target_area:
-                    logging.warning(f"[Detected model: {self.model_name}] Input video frame area {input_area} is more than 10\% smaller or larger than model's target area {self.target_area}. This may lead to suboptimal results, please refer to readme for best resolutions or use the right model. DEFAULTING TO MODEL'S TARGET AREA while preserving given aspect ratio.")
-
-                video_h, video_w = video_frame_height_width
-                video_h, video_w = snap_hw_to_multiple_of_32(video_h, video_w, area = self.target_area)
-                video_latent_h, video_latent_w = video_h // 16, video_w // 16
-                if self.image_model is not None:
-                    # this already means t2v mode with image model
-                    image_h, image_w = scale_hw_to_area_divisible(video_h, video_w, area = 1024 * 1024)
-                    image = self.image_model(
-                        clean_text(text_prompt),
-                        height=image_h,
-                        width=image_w,
-                        guidance_scale=4.5,
-                        generator=torch.Generator().manual_seed(seed)
-                    ).images[0]
-                    first_frame = preprocess_image_tensor(image, self.device, self.target_dtype, resize_total_area=self.target_area)
-                    is_i2v = True
-                else:
-                    print(f"Pure T2V mode: calculated video latent size: {video_latent_h} x {video_latent_w}")
-
-            
+        if any(p["is_i2v"] for p in prepared):
+            _progress("vae-encode")
             if self.cpu_offload:
-                self.text_model.model = self.text_model.model.to(self.device)
-            text_embeddings = self.text_model([text_prompt, video_negative_prompt, audio_negative_prompt], self.text_model.device)
-            text_embeddings = [emb.to(self.target_dtype).to(self.device) for emb in text_embeddings]
-
+                self.vae_model_video.model = self.vae_model_video.model.to(
+                    self.device
+                )
+            for p in prepared:
+                if not p["is_i2v"]:
+                    continue
+                with torch.no_grad():
+                    latents_images = self.vae_model_video.wrapped_encode(p["first_frame"][:, :, None]).to(self.target_dtype).squeeze(0) # c 1 h w 
+                p["latents_image"] = latents_images.to(self.target_dtype)
+                p["latent_h"], p["latent_w"] = latents_images.shape[2], latents_images.shape[3]
             if self.cpu_offload:
-                self.offload_to_cpu(self.text_model.model)
+                self.offload_to_cpu(self.vae_model_video.model)
 
-            # Split embeddings
-            text_embeddings_audio_pos = text_embeddings[0]
-            text_embeddings_video_pos = text_embeddings[0] 
+        groups = {}
+        for idx, p in enumerate(prepared):
+            groups.setdefault((p["is_i2v"], p["latent_h"], p["latent_w"]), []).append(idx)
 
-            text_embeddings_video_neg = text_embeddings[1]
-            text_embeddings_audio_neg = text_embeddings[2]
+        self.model.set_ffn_chunk_size(ffn_chunk_size)
+        self.lora.set_adapters(lora or [], merge=lora_merge)
 
-            if is_i2v:
-                if self.cpu_offload:
-                    self.vae_model_video.model = self.vae_model_video.model.to(
-                        self.device
-                    )
-                with torch.no_grad():
-                    latents_images = self.vae_model_video.wrapped_encode(first_frame[:, :, None]).to(self.target_dtype).squeeze(0) # c 1 h w 
-                latents_images = latents_images.to(self.target_dtype)
-                video_latent_h, video_latent_w = latents_images.shape[2], latents_images.shape[3]
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.vae_model_video.model)
-
-            video_noise = torch.randn((self.video_latent_channel, self.video_latent_length, video_latent_h, video_latent_w), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(seed))  # c, f, h, w
-            audio_noise = torch.randn((self.audio_latent_length, self.audio_latent_channel), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(seed))  # 1, l c -> l, c
-            
-            # Calculate sequence lengths from actual latents
-            max_seq_len_audio = audio_noise.shape[0]  # L dimension from latents_audios shape [1, L, D]
-            _patch_size_h, _patch_size_w = self.model.video_model.patch_size[1], self.model.video_model.patch_size[2]
-            max_seq_len_video = video_noise.shape[1] * video_noise.shape[2] * video_noise.shape[3] // (_patch_size_h*_patch_size_w) # f * h * w from [1, c, f, h, w]
-            
-            # Sampling loop
-            if self.cpu_offload:
-                self.offload_to_cpu(self.vae_model_video.model)
-                self.offload_to_cpu(self.vae_model_audio)
+        results = [None] * len(prepared)
+        offset = 0
+        for idxs in groups.values():
+            outs = self._denoise_group(
+                [prepared[i] for i in idxs],
+                text_embeddings_video_neg=text_embeddings_video_neg,
+                text_embeddings_audio_neg=text_embeddings_audio_neg,
+                solver_name=solver_name,
+                sample_steps=sample_steps,
+                shift=shift,
+                video_guidance_scale=video_guidance_scale,
+                audio_guidance_scale=audio_guidance_scale,
+                slg_layer=slg_layer,
+                cfg_batch=cfg_batch,
+                guidance=guidance or GuidanceSchedule(),
+                step_cache_threshold=step_cache_threshold,
+                step_cache_warmup=step_cache_warmup,
+                progress=lambda stage, _o=offset, **info: _progress(stage, offset=_o, **info),
+            )
+            for i, out in zip(idxs, outs):
+                results[i] = out
+            offset += len(idxs)
+        return results
+
+    def _prepare_sample(self, text_prompt, image_path, video_frame_height_width, seed):
+        is_t2v = image_path is None
+        is_i2v = not is_t2v
+
+        first_frame = None
+        image = None
+        video_latent_h = video_latent_w = None
+
+        # text and image checks
+        formatted_text_prompt = self.text_formatter(text_prompt)
+        if formatted_text_prompt != text_prompt:
+            logging.info(f"Wrong audio description format detected! Please use <AUDCAP>...<ENDAUDCAP> tags for 720x720_5s model and Audio: ... for 960x960 models.\n \
+                         Original prompt: {text_prompt}\nFormatted prompt: {formatted_text_prompt}")
+            text_prompt = formatted_text_prompt
+
+        if is_i2v and not self.image_model:
+            # Load first frame from path
+            first_frame = preprocess_image_tensor(image_path, self.device, self.target_dtype, resize_total_area=self.target_area)
+        else:
+            assert video_frame_height_width is not None, f"If mode=t2v or t2i2v, video_frame_height_width must be provided."
+
+            # input resolution should be at least 0.9x of video area of model spec
+            input_area = video_frame_height_width[0] * video_frame_height_width[1]
+            if input_area < 0.9 * self.target_area or input_area > 1.1 * self.target_area:
+                logging.warning(f"[Detected model: {self.model_name}] Input video frame area {input_area} is more than 10\% smaller or larger than model's target area {self.target_area}. This may lead to suboptimal results, please refer to readme for best resolutions or use the right model. DEFAULTING TO MODEL'S TARGET AREA while preserving given aspect ratio.")
+
+            video_h, video_w = video_frame_height_width
+            video_h, video_w = snap_hw_to_multiple_of_32(video_h, video_w, area = self.target_area)
+            video_latent_h, video_latent_w = video_h // 16, video_w // 16
+            if self.image_model is not None:
+                # this already means t2v mode with image model
+                image_h, image_w = scale_hw_to_area_divisible(video_h, video_w, area = 1024 * 1024)
+                image = self.image_model(
+                    clean_text(text_prompt),
+                    height=image_h,
+                    width=image_w,
+                    guidance_scale=4.5,
+                    generator=torch.Generator().manual_seed(seed)
+                ).images[0]
+                first_frame = preprocess_image_tensor(image, self.device, self.target_dtype, resize_total_area=self.target_area)
+                is_i2v = True
+            else:
+                print(f"Pure T2V mode: calculated video latent size: {video_latent_h} x {video_latent_w}")
+
+        return {
+            "text_prompt": text_prompt,
+            "seed": seed,
+            "is_i2v": is_i2v,
+            "first_frame": first_frame,
+            "image": image,
+            "latent_h": video_latent_h,
+            "latent_w": video_latent_w,
+        }
+
+    def _denoise_group(self,
+                    group,
+                    text_embeddings_video_neg,
+                    text_embeddings_audio_neg,
+                    solver_name,
+                    sample_steps,
+                    shift,
+                    video_guidance_scale,
+                    audio_guidance_scale,
+                    slg_layer,
+                    cfg_batch,
+                    guidance,
+                    step_cache_threshold,
+                    step_cache_warmup,
+                    progress
+                ):
+        """Denoise + decode samples of one shape as a batch of k; returns [(video, audio, image), ...]."""
+        k = len(group)
+        is_i2v = group[0]["is_i2v"]
+        video_latent_h, video_latent_w = group[0]["latent_h"], group[0]["latent_w"]
+
+        # video and audio share the timesteps: one scheduler steps both stacked [k, ...] latents together
+        scheduler, timesteps = self.get_scheduler_time_steps(
+            sampling_steps=sample_steps,
+            device=self.device,
+            solver_name=solver_name,
+            shift=shift
+        )
+        scheduler = MultiStreamScheduler(scheduler)
+        guidance_run = guidance.start(timesteps)
+
+        # per-sample generators: same noise as generating the sample on its own
+        video_noise = torch.stack([
+            torch.randn((self.video_latent_channel, self.video_latent_length, video_latent_h, video_latent_w), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(p["seed"]))
+            for p in group])  # k, c, f, h, w
+        audio_noise = torch.stack([
+            torch.randn((self.audio_latent_length, self.audio_latent_channel), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(p["seed"]))
+            for p in group])  # k, l, c
+        latents_images = torch.stack([p["latents_image"] for p in group]) if is_i2v else None  # k, c, 1, h, w
+
+        # Calculate sequence lengths from actual latents
+        max_seq_len_audio = audio_noise.shape[1]  # L dimension from latents_audios shape [k, L, D]
+        _patch_size_h, _patch_size_w = self.model.video_model.patch_size[1], self.model.video_model.patch_size[2]
+        max_seq_len_video = video_noise.shape[2] * video_noise.shape[3] * video_noise.shape[4] // (_patch_size_h*_patch_size_w) # f * h * w from [k, c, f, h, w]
+
+        text_embeddings_pos = [p["text_embedding"] for p in group]
+
+        # Sampling loop
+        if self.cpu_offload:
+            self.offload_to_cpu(self.vae_model_video.model)
+            self.offload_to_cpu(self.vae_model_audio)
+            if not self.block_offload:
                 self.model = self.model.to(self.device)
-            with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
-                for i, (t_v, t_a) in tqdm(enumerate(zip(timesteps_video, timesteps_audio))):
-                    timestep_input = torch.full((1,), t_v, device=self.device)
+        torch.cuda.reset_peak_memory_stats(self.device)
+        with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
+            # text embedding + cross-attention K/V of this group's prompts are computed once, not per step;
+            # optional step cache reuses the deep blocks' residual on steps that barely change
+            with self.model.cached_context() if self.context_cache else contextlib.nullcontext(), \
+                    self.model.cached_steps(step_cache_threshold, step_cache_warmup) if step_cache_threshold > 0 else contextlib.nullcontext() as step_cache:
+                for i, t in tqdm(enumerate(timesteps)):
+                    timestep_input = timesteps[i:i + 1]  # already on device, no host round trip
 
                     if is_i2v:
-                        video_noise[:, :1] = latents_images
-
-                    # Positive (conditional) forward pass
-                    pos_forward_args = {
-                        'audio_context': [text_embeddings_audio_pos],
-                        'vid_context': [text_embeddings_video_pos],
-                        'vid_seq_len': max_seq_len_video,
-                        'audio_seq_len': max_seq_len_audio,
-                        'first_frame_is_clean': is_i2v
-                    }
-
-                    pred_vid_pos, pred_audio_pos = self.model(
-                        vid=[video_noise],
-                        audio=[audio_noise],
-                        t=timestep_input,
-                        **pos_forward_args
-                    )
-                    
-                    # Negative (unconditional) forward pass  
-                    neg_forward_args = {
-                        'audio_context': [text_embeddings_audio_neg],
-                        'vid_context': [text_embeddings_video_neg],
-                        'vid_seq_len': max_seq_len_video,
-                        'audio_seq_len': max_seq_len_audio,
-                        'first_frame_is_clean': is_i2v,
-                        'slg_layer': slg_layer
-                    }
-                    
-                    pred_vid_neg, pred_audio_neg = self.model(
-                        vid=[video_noise],
-                        audio=[audio_noise],
-                        t=timestep_input,
-                        **neg_forward_args
-                    )
+                        video_noise[:, :, :1] = latents_images
+
+                    vids = list(video_noise.unbind(0))
+                    audios = list(audio_noise.unbind(0))
+
+                    # guidance schedule: steps with effective scale 1.0 for both modalities skip the unconditional pass
+                    video_scale, audio_scale = guidance_run.scales(i, video_guidance_scale, audio_guidance_scale)
+                    use_cfg = video_scale != 1.0 or audio_scale != 1.0
+
+                    if use_cfg:
+                        # conditional + unconditional branch in one call: embeddings and the self-attention half of
+                        # block 0 are shared, the branches split at the text cross-attention (SLG on the unconditional
+                        # branch). cfg_batch runs them as one batch of 2k, else one after the other.
+                        # The timestep is shared and broadcasts over the batch.
+                        pred_vid, pred_audio = self.model(
+                            vid=vids,
+                            audio=audios,
+                            t=timestep_input,
+                            audio_context=text_embeddings_pos,
+                            vid_context=text_embeddings_pos,
+                            neg_audio_context=[text_embeddings_audio_neg] * k,
+                            neg_vid_context=[text_embeddings_video_neg] * k,
+                            vid_seq_len=max_seq_len_video,
+                            audio_seq_len=max_seq_len_audio,
+                            first_frame_is_clean=is_i2v,
+                            slg_layer=slg_layer,
+                            cfg_batch=cfg_batch,
+                            cache_branch="cfg" if cfg_batch else ("pos", "neg")
+                        )
+                        pred_vid_pos, pred_vid_neg = pred_vid[:k], pred_vid[k:]
+                        pred_audio_pos, pred_audio_neg = pred_audio[:k], pred_audio[k:]
+                    else:
+                        # Positive (conditional) forward pass
+                        pos_forward_args = {
+                            'audio_context': text_embeddings_pos,
+                            'vid_context': text_embeddings_pos,
+                            'vid_seq_len': max_seq_len_video,
+                            'audio_seq_len': max_seq_len_audio,
+                            'first_frame_is_clean': is_i2v,
+                            'cache_branch': "pos"
+                        }
+
+                        pred_vid_pos, pred_audio_pos = self.model(
+                            vid=vids,
+                            audio=audios,
+                            t=timestep_input,
+                            **pos_forward_args
+                        )
 
                     # Apply classifier-free guidance
-                    pred_video_guided = pred_vid_neg[0] + video_guidance_scale * (pred_vid_pos[0] - pred_vid_neg[0])
-                    pred_audio_guided = pred_audio_neg[0] + audio_guidance_scale * (pred_audio_pos[0] - pred_audio_neg[0])
+                    pred_vid_pos, pred_audio_pos = torch.stack(pred_vid_pos), torch.stack(pred_audio_pos)
+                    if use_cfg:
+                        pred_vid_neg, pred_audio_neg = torch.stack(pred_vid_neg), torch.stack(pred_audio_neg)
+                        pred_video_guided = pred_vid_neg + video_scale * (pred_vid_pos - pred_vid_neg)
+                        pred_audio_guided = pred_audio_neg + audio_scale * (pred_audio_pos - pred_audio_neg)
+                        guidance_run.observe(i, [(pred_vid_pos, pred_vid_neg), (pred_audio_pos, pred_audio_neg)])
+                    else:
+                        pred_video_guided, pred_audio_guided = pred_vid_pos, pred_audio_pos
 
                     # Update noise using scheduler
-                    video_noise = scheduler_video.step(
-                        pred_video_guided.unsqueeze(0), t_v, video_noise.unsqueeze(0), return_dict=False
-                    )[0].squeeze(0)
-
-                    audio_noise = scheduler_audio.step(
-                        pred_audio_guided.unsqueeze(0), t_a, audio_noise.unsqueeze(0), return_dict=False
-                    )[0].squeeze(0)
-
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.model)
-                    self.vae_model_video.model = self.vae_model_video.model.to(
-                        self.device
+                    video_noise, audio_noise = scheduler.step(
+                        [pred_video_guided, pred_audio_guided], t, [video_noise, audio_noise]
                     )
-                    self.vae_model_audio = self.vae_model_audio.to(self.device)
-
-                if is_i2v:
-                    video_noise[:, :1] = latents_images
-
-                # Decode audio
-                audio_latents_for_vae = audio_noise.unsqueeze(0).transpose(1, 2)  # 1, c, l
-                generated_audio = self.vae_model_audio.wrapped_decode(audio_latents_for_vae)
-                generated_audio = generated_audio.squeeze().cpu().float().numpy()
-                
-                # Decode video  
-                video_latents_for_vae = video_noise.unsqueeze(0)  # 1, c, f, h, w
-                generated_video = self.vae_model_video.wrapped_decode(video_latents_for_vae)
-                generated_video = generated_video.squeeze(0).cpu().float().numpy()  # c, f, h, w
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.vae_model_video.model)
-                    self.offload_to_cpu(self.vae_model_audio)
-            return generated_video, generated_audio, image
 
+                    progress("denoise", step=i + 1, total=len(timesteps), batch=k, cfg=use_cfg)
+            logging.info(f"Guidance: {guidance_run.summary()}")
+            if step_cache is not None:
+                step_cache.log_report()
+            if self.model.block_streamer is not None:
+                logging.info(f"Block streaming: {self.model.block_streamer.report()}")
+            self._log_denoise_peak(forward_batch=2 * k if cfg_batch else k, seq_len=max_seq_len_video)
+
+            if self.cpu_offload and not self.block_offload:
+                self.offload_to_cpu(self.model)
+                self.vae_model_video.model = self.vae_model_video.model.to(
+                    self.device
+                )
+                self.vae_model_audio = self.vae_model_audio.to(self.device)
 
-        except Exception as e:
-            logging.error(traceback.format_exc())
-            return None
+            if is_i2v:
+                video_noise[:, :, :1] = latents_images
+
+            progress("decode", batch=k)
+            # Decode audio
+            audio_latents_for_vae = audio_noise.transpose(1, 2)  # k, c, l
+            generated_audio = self.vae_model_audio.wrapped_decode(audio_latents_for_vae)
+
+            # Decode video
+            generated_video = self.vae_model_video.wrapped_decode(video_noise)  # k, c, f, h, w
+            if self.cpu_offload:
+                self.offload_to_cpu(self.vae_model_video.model)
+                self.offload_to_cpu(self.vae_model_audio)
+
+        return [
+            (generated_video[j].cpu().float().numpy(),  # c, f, h, w
+             generated_audio[j].squeeze().cpu().float().numpy(),
+             group[j]["image"])
+            for j in range(k)
+        ]
             
+    def _log_denoise_peak(self, forward_batch, seq_len):
+        # only the peak is measured; the FFN figures are computed from the shapes (Linear out + GELU out of
+        # one video block, bf16), not measured against an unchunked run
+        chunk = self.model.video_model.blocks[0].ffn_chunk_size
+        ffn_bytes = lambda tokens: forward_batch * tokens * self.model.video_model.ffn_dim * 2 * 2
+        saved = ffn_bytes(seq_len) - ffn_bytes(min(chunk, seq_len)) if chunk else 0
+        logging.info(f"Denoise peak VRAM (measured): {torch.cuda.max_memory_allocated(self.device)/1e9:.2f} GB "
+                     f"(ffn_chunk_size={chunk or 'off'}, estimated FFN transient per block {ffn_bytes(seq_len)/1e9:.2f} GB"
+                     + (f", ~{saved/1e9:.2f} GB estimated saving from chunking)" if chunk else ")"))
+
     def offload_to_cpu(self, model):
         model = model.cpu()
         torch.cuda.synchronize()
@@ -380,38 +608,4 @@ class OviFusionEngine:
 
     def get_scheduler_time_steps(self, sampling_steps, solver_name='unipc', device=0, shift=5.0):
         torch.manual_seed(4)
-
-        if solver_name == 'unipc':
-            sample_scheduler = FlowUniPCMultistepScheduler(
-                num_train_timesteps=1000,
-                shift=1,
-                use_dynamic_shifting=False)
-            sample_scheduler.set_timesteps(
-                sampling_steps, device=device, shift=shift)
-            timesteps = sample_scheduler.timesteps
-
-        elif solver_name == 'dpm++':
-            sample_scheduler = FlowDPMSolverMultistepScheduler(
-                num_train_timesteps=1000,
-                shift=1,
-                use_dynamic_shifting=False)
-            sampling_sigmas = get_sampling_sigmas(sampling_steps, shift=shift)
-            timesteps, _ = retrieve_timesteps(
-                sample_scheduler,
-                device=device,
-                sigmas=sampling_sigmas)
-            
-        elif solver_name == 'euler':
-            sample_scheduler = FlowMatchEulerDiscreteScheduler(
-                shift=shift
-            )
-            timesteps, sampling_steps = retrieve_timesteps(
-                sample_scheduler,
-                sampling_steps,
-                device=device,
-            )
-        
-        else:
-            raise NotImplementedError("Unsupported solver.")
-        
-        return sample_scheduler, timesteps
+        return self.scheduler_factory.get(sampling_steps, solver_name=solver_name, device=device, shift=shift)
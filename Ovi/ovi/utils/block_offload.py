@@ -0,0 +1,127 @@
+import contextlib
+import logging
+
+import torch
+import torch.nn as nn
+
+
+class BlockStreamer:
+    """
+    Layer-streaming offload for FusionModel.
+
+    Everything except the transformer blocks (embeddings, time projection, heads) lives on `device`. Every fusion
+    block pair (video block i + audio block i) stays in host memory (pinned when CUDA is available) and is copied
+    to the device on a side stream `prefetch` blocks ahead of its use; the compute stream waits on the copy's
+    event, the weights are swapped in by pointer (`param.data = ...`) and dropped again after the block ran.
+    Prefetching wraps around, so block 0 of the next step is already loading while the last block runs.
+
+    On a CPU `device` the same fetch / prefetch / evict schedule runs with synchronous copies, which keeps the
+    logic exercisable on machines without a GPU.
+
+    Only FusionModel.forward's fused path streams (see FusionModel.block_streamer); the single-modality paths
+    would run on host weights.
+    """
+
+    def __init__(self, model, device, prefetch=1):
+        self.model = model
+        self.device = torch.device("cuda", device) if isinstance(device, int) else torch.device(device)
+        self.num_blocks = model.num_blocks
+        self.prefetch = min(max(0, int(prefetch)), self.num_blocks - 1)
+        self._cuda = self.device.type == "cuda"
+        self._stream = torch.cuda.Stream(self.device) if self._cuda else None
+        self._resident = {}  # block index -> (copy done event, device tensors)
+        self._active = set()  # blocks whose modules currently point at the device tensors
+        self.stats = {"fetches": 0, "prefetch_hits": 0, "sync_loads": 0}
+
+        # resident part: the towers without their blocks
+        for tower in (model.video_model, model.audio_model):
+            blocks = tower.blocks
+            tower.blocks = nn.ModuleList()
+            tower.to(self.device)
+            tower.blocks = blocks
+
+        # streamed part: host copies of every parameter / buffer of each block pair
+        self._host = []
+        host_bytes = 0
+        for i in range(self.num_blocks):
+            entries = []
+            for block in (model.video_model.blocks[i], model.audio_model.blocks[i]):
+                for module in block.modules():
+                    for store in (module._parameters, module._buffers):
+                        for name, t in store.items():
+                            if t is None:
+                                continue
+                            host = t.data.to("cpu")
+                            if self._cuda:
+                                host = host.pin_memory()
+                            t.data = host
+                            entries.append((t, host))
+                            host_bytes += host.numel() * host.element_size()
+            self._host.append(entries)
+        logging.info(f"Block streaming: {self.num_blocks} fusion blocks ({host_bytes/1e9:.2f} GB) in "
+                     f"{'pinned ' if self._cuda else ''}host memory, prefetch {self.prefetch} block(s) ahead on {self.device}")
+
+    def _load(self, i):
+        ctx = torch.cuda.stream(self._stream) if self._cuda else contextlib.nullcontext()
+        with ctx:
+            tensors = [host.to(self.device, non_blocking=True) if self._cuda else host.clone()
+                       for _, host in self._host[i]]
+            event = None
+            if self._cuda:
+                event = torch.cuda.Event()
+                event.record(self._stream)
+        self._resident[i] = (event, tensors)
+
+    def _evict(self, i):
+        self._resident.pop(i, None)
+        if i in self._active:
+            for t, host in self._host[i]:
+                t.data = host
+            self._active.discard(i)
+
+    def fetch(self, i):
+        """Make block pair i usable on the device (waits for its prefetch) and start prefetching the next ones."""
+        window = {(i + d) % self.num_blocks for d in range(self.prefetch + 1)}
+        for j in list(self._resident):
+            if j not in window:
+                self._evict(j)
+
+        self.stats["fetches"] += 1
+        if i in self._resident:
+            self.stats["prefetch_hits"] += 1
+        else:
+            self.stats["sync_loads"] += 1
+            self._load(i)
+
+        event, tensors = self._resident[i]
+        if self._cuda:
+            compute = torch.cuda.current_stream(self.device)
+            compute.wait_event(event)
+            for t in tensors:
+                t.record_stream(compute)  # allocated on the side stream, used on the compute stream
+        for (t, _), dev in zip(self._host[i], tensors):
+            t.data = dev
+        self._active.add(i)
+
+        for d in range(1, self.prefetch + 1):
+            j = (i + d) % self.num_blocks
+            if j not in self._resident:
+                self._load(j)
+
+    def release(self, i):
+        """Block pair i is done for this forward: point it back at host memory and free the device copy."""
+        self._evict(i)
+
+    def reset(self):
+        """
+        Drop every device copy (resident and prefetched). Needed whenever the host weights are rewritten between
+        generations (e.g. LoRA merge / restore): the wrap-around prefetch keeps block 0.. resident otherwise.
+        """
+        if self._cuda:
+            self._stream.synchronize()
+        for i in list(self._resident) + list(self._active):
+            self._evict(i)
+
+    def report(self):
+        s = self.stats
+        return f"{s['fetches']} block fetches, {s['prefetch_hits']} served by prefetch, {s['sync_loads']} synchronous loads"
@@ -0,0 +1,94 @@
+import logging
+import math
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple, Union
+
+
+@dataclass
+class GuidanceSchedule:
+    """
+    When and how strongly classifier-free guidance is applied during sampling.
+
+    curve: per-step multiplier on the configured guidance scale. "constant", "linear" or "cosine" go from 1.0
+        at the first step to `end_ratio` at the last one; a list of floats is an explicit curve, resampled
+        linearly to the number of steps.
+    interval: (sigma_low, sigma_high). Outside this range no guidance is applied (scale 1.0).
+    adaptive_threshold: once the relative difference ||cond - uncond|| / ||cond|| drops below this value
+        (for both modalities and all samples), guidance is switched off for the remaining steps. 0 disables it.
+
+    A step whose effective scales are 1.0 for video and audio needs no unconditional forward at all.
+    """
+    curve: Union[str, Sequence[float]] = "constant"
+    end_ratio: float = 1.0
+    interval: Optional[Tuple[float, float]] = None
+    adaptive_threshold: float = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        interval = config.get("guidance_interval", None)
+        curve = config.get("guidance_curve", "constant")
+        return cls(
+            curve=curve if isinstance(curve, str) else [float(c) for c in curve],
+            end_ratio=float(config.get("guidance_end_ratio", 1.0)),
+            interval=tuple(float(s) for s in interval) if interval else None,
+            adaptive_threshold=float(config.get("guidance_adaptive_threshold", 0.0)),
+        )
+
+    def multiplier(self, step, num_steps):
+        frac = step / max(num_steps - 1, 1)
+        if isinstance(self.curve, str):
+            if self.curve == "constant":
+                return 1.0
+            if self.curve == "linear":
+                return 1.0 + (self.end_ratio - 1.0) * frac
+            if self.curve == "cosine":
+                return self.end_ratio + (1.0 - self.end_ratio) * 0.5 * (1.0 + math.cos(math.pi * frac))
+            raise ValueError(f"Unknown guidance curve {self.curve!r}")
+        curve = list(self.curve)
+        if len(curve) == 1:
+            return curve[0]
+        pos = frac * (len(curve) - 1)
+        lo = min(int(pos), len(curve) - 2)
+        return curve[lo] + (curve[lo + 1] - curve[lo]) * (pos - lo)
+
+    def start(self, timesteps, num_train_timesteps=1000):
+        """Per-generation state; `timesteps` is the solver's timestep table (sigma = t / num_train_timesteps)."""
+        return GuidanceRun(self, [float(t) / num_train_timesteps for t in timesteps.tolist()])
+
+
+class GuidanceRun:
+    def __init__(self, schedule, sigmas):
+        self.schedule = schedule
+        self.sigmas = sigmas
+        self.converged_at = None
+        self.cfg_steps = 0
+
+    def scales(self, step, video_scale, audio_scale):
+        """Effective (video, audio) guidance scale for `step`; (1.0, 1.0) means: skip the unconditional pass."""
+        s = self.schedule
+        if self.converged_at is not None:
+            return 1.0, 1.0
+        if s.interval is not None:
+            lo, hi = min(s.interval), max(s.interval)
+            if not lo <= self.sigmas[step] <= hi:
+                return 1.0, 1.0
+        m = s.multiplier(step, len(self.sigmas))
+        return 1.0 + (video_scale - 1.0) * m, 1.0 + (audio_scale - 1.0) * m
+
+    def observe(self, step, pairs):
+        """pairs: [(cond, uncond), ...] predictions of the step that just ran with guidance."""
+        self.cfg_steps += 1
+        threshold = self.schedule.adaptive_threshold
+        if threshold <= 0:
+            return
+        diff = max(
+            ((cond.float() - uncond.float()).flatten(1).norm(dim=1) / cond.float().flatten(1).norm(dim=1).clamp_min(1e-6)).max()
+            for cond, uncond in pairs
+        ).item()
+        if diff < threshold:
+            self.converged_at = step
+            logging.info(f"Guidance converged at step {step + 1}/{len(self.sigmas)} (relative difference {diff:.4f} < {threshold}), "
+                         f"skipping the unconditional pass from here on")
+
+    def summary(self):
+        return f"unconditional pass ran on {self.cfg_steps}/{len(self.sigmas)} steps"
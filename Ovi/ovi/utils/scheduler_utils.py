@@ -0,0 +1,93 @@
+import copy
+
+import torch
+from diffusers import FlowMatchEulerDiscreteScheduler
+
+from ovi.utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
+                                  get_sampling_sigmas, retrieve_timesteps)
+from ovi.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+
+
+def build_scheduler(sampling_steps, solver_name='unipc', device=0, shift=5.0):
+    if solver_name == 'unipc':
+        sample_scheduler = FlowUniPCMultistepScheduler(
+            num_train_timesteps=1000,
+            shift=1,
+            use_dynamic_shifting=False)
+        sample_scheduler.set_timesteps(
+            sampling_steps, device=device, shift=shift)
+        timesteps = sample_scheduler.timesteps
+
+    elif solver_name == 'dpm++':
+        sample_scheduler = FlowDPMSolverMultistepScheduler(
+            num_train_timesteps=1000,
+            shift=1,
+            use_dynamic_shifting=False)
+        sampling_sigmas = get_sampling_sigmas(sampling_steps, shift=shift)
+        timesteps, _ = retrieve_timesteps(
+            sample_scheduler,
+            device=device,
+            sigmas=sampling_sigmas)
+
+    elif solver_name == 'euler':
+        sample_scheduler = FlowMatchEulerDiscreteScheduler(
+            shift=shift
+        )
+        timesteps, sampling_steps = retrieve_timesteps(
+            sample_scheduler,
+            sampling_steps,
+            device=device,
+        )
+
+    else:
+        raise NotImplementedError("Unsupported solver.")
+
+    return sample_scheduler, timesteps
+
+
+class SchedulerFactory:
+    """
+    Builds each (solver, steps, shift, device) schedule once. Later calls hand out a fresh copy of the
+    prepared scheduler (own multistep state, shared-value timestep/sigma tables already on device)
+    instead of recomputing sigmas and timesteps.
+    """
+
+    def __init__(self):
+        self._templates = {}
+
+    def get(self, sampling_steps, solver_name='unipc', device=0, shift=5.0):
+        key = (solver_name, int(sampling_steps), float(shift), str(device))
+        if key not in self._templates:
+            self._templates[key] = build_scheduler(sampling_steps, solver_name=solver_name, device=device, shift=shift)
+        template, timesteps = self._templates[key]
+        return copy.deepcopy(template), timesteps
+
+
+class MultiStreamScheduler:
+    """
+    Steps several latent streams (e.g. video and audio) that share one timestep schedule with a single
+    solver: the streams are flattened per sample and concatenated, so the multistep history, sigma
+    lookups and per-step bookkeeping run once instead of once per stream.
+
+    The deterministic solvers (unipc, dpm++, euler) only combine tensors elementwise, so the result is
+    identical to stepping every stream with its own scheduler. SDE variants would draw their noise for
+    the packed tensor instead.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    @staticmethod
+    def pack(tensors):
+        # [k, ...] per stream -> [k, sum(numel / k)]
+        return torch.cat([u.flatten(1) for u in tensors], dim=1)
+
+    @staticmethod
+    def unpack(packed, like):
+        sizes = [u[0].numel() for u in like]
+        return [p.view_as(u) for p, u in zip(packed.split(sizes, dim=1), like)]
+
+    def step(self, model_outputs, timestep, samples):
+        """model_outputs / samples: lists of [k, ...] tensors, one per stream. Returns the next samples."""
+        prev = self.scheduler.step(self.pack(model_outputs), timestep, self.pack(samples), return_dict=False)[0]
+        return self.unpack(prev, samples)
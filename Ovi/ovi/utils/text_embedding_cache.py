@@ -0,0 +1,131 @@
+import contextlib
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+import torch
+from safetensors.torch import load_file, save_file
+
+# on-disk size cap, oldest files (by mtime, refreshed on every disk hit) are removed first
+TEXT_CACHE_MAX_BYTES = int(float(os.getenv("OVI_TEXT_CACHE_MAX_GB", "5")) * 1024 ** 3)
+
+
+class TextEmbeddingCache:
+    """
+    LRU cache for T5 prompt embeddings, in memory (CPU tensors) plus one safetensors file per prompt hash on disk.
+
+    Keys hash the prompt together with `namespace` (text encoder checkpoint identity + text_len), so a
+    different or updated T5 checkpoint never reads embeddings written by another one.
+    """
+
+    def __init__(self, namespace, max_items=128, cache_dir=None, max_disk_bytes=TEXT_CACHE_MAX_BYTES):
+        self.namespace = namespace
+        self.max_items = max_items
+        self.cache_dir = cache_dir or None
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_bytes = None  # running estimate, initialised by a directory scan on the first write
+        self._mem = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.safetensors")
+
+    def get(self, text):
+        key = self.key(text)
+        emb = self._mem.get(key)
+        if emb is not None:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return emb
+
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                emb = load_file(self._path(key))["embedding"]
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable text embedding cache file {self._path(key)}: {e}")
+            else:
+                with contextlib.suppress(OSError):
+                    os.utime(self._path(key))  # keeps recently used files out of the eviction
+                self._remember(key, emb)
+                self.hits += 1
+                return emb
+
+        self.misses += 1
+        return None
+
+    def put(self, text, emb):
+        key = self.key(text)
+        emb = emb.detach().to("cpu").contiguous()
+        self._remember(key, emb)
+        if self.cache_dir:
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_file({"embedding": emb}, tmp)
+                os.replace(tmp, path)  # concurrent workers never see half-written files
+                self._trim_disk(os.path.getsize(path))
+            except OSError as e:
+                # full / read-only disk: the embedding is computed and stays cached in memory
+                logging.warning(f"Could not write text embedding cache file {path}: {e}")
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".safetensors"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # removed by another worker meanwhile
+                files.append((st.st_mtime_ns, st.st_size, path))
+        return files
+
+    def _trim_disk(self, added):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+        else:
+            self._disk_bytes += added
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        # rescan (other workers share the directory), then drop the oldest files down to 90% of the cap
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if total <= 0.9 * self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._disk_bytes = total
+        logging.info(f"Text embedding cache: removed {removed} old files, {total / 1024 ** 3:.2f} GB on disk")
+
+    def _remember(self, key, emb):
+        self._mem[key] = emb
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+
+def checkpoint_namespace(checkpoint_path, text_len):
+    try:
+        st = os.stat(checkpoint_path)
+        ident = f"{os.path.realpath(checkpoint_path)}:{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        ident = checkpoint_path
+    return f"{ident}:{text_len}:{torch.bfloat16}"
@@ -0,0 +1,74 @@
+"""
+Parity of the CPU attention backends ("sdpa", "chunked") with a per-sample reference on the unpadded
+tokens: padded k_lens / q_lens, causal masking, grouped-query heads and samples without any key.
+
+    cd /workspace/Ovi && python -m pytest -q tests/test_attention.py
+"""
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ovi.modules import attention as attn  # noqa: E402
+
+BACKENDS = ["sdpa", "chunked"]
+
+CASES = {
+    # name: (Lq, Lk, q_lens, k_lens, Nq, Nk)
+    "unpadded": (9, 11, None, None, 4, 4),
+    "padded_keys": (9, 11, None, [11, 6], 4, 4),
+    "padded_queries": (9, 11, [9, 4], None, 4, 4),
+    "padded_both": (9, 11, [7, 9], [5, 11], 4, 4),
+    "empty_keys": (9, 11, None, [11, 0], 4, 4),
+    "empty_keys_padded_queries": (9, 11, [5, 9], [0, 8], 4, 4),
+    "grouped_query_heads": (9, 11, [9, 6], [11, 7], 4, 2),
+}
+
+
+def reference(q, k, v, q_lens, k_lens, causal):
+    # plain softmax attention per sample on its real tokens, zeros everywhere else
+    out = torch.zeros(q.size(0), q.size(1), q.size(2), v.size(-1))
+    rep = q.size(2) // k.size(2)
+    for b in range(q.size(0)):
+        lq = q.size(1) if q_lens is None else int(q_lens[b])
+        lk = k.size(1) if k_lens is None else int(k_lens[b])
+        if lk == 0:
+            continue
+        q_ = q[b, :lq].transpose(0, 1)                                   # N lq C
+        k_ = k[b, :lk].repeat_interleave(rep, dim=1).transpose(0, 1)
+        v_ = v[b, :lk].repeat_interleave(rep, dim=1).transpose(0, 1)
+        scores = q_ @ k_.transpose(-1, -2) * q.size(-1) ** -0.5
+        if causal:
+            scores.masked_fill_(torch.ones(lq, lk, dtype=torch.bool).tril().logical_not(), float('-inf'))
+        out[b, :lq] = (scores.softmax(-1) @ v_).transpose(0, 1)
+    return out
+
+
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("case", list(CASES))
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_matches_reference(backend, case, causal, monkeypatch):
+    # small chunks so the chunked backend runs several of them, with a partial last one
+    monkeypatch.setattr(attn, "ATTN_CHUNK_SIZE", 4)
+    lq, lk, q_lens, k_lens, nq, nk = CASES[case]
+    torch.manual_seed(0)
+    q, k, v = torch.randn(2, lq, nq, 16), torch.randn(2, lk, nk, 16), torch.randn(2, lk, nk, 16)
+    q_lens = torch.tensor(q_lens, dtype=torch.int32) if q_lens is not None else None
+    k_lens = torch.tensor(k_lens, dtype=torch.int32) if k_lens is not None else None
+
+    out = attn.ATTENTION_BACKENDS[backend].fn(q, k, v, q_lens, k_lens, dropout_p=0., softmax_scale=None,
+                                              causal=causal, window_size=(-1, -1), deterministic=False,
+                                              dtype=torch.bfloat16).float()
+    ref = reference(q, k, v, q_lens, k_lens, causal)
+
+    assert not out.isnan().any()
+    assert torch.allclose(out, ref, atol=1e-5, rtol=1e-4)
+
+
+def test_flash_attention_selects_a_cpu_backend():
+    q = torch.randn(1, 5, 2, 16, dtype=torch.bfloat16)
+    out = attn.flash_attention(q, q, q, k_lens=torch.tensor([0]))
+    assert out.dtype == torch.bfloat16 and torch.equal(out, torch.zeros_like(out))
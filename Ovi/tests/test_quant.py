@@ -0,0 +1,144 @@
+"""
+Weight-only quantization (ovi.modules.quant) on CPU: quantize -> dequantize round trips, int4 packing,
+format validation, QuantLinear dtype handling and replace_linear_layers.
+
+    cd /workspace/Ovi && python -m pytest -q tests/test_quant.py
+"""
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+nn = torch.nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ovi.modules.quant import (DEFAULT_GROUP_SIZE, QuantLinear, dequantize_weight, quant_checkpoint_name,  # noqa: E402
+                               quantize_weight, replace_linear_layers)
+
+# (format, group_size)
+CASES = [("int8", 0), ("int8", 32), ("int4", 0), ("int4", 32), ("fp8", 0), ("fp8", 32)]
+
+# relative output error of a quantized linear against the float one
+REL_TOL = {"int8": 0.02, "int4": 0.15, "fp8": 0.08}
+
+
+def _rel_err(out, ref):
+    return ((out - ref).norm() / ref.norm()).item()
+
+
+def _scale_per_element(scale, shape):
+    out_features, n_groups = scale.shape
+    return scale.unsqueeze(-1).expand(out_features, n_groups, shape[1] // n_groups).reshape(shape)
+
+
+@pytest.mark.parametrize("fmt,group_size", CASES)
+def test_round_trip(fmt, group_size):
+    torch.manual_seed(0)
+    w = torch.randn(48, 64)
+    q, s = quantize_weight(w, fmt, group_size)
+    assert s.dtype == torch.float32 and s.shape == (48, 64 // group_size if group_size else 1)
+    assert q.shape == ((48, 32) if fmt == "int4" else (48, 64))
+
+    deq = dequantize_weight(q, s, fmt, torch.float32)
+    err = (deq - w).abs()
+    if fmt == "fp8":
+        # e4m3: 3 mantissa bits, half a step is 2^-4 relative (looser near zero / subnormals)
+        assert (err <= w.abs() * 2 ** -4 + _scale_per_element(s, w.shape) * 2 ** -6).all()
+    else:
+        # symmetric rounding: at most half a quantization step per element
+        assert (err <= _scale_per_element(s, w.shape) * 0.5 + 1e-6).all()
+
+
+def test_int4_nibble_order():
+    # scale 1 (row amax 7): values -7..7 land on the integers, stored offset by 8, even columns in the low nibble
+    w = torch.tensor([[7.0, -7.0, 0.0, 7.0], [1.0, 2.0, -3.0, 7.0]])
+    q, s = quantize_weight(w, "int4", 0)
+    assert torch.equal(s, torch.ones(2, 1))
+    assert q.dtype == torch.uint8
+    assert q.tolist() == [[15 | (1 << 4), 8 | (15 << 4)], [9 | (10 << 4), 5 | (15 << 4)]]
+    assert torch.equal(dequantize_weight(q, s, "int4", torch.float32), w)
+
+
+@pytest.mark.parametrize("fmt,group_size,in_features", [
+    ("int8", 48, 64),   # 64 % 48 != 0
+    ("int4", 0, 63),    # two weights per byte
+    ("int3", 0, 64),    # unknown format
+])
+def test_invalid_format(fmt, group_size, in_features):
+    with pytest.raises(ValueError):
+        quantize_weight(torch.randn(8, in_features), fmt, group_size)
+    with pytest.raises(ValueError):
+        QuantLinear(in_features, 8, fmt=fmt, group_size=group_size)
+
+
+@pytest.mark.parametrize("fmt,group_size", CASES)
+def test_quant_linear_matches_dequantized(fmt, group_size):
+    torch.manual_seed(0)
+    linear = nn.Linear(64, 16)
+    m = QuantLinear.from_linear(linear, fmt, group_size)
+    x = torch.randn(3, 64)
+    ref = torch.nn.functional.linear(x, m.dequantize(torch.float32), linear.bias)
+    assert torch.allclose(m(x), ref, atol=1e-5)
+    assert _rel_err(m(x), linear(x)) < REL_TOL[fmt]
+
+
+@pytest.mark.parametrize("fmt", ["int8", "int4", "fp8"])
+def test_dtype_cast_keeps_storage(fmt):
+    m = QuantLinear.from_linear(nn.Linear(64, 16), fmt, 32)
+    qweight, scale = m.qweight.clone(), m.scale.clone()
+    m.to(torch.bfloat16)
+    m.half()
+    m.float()
+    # storage is untouched bit for bit, only the bias follows the dtype
+    assert m.qweight.dtype == qweight.dtype and m.scale.dtype == torch.float32
+    assert torch.equal(m.qweight.view(torch.uint8), qweight.view(torch.uint8))
+    assert torch.equal(m.scale, scale)
+    assert m.bias.dtype == torch.float32
+
+
+def test_replace_linear_layers():
+    class Block(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.ffn = nn.Sequential(nn.Linear(64, 128), nn.GELU(), nn.Linear(128, 64))
+
+        def forward(self, x):
+            return self.ffn(x)
+
+    class Model(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.embed = nn.Linear(64, 64)
+            self.blocks = nn.ModuleList([Block(), Block()])
+
+        def forward(self, x):
+            x = self.embed(x)
+            for block in self.blocks:
+                x = block(x)
+            return x
+
+    torch.manual_seed(0)
+    model = Model()
+    x = torch.randn(2, 64)
+    ref = model(x)
+
+    replaced = replace_linear_layers(model, "int8", quantize=True)
+    # default filter: only the linears inside .blocks.
+    assert replaced == ["blocks.0.ffn.0", "blocks.0.ffn.2", "blocks.1.ffn.0", "blocks.1.ffn.2"]
+    assert type(model.embed) is nn.Linear
+    assert all(isinstance(model.get_submodule(name), QuantLinear) for name in replaced)
+    assert _rel_err(model(x), ref) < REL_TOL["int8"]
+
+    # empty layers on meta, as used to load a pre-quantized checkpoint with assign=True
+    seq = nn.Sequential(nn.Linear(256, 128), nn.Linear(128, 8)).to("meta")
+    replaced = replace_linear_layers(seq, "int4", filter_fn=lambda name, module: True)
+    assert replaced == ["0", "1"]
+    assert seq[0].qweight.is_meta and seq[0].qweight.shape == (128, 128)
+    assert seq[1].group_size == DEFAULT_GROUP_SIZE["int4"] and seq[1].scale.shape == (8, 1)
+
+
+def test_quant_checkpoint_name():
+    assert quant_checkpoint_name("model_960x960.safetensors", "int4") == "model_960x960_int4_g128.safetensors"
+    assert quant_checkpoint_name("model.safetensors", "int8") == "model_int8.safetensors"
+    assert quant_checkpoint_name("model.safetensors", "fp8", 64) == "model_fp8_g64.safetensors"
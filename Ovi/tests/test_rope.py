@@ -0,0 +1,68 @@
+"""
+Parity of the cached real-valued RoPE (rope_apply_real) with the float64 complex reference
+(rope_apply_complex) for the video (3D) and audio (1D) layouts of WanModel, on CPU.
+
+    cd /workspace/Ovi && python -m pytest -q tests/test_rope.py
+"""
+import json
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ovi.modules.model import audio_rope_freqs, rope_apply_complex, rope_apply_real, video_rope_freqs  # noqa: E402
+
+HEADS, HEAD_DIM = 4, 128
+AUDIO_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ovi/configs/model/dit/audio.json")
+
+
+def video_freqs():
+    return video_rope_freqs(HEAD_DIM)
+
+
+def audio_freqs():
+    with open(AUDIO_CONFIG) as f:
+        return audio_rope_freqs(HEAD_DIM, json.load(f)["temporal_rope_scaling_factor"])
+
+
+CASES = {
+    # name: (grid_sizes, padded seq_len, freqs factory)
+    "video_3d_single": ([[3, 4, 5]], 3 * 4 * 5, video_freqs),
+    "video_3d_padded_batch": ([[3, 4, 5]] * 3, 3 * 4 * 5 + 7, video_freqs),
+    "video_3d_mixed_grids": ([[3, 4, 5], [2, 4, 5], [3, 2, 6]], 3 * 4 * 5, video_freqs),
+    "audio_1d_single": ([[157]], 157, audio_freqs),
+    "audio_1d_padded_batch": ([[157]] * 2, 160, audio_freqs),
+    "audio_1d_mixed_lengths": ([[157], [100]], 157, audio_freqs),
+}
+
+# fp32 tables match the float64 path up to bf16 output rounding, bf16 tables up to bf16 math
+DTYPES = {"fp32": (torch.float32, 1e-2), "bf16": (torch.bfloat16, 3e-2)}
+
+
+@pytest.mark.parametrize("dtype_name", list(DTYPES))
+@pytest.mark.parametrize("case", list(CASES))
+def test_rope_real_matches_complex(case, dtype_name):
+    grids, seq_len, freqs_fn = CASES[case]
+    dtype, tol = DTYPES[dtype_name]
+    torch.manual_seed(0)
+    grid_sizes = torch.tensor(grids, dtype=torch.long)
+    x = torch.randn(len(grids), seq_len, HEADS, HEAD_DIM).bfloat16()
+    freqs = freqs_fn()
+
+    ref = rope_apply_complex(x, grid_sizes, freqs).float()
+    out = rope_apply_real(x, grid_sizes, freqs, dtype=dtype).float()
+
+    assert out.shape == ref.shape
+    assert torch.allclose(out, ref, rtol=0, atol=tol * ref.abs().max().item())
+
+
+def test_rope_table_cache_is_stable():
+    grid_sizes = torch.tensor([[3, 4, 5]] * 2, dtype=torch.long)
+    x = torch.randn(2, 3 * 4 * 5 + 3, HEADS, HEAD_DIM).bfloat16()
+    freqs = video_freqs()
+    first = rope_apply_real(x, grid_sizes, freqs)
+    # second call is served from the cos/sin table cache
+    assert torch.equal(first, rope_apply_real(x, grid_sizes, freqs))
@@ -0,0 +1,77 @@
+# /workspace/Ovi/tools/bench_attention.py
+"""
+Benchmark the registered attention backends (ovi.modules.attention.ATTENTION_BACKENDS) against each other
+on one shape, and check them against the exact fp32 "chunked" backend.
+
+    cd /workspace/Ovi
+    python tools/bench_attention.py                                   # video self-attention, 720x720_5s-ish
+    python tools/bench_attention.py --lq 157 --lk 512 --k-len 300     # audio cross-attention with padded text
+    python tools/bench_attention.py --device cpu --lq 2048 --lk 2048  # CPU draft sizes
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ovi.modules import attention  # noqa: E402
+
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--dtype", default="bf16", choices=["bf16", "fp16"])
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--lq", type=int, default=21 * 22 * 40)
+    ap.add_argument("--lk", type=int, default=None, help="defaults to --lq (self-attention)")
+    ap.add_argument("--k-len", type=int, default=None, help="valid keys per sample, rest is padding")
+    ap.add_argument("--heads", type=int, default=24)
+    ap.add_argument("--head-dim", type=int, default=128)
+    ap.add_argument("--iters", type=int, default=10)
+    ap.add_argument("--backends", default=",".join(attention.ATTENTION_BACKENDS))
+    args = ap.parse_args()
+
+    device = torch.device(args.device)
+    dtype = torch.bfloat16 if args.dtype == "bf16" else torch.float16
+    lk = args.lk or args.lq
+    torch.manual_seed(0)
+    q = torch.randn(args.batch, args.lq, args.heads, args.head_dim, device=device, dtype=dtype)
+    k = torch.randn(args.batch, lk, args.heads, args.head_dim, device=device, dtype=dtype)
+    v = torch.randn(args.batch, lk, args.heads, args.head_dim, device=device, dtype=dtype)
+    k_lens = torch.tensor([args.k_len] * args.batch, dtype=torch.long) if args.k_len else None
+
+    call = dict(q_lens=None, k_lens=k_lens, dropout_p=0., softmax_scale=None, causal=False,
+                window_size=(-1, -1), deterministic=False, dtype=dtype)
+    ref = attention.ATTENTION_BACKENDS["chunked"].fn(q, k, v, **call).float()
+
+    print(f"q={tuple(q.shape)} k={tuple(k.shape)} k_len={args.k_len or lk} device={device} dtype={dtype}")
+    print(f"{'backend':<10} {'ms/call':>10} {'max_abs_err':>12}")
+    for name in args.backends.split(","):
+        backend = attention.ATTENTION_BACKENDS.get(name)
+        if backend is None:
+            print(f"{name:<10} {'unknown':>10}")
+            continue
+        # "chunked" and "sdpa" off-GPU are always runnable; the selection thresholds don't matter here
+        if name not in ("chunked", "sdpa") and not backend.supports(q, k, v, (-1, -1), 0., None):
+            print(f"{name:<10} {'n/a':>10}")
+            continue
+        out = backend.fn(q, k, v, **call)
+        _sync(device)
+        t0 = time.perf_counter()
+        for _ in range(args.iters):
+            backend.fn(q, k, v, **call)
+        _sync(device)
+        ms = (time.perf_counter() - t0) * 1000 / args.iters
+        err = (out.float() - ref).abs().max().item()
+        print(f"{name:<10} {ms:>10.2f} {err:>12.3e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# /workspace/Ovi/tools/quantize_checkpoint.py
+"""
+Write a pre-quantized fusion checkpoint (ovi.modules.quant) next to the bf16 one, for the `quant` /
+`quant_group_size` options of the run config.
+
+    cd /workspace/Ovi
+    python tools/quantize_checkpoint.py --model-name 960x960_10s --format int8
+    python tools/quantize_checkpoint.py --model-name all --format int4 --group-size 128
+
+The linear layers of the fusion blocks are quantized, everything else is stored in bf16. Source tensors
+are read one by one, so only the output state dict (quantized block linears + bf16 rest) is held in memory,
+not the source bf16 state dict on top of it.
+"""
+import argparse
+import json
+import os
+import sys
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ovi.model_specs import NAME_TO_MODEL_SPECS_MAP  # noqa: E402
+from ovi.modules.quant import (DEFAULT_GROUP_SIZE, QUANT_FORMATS, dequantize_weight, quant_checkpoint_name,  # noqa: E402
+                               quantize_weight, replace_linear_layers)
+from ovi.utils.model_loading_utils import init_fusion_score_model_ovi  # noqa: E402
+
+
+def quantize_file(src, dst, fmt, group_size):
+    # meta model: which linears get quantized and which keys the quantized state dict must have
+    model, _, _ = init_fusion_score_model_ovi(rank=0, meta_init=True)
+    quantized = set(replace_linear_layers(model, fmt, group_size))
+    expected = set(model.state_dict().keys())
+
+    out, max_err = {}, 0.0
+    with safe_open(src, framework="pt", device="cpu") as f:
+        for key in f.keys():
+            t = f.get_tensor(key)
+            module, _, leaf = key.rpartition(".")
+            if module in quantized and leaf == "weight":
+                q, s = quantize_weight(t, fmt, group_size)
+                out[f"{module}.qweight"], out[f"{module}.scale"] = q, s
+                rel = (dequantize_weight(q, s, fmt, torch.float32) - t.float()).abs().mean() / t.float().abs().mean()
+                max_err = max(max_err, rel.item())
+            else:
+                out[key] = t.to(torch.bfloat16) if t.is_floating_point() else t
+
+    missing, unexpected = expected - set(out), set(out) - expected
+    if missing or unexpected:
+        raise RuntimeError(f"{src}: quantized state dict does not match the model, "
+                           f"missing {sorted(missing)[:5]}, unexpected {sorted(unexpected)[:5]}")
+
+    metadata = {
+        "quant_format": fmt,
+        "quant_group_size": str(group_size),
+        "quantized_modules": json.dumps(sorted(quantized)),
+        "source": os.path.basename(src),
+    }
+    tmp = dst + ".tmp"
+    save_file(out, tmp, metadata=metadata)
+    os.replace(tmp, dst)
+    print(f"{dst}: {len(quantized)} linears as {fmt} (group_size {group_size}), "
+          f"{os.path.getsize(src)/1e9:.2f} GB -> {os.path.getsize(dst)/1e9:.2f} GB, max mean rel. weight error {max_err:.3e}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ckpt-dir", default="./ckpts")
+    ap.add_argument("--model-name", default="all", help=f"one of {list(NAME_TO_MODEL_SPECS_MAP)} or 'all'")
+    ap.add_argument("--format", default="int8", choices=QUANT_FORMATS)
+    ap.add_argument("--group-size", type=int, default=None, help="input channels per scale, 0 = per output channel")
+    ap.add_argument("--overwrite", action="store_true")
+    args = ap.parse_args()
+
+    names = list(NAME_TO_MODEL_SPECS_MAP) if args.model_name == "all" else [args.model_name]
+    group_size = DEFAULT_GROUP_SIZE[args.format] if args.group_size is None else args.group_size
+    done = set()
+    for name in names:
+        basename = NAME_TO_MODEL_SPECS_MAP[name]["path"]
+        if basename in done:  # e.g. 720x720_5s and 720x720_3s share one checkpoint
+            continue
+        done.add(basename)
+        src = os.path.join(args.ckpt_dir, "Ovi", basename)
+        dst = os.path.join(args.ckpt_dir, "Ovi", quant_checkpoint_name(basename, args.format, group_size))
+        if not os.path.exists(src):
+            print(f"{name}: {src} not found, skipping")
+            continue
+        if os.path.exists(dst) and not args.overwrite:
+            print(f"{name}: {dst} exists, skipping (--overwrite to redo)")
+            continue
+        quantize_file(src, dst, args.format, group_size)
+
+
+if __name__ == "__main__":
+    main()
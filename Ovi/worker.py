@@ -0,0 +1,242 @@
+# /workspace/Ovi/worker.py
+"""
+Long-lived OVI worker: builds OviFusionEngine once and serves jobs over stdin/stdout.
+
+Protocol (one JSON object per line):
+    -> {"cmd": "run", "job_id": "...", "run_json": "/abs/run.json", "log_file": "/abs/job.log"}
+    <- {"type": "event", "job_id": "...", "stage": "denoise", "step": 3, "total": 35, "sample": 0, "num_samples": 1, "ts": ...}
+    <- {"type": "result", "job_id": "...", "exit_code": 0, "error": null, "outputs": ["/abs/x.mp4"]}
+    -> {"cmd": "run_batch", "jobs": [{"job_id": ..., "run_json": ..., "log_file": ...}, ...]}
+    <- {"type": "event", ...} / {"type": "item_result", "job_id": ..., ...}   (per job, as they finish)
+    <- {"type": "result", "job_id": null, "results": [...]}
+    -> {"cmd": "ping"}
+    <- {"type": "pong", "engine_key": [...]}
+    -> {"cmd": "shutdown"}
+
+The engine is only rebuilt when the engine-level part of the run config changes (see ENGINE_KEYS).
+run_batch denoises jobs with the same engine and sampling config (inference.sampling_key) together:
+their samples are packed into shared generate_batch calls of up to batch_size samples.
+Everything the job prints (logging, tqdm, native libs) goes into the job's log_file, exactly like
+the old `python inference.py --config-file run.json > job.log` call.
+"""
+import contextlib
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+
+import torch
+from omegaconf import OmegaConf
+
+from inference import generate_jobs, generate_samples, load_eval_data, sampling_key
+from ovi.distributed_comms.parallel_states import initialize_sequence_parallel_state
+from ovi.ovi_fusion_engine import OviFusionEngine
+
+# run.json keys that require a new OviFusionEngine when they change
+ENGINE_KEYS = ("model_name", "fp8", "qint8", "quant", "quant_group_size", "cpu_offload", "block_offload", "block_prefetch")
+
+
+def engine_key(config):
+    key = [
+        config.get("model_name", "960x960_5s"),
+        bool(config.get("fp8", False)),
+        bool(config.get("qint8", False)),
+        config.get("quant") or None,
+        config.get("quant_group_size"),
+        bool(config.get("cpu_offload", False)),
+        bool(config.get("block_offload", False)),
+        int(config.get("block_prefetch", 1)),
+    ]
+    # ckpt_dir decides which files get loaded, t2i2v additionally loads Flux + forces offload
+    key.append(str(config.get("ckpt_dir")))
+    key.append(config.get("mode") == "t2i2v")
+    return key
+
+
+class _Worker:
+    def __init__(self, proto_out, device=0):
+        self.proto_out = proto_out
+        self.device = device
+        self.engine = None
+        self.engine_key = None
+
+    def send(self, payload):
+        self.proto_out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        self.proto_out.flush()
+
+    def event(self, job_id, stage, **info):
+        self.send({"type": "event", "job_id": job_id, "stage": stage, "ts": time.time(), **info})
+
+    def _ensure_engine(self, config, job_id=None):
+        key = engine_key(config)
+        if self.engine is not None and key == self.engine_key:
+            logging.info(f"[OVI-WORKER] reusing warm engine {key}")
+            return self.engine
+
+        if self.engine is not None:
+            logging.info(f"[OVI-WORKER] engine config changed {self.engine_key} -> {key}, reloading")
+            self.engine = None
+            self.engine_key = None
+            gc.collect()
+            torch.cuda.empty_cache()
+
+        logging.info("Loading OVI Fusion Engine...")
+        self.event(job_id, "load")
+        self.engine = OviFusionEngine(config=config, device=self.device, target_dtype=torch.bfloat16)
+        self.engine_key = key
+        logging.info("OVI Fusion Engine loaded!")
+        return self.engine
+
+    def _run_job(self, msg):
+        job_id = msg.get("job_id")
+        try:
+            with _redirect_output(msg["log_file"]):
+                try:
+                    config = OmegaConf.load(msg["run_json"])
+                    eval_data = load_eval_data(config)
+                    engine = self._ensure_engine(config, job_id=job_id)
+
+                    output_dir = config.get("output_dir", "./outputs")
+                    os.makedirs(output_dir, exist_ok=True)
+                    outputs = generate_samples(engine, config, eval_data, output_dir,
+                                               progress_callback=lambda stage, **info: self.event(job_id, stage, **info))
+                except Exception:
+                    traceback.print_exc()
+                    raise
+        except Exception as e:
+            return {"job_id": job_id, "exit_code": 1, "error": repr(e), "outputs": []}
+
+        return {"job_id": job_id, "exit_code": 0, "error": None, "outputs": outputs}
+
+    def run(self, msg):
+        self.send({"type": "result", **self._run_job(msg)})
+
+    def _load_item(self, item):
+        """(config, eval_data) of a batch item, None (with the error in its log) if its inputs are invalid."""
+        with _redirect_output(item["log_file"]):
+            try:
+                config = OmegaConf.load(item["run_json"])
+                return config, load_eval_data(config)
+            except Exception:
+                traceback.print_exc()
+                return None
+
+    def _run_group(self, group):
+        """
+        Jobs with the same engine and sampling config: their samples share generate_batch calls (generate_jobs).
+        Output goes to the first job's log, the others point to it. Returns the per-job results.
+        """
+        first = group[0][0]
+        try:
+            with _redirect_output(first["log_file"]):
+                try:
+                    logging.info(f"[OVI-WORKER] generating jobs {[item['job_id'] for item, _, _ in group]} in shared batches")
+                    engine = self._ensure_engine(group[0][1], job_id=first["job_id"])
+                    jobs = []
+                    for _, config, eval_data in group:
+                        output_dir = config.get("output_dir", "./outputs")
+                        os.makedirs(output_dir, exist_ok=True)
+                        jobs.append((config, eval_data, output_dir))
+                    job_ids = [item["job_id"] for item, _, _ in group]
+                    outputs = generate_jobs(engine, jobs,
+                                            progress_callback=lambda job, stage, **info: self.event(job_ids[job], stage, **info))
+                except Exception:
+                    traceback.print_exc()
+                    raise
+        except Exception as e:
+            # one bad job must not fail the others: fall back to running them one by one
+            logging.warning(f"[OVI-WORKER] shared batch failed ({e!r}), running the jobs individually")
+            return [self._run_job(item) for item, _, _ in group]
+
+        for item, _, _ in group[1:]:
+            with open(item["log_file"], "a", encoding="utf-8") as lf:
+                lf.write(f"[OVI-WORKER] generated in shared batches with job {first['job_id']}, see {first['log_file']}\n")
+        return [{"job_id": item["job_id"], "exit_code": 0, "error": None, "outputs": out}
+                for (item, _, _), out in zip(group, outputs)]
+
+    def run_batch(self, msg):
+        # jobs with the same engine + sampling config are denoised together; results are reported per job
+        groups = {}
+        results = {}
+        for item in msg.get("jobs", []):
+            loaded = self._load_item(item)
+            if loaded is None:
+                res = {"job_id": item.get("job_id"), "exit_code": 1, "error": "invalid job inputs, see log", "outputs": []}
+                self.send({"type": "item_result", **res})
+                results[item.get("job_id")] = res
+                continue
+            config, eval_data = loaded
+            key = (json.dumps(engine_key(config), default=str), sampling_key(config))
+            groups.setdefault(key, []).append((item, config, eval_data))
+
+        for group in groups.values():
+            group_results = [self._run_job(group[0][0])] if len(group) == 1 else self._run_group(group)
+            for res in group_results:
+                self.send({"type": "item_result", **res})
+                results[res["job_id"]] = res
+        self.send({"type": "result", "job_id": None,
+                   "results": [results[item.get("job_id")] for item in msg.get("jobs", [])]})
+
+    def serve(self, stdin):
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            msg = json.loads(line)
+            cmd = msg.get("cmd")
+            if cmd == "run":
+                self.run(msg)
+            elif cmd == "run_batch":
+                self.run_batch(msg)
+            elif cmd == "ping":
+                self.send({"type": "pong", "engine_key": self.engine_key})
+            elif cmd == "shutdown":
+                break
+            else:
+                self.send({"type": "error", "error": f"unknown cmd {cmd!r}"})
+
+
+@contextlib.contextmanager
+def _redirect_output(log_file):
+    """Point fd 1/2 (and therefore logging, tqdm and native prints) at the job log for the duration of a job."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_out, saved_err = os.dup(1), os.dup(2)
+    with open(log_file, "ab") as lf:
+        os.dup2(lf.fileno(), 1)
+        os.dup2(lf.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_out, 1)
+            os.dup2(saved_err, 2)
+            os.close(saved_out)
+            os.close(saved_err)
+
+
+def main():
+    # keep the real stdout for the protocol, everything else that prints goes to stderr (worker log)
+    proto_out = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+
+    device = int(os.environ.get("LOCAL_RANK", "0"))
+    torch.cuda.set_device(device)
+    initialize_sequence_parallel_state(1)
+
+    worker = _Worker(proto_out, device=device)
+    worker.send({"type": "ready", "pid": os.getpid()})
+    worker.serve(sys.stdin)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,25 @@
 # /workspace/app/OVI.py
 import asyncio
 import csv
+import importlib.util
 import json
 import os
+import shutil
 import subprocess
 import time
 import uuid
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
+from .admission import AdmissionController, AdmissionLimits, Overloaded, TooLarge, client_id
+from .jobstore import get_store
+from .resultcache import cache_key, file_identity, file_sha256, get_cache
+from .scheduler import PRIORITY_CLASSES, PriorityScheduler
+from .warm_worker import WarmWorker, WorkerDied, child_env
+
 
 # Public constants (für /health)
 OVI_ROOT = os.getenv("OVI_ROOT", "/workspace/Ovi")
@@ -19,12 +27,79 @@ OVI_CKPT_DIR = os.getenv("OVI_CKPT_DIR", f"{OVI_ROOT}/ckpts")
 OVI_RUN_BASE = os.getenv("OVI_RUN_BASE", f"{OVI_ROOT}/run.json")
 OVI_JOBS_DIR = os.getenv("OVI_JOBS_DIR", "/workspace/jobs")
 OVI_PYTHON = os.getenv("OVI_PYTHON", "python3")
+# 1 = resident worker (Engine bleibt geladen), 0 = wie früher inference.py pro Job
+OVI_WARM_WORKER = os.getenv("OVI_WARM_WORKER", "1") == "1"
+# Wie oft ein Job insgesamt gestartet werden darf (Neustart während "running" zählt als Versuch)
+OVI_MAX_ATTEMPTS = max(1, int(os.getenv("OVI_MAX_ATTEMPTS", "2")))
+# SSE: Kommentar-Ping wenn so lange kein Event kam (Proxies schließen sonst die Verbindung)
+OVI_SSE_KEEPALIVE_S = float(os.getenv("OVI_SSE_KEEPALIVE_S", "15"))
+# POST /jobs/batch: max. Items pro Request
+OVI_BATCH_MAX_ITEMS = int(os.getenv("OVI_BATCH_MAX_ITEMS", "64"))
+# max. Jobs, die zusammen an den Worker gehen (ein run_batch)
+OVI_BATCH_GROUP_MAX = int(os.getenv("OVI_BATCH_GROUP_MAX", "8"))
+
+# run.json Keys, die eine eigene Engine brauchen -> nur Jobs mit gleichen Werten teilen sich eine Engine-Session
+ENGINE_GROUP_KEYS = ("model_name", "fp8", "qint8", "quant", "quant_group_size", "cpu_offload", "block_offload", "block_prefetch", "mode")
+
+# Scheduler-Aging: alle X Sekunden Wartezeit eine Prioritätsklasse höher / Kosten halbiert nach Y Sekunden
+OVI_AGING_CLASS_S = float(os.getenv("OVI_AGING_CLASS_S", "600"))
+OVI_AGING_COST_S = float(os.getenv("OVI_AGING_COST_S", "300"))
+
+# Kostenmodell: Tokens pro Forward, quadratischer Attention-Anteil ab ~so vielen Tokens so teuer wie der lineare
+_ATTN_BREAK_EVEN_TOKENS = 28000
+_DEFAULT_TOKENS = (31 * 960 * 960 // (32 * 32), 157)   # 960x960_5s, falls model_specs fehlt
+
+# Admission: Limits per Env (OVI_MAX_QUEUED_JOBS, OVI_MAX_QUEUED_GPU_S, OVI_KEY_MAX_QUEUED_*),
+# Laufzeit-Schätzung pro Job bis die ersten Jobs fertig sind
+OVI_DEFAULT_JOB_S = float(os.getenv("OVI_DEFAULT_JOB_S", "600"))
+
+# Ergebnis-Cache: Checkpoint-Dateien (relativ zu ckpt_dir) die in den Cache-Key eingehen, Fusion-Modell kommt dazu
+_CKPT_FILES = (
+    "Wan2.2-TI2V-5B/Wan2.2_VAE.pth",
+    "Wan2.2-TI2V-5B/models_t5_umt5-xxl-enc-bf16.pth",
+    "MMAudio/ext_weights/v1-16.pth",
+    "MMAudio/ext_weights/best_netG.pt",
+)
+# run.json Keys die pro Job anders sind, aber das Ergebnis nicht beeinflussen (Inhalt geht separat ein)
+_CACHE_IGNORED_KEYS = ("text_prompt", "output_dir", "image_path", "image_paths", "ckpt_dir",
+                       "cfg_batch", "batch_size")
+
+# wie ovi.modules.quant.DEFAULT_GROUP_SIZE / quant_checkpoint_name (ohne torch zu importieren)
+_QUANT_DEFAULT_GROUP_SIZE = {"int8": 0, "int4": 128, "fp8": 0}
+
+
+def _quant_checkpoint_name(basename: str, fmt: str, group_size: Optional[int] = None) -> str:
+    group_size = _QUANT_DEFAULT_GROUP_SIZE.get(fmt, 0) if group_size is None else int(group_size)
+    stem = os.path.splitext(basename)[0]
+    return f"{stem}_{fmt}{f'_g{group_size}' if group_size else ''}.safetensors"
+
+
+Priority = Literal["high", "normal", "low"]
 
 
 class OVIJobRequest(BaseModel):
     prompt: str = Field(..., min_length=1)
     overrides: Dict[str, Any] = Field(default_factory=dict)
     job_id: Optional[str] = None
+    tag: Optional[str] = Field(None, max_length=128)
+    priority: Priority = "normal"
+    cache: bool = True   # False = immer neu generieren
+
+
+class OVIBatchItem(BaseModel):
+    prompt: str = Field(..., min_length=1)
+    overrides: Dict[str, Any] = Field(default_factory=dict)
+    job_id: Optional[str] = None
+    tag: Optional[str] = Field(None, max_length=128)
+    priority: Optional[Priority] = None
+
+
+class OVIBatchRequest(BaseModel):
+    items: List[OVIBatchItem] = Field(..., min_length=1)
+    overrides: Dict[str, Any] = Field(default_factory=dict)   # gemeinsame Defaults, Item-overrides gewinnen
+    tag: Optional[str] = Field(None, max_length=128)          # Default-Tag für Items ohne eigenen
+    priority: Priority = "normal"
+    cache: bool = True
 
 
 @dataclass
@@ -43,6 +118,21 @@ class Job:
     output_dir: str = ""
     log_file: str = ""
 
+    tag: Optional[str] = None
+    final_video_path: Optional[str] = None
+    attempts: int = 0
+    progress: Optional[Dict[str, Any]] = None   # letztes Progress-Event (stage, step/total, eta_s, ...)
+
+    batch_id: Optional[str] = None
+    engine_group: Optional[List[Any]] = None    # Werte von ENGINE_GROUP_KEYS aus run.json
+
+    priority: str = "normal"                    # high | normal | low
+    cost: float = 0.0                           # geschätzte Token-Steps (siehe _estimate_cost)
+    client: str = "anonymous"                   # Hash des API-Keys (Admission pro Key)
+
+    cache_key: Optional[str] = None             # Ergebnis-Cache (None = nicht cachebar)
+    cached: bool = False                        # True = Artefakt kam aus dem Cache, keine Generierung
+
 
 class _OVIService:
     def __init__(self):
@@ -50,13 +140,26 @@ class _OVIService:
         self.jobs_root = Path(OVI_JOBS_DIR).resolve()
         self.run_base = Path(OVI_RUN_BASE).resolve()
         self.inference_py = (self.ovi_root / "inference.py").resolve()
+        self.worker_py = (self.ovi_root / "worker.py").resolve()
         self.ckpts_dir = Path(OVI_CKPT_DIR).resolve()
 
-        self.jobs: Dict[str, Job] = {}
+        self.jobs: Dict[str, Job] = {}           # nur aktive Jobs, fertige liegen im JobStore
+        self.store = get_store()
 
-        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._queue = PriorityScheduler(class_age_s=OVI_AGING_CLASS_S, cost_age_s=OVI_AGING_COST_S)
+        self._specs: Optional[Dict[str, Any]] = None
+        self.admission = AdmissionController("ovi", AdmissionLimits.from_env("OVI"), concurrency=1,
+                                             default_job_s=OVI_DEFAULT_JOB_S)
+        self._last_finish = 0.0
         self._lock = asyncio.Lock()               # ✅ nur 1 Job gleichzeitig
         self._worker_task: Optional[asyncio.Task] = None
+        self._warm: Optional[WarmWorker] = None
+        self._recovered = False
+
+        # Progress-Events aktiver Jobs: Historie (Replay für neue SSE-Clients) + Live-Subscriber
+        self._events: Dict[str, List[Dict[str, Any]]] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._progress_state: Dict[str, Dict[str, float]] = {}
 
         self.jobs_root.mkdir(parents=True, exist_ok=True)
 
@@ -65,14 +168,50 @@ class _OVIService:
             raise RuntimeError(f"OVI root missing: {self.ovi_root}")
         if not self.inference_py.exists():
             raise RuntimeError(f"inference.py missing: {self.inference_py}")
+        if OVI_WARM_WORKER and not self.worker_py.exists():
+            raise RuntimeError(f"worker.py missing: {self.worker_py}")
         if not self.run_base.exists():
             raise RuntimeError(f"run_base.json missing: {self.run_base}")
 
     async def ensure_worker(self):
         self._sanity()
+        if not self._recovered:
+            self._recovered = True
+            await self.recover()
         if self._worker_task is None:
             self._worker_task = asyncio.create_task(self._worker_loop())
 
+    async def recover(self):
+        """
+        Queue überlebt Neustarts: alles was im JobStore noch "queued" ist, kommt wieder in die Queue.
+        Jobs die beim Absturz "running" waren werden erneut eingereiht (bis OVI_MAX_ATTEMPTS) oder failed.
+        """
+        for status in ("running", "queued"):
+            for data in self.store.query("ovi", status=status, limit=None, oldest_first=True):
+                jid = data.get("id")
+                if not jid or jid in self.jobs:
+                    continue
+                fields = {k: v for k, v in data.items() if k in Job.__dataclass_fields__}
+                job = Job(**fields)
+
+                if status == "running":
+                    if job.attempts >= OVI_MAX_ATTEMPTS:
+                        job.status = "failed"
+                        job.error = f"interrupted by service restart (attempt {job.attempts}/{OVI_MAX_ATTEMPTS})"
+                        job.finished_at = time.time()
+                        self._persist(job)
+                        continue
+                    job.status = "queued"
+                    job.error = f"interrupted by service restart, retrying (attempt {job.attempts}/{OVI_MAX_ATTEMPTS})"
+                    job.started_at = None
+                    self._persist(job)
+
+                if not job.cost:
+                    job.cost = self._estimate_cost(self._load_json(Path(job.run_json)))
+                self.admission.restore(job.client, jid, job.cost)
+                self.jobs[jid] = job
+                await self._put(job)
+
     def _make_job_id(self, job_id: Optional[str]) -> str:
         if job_id:
             clean = "".join(ch for ch in job_id if ch.isalnum() or ch in ("-", "_"))
@@ -88,10 +227,19 @@ class _OVIService:
         p.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
 
     def _persist(self, job: Job):
+        data = asdict(job)
+        self.store.upsert(
+            "ovi", job.id, job.status, data,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            finished_at=job.finished_at,
+            tag=job.tag,
+            artifact_path=job.final_video_path,
+        )
         try:
             jd = Path(job.job_dir)
             (jd / "job_status.json").write_text(
-                json.dumps(asdict(job), indent=2),
+                json.dumps(data, indent=2),
                 encoding="utf-8"
             )
         except Exception:
@@ -108,10 +256,195 @@ class _OVIService:
                 w.writerow(["text_prompt"])
                 w.writerow([prompt])
 
-    async def create_job(self, prompt: str, overrides: Dict[str, Any], job_id: Optional[str]) -> str:
+    async def create_job(self, prompt: str, overrides: Dict[str, Any], job_id: Optional[str],
+                         tag: Optional[str] = None, priority: str = "normal", api_key: Optional[str] = None,
+                         use_cache: bool = True) -> str:
+        await self.ensure_worker()
+
+        job = self._build_job(prompt, overrides, self._make_job_id(job_id), tag, priority=priority,
+                              client=client_id(api_key), use_cache=use_cache)
+        if self._from_cache(job):
+            self._persist(job)
+            return job.id
+        try:
+            self.admission.admit(job.client, [(job.id, job.cost)])
+        except (Overloaded, TooLarge):
+            shutil.rmtree(job.job_dir, ignore_errors=True)
+            raise
+        try:
+            await self._enqueue(job)
+        except BaseException:
+            self._abandon(job)
+            raise
+        return job.id
+
+    async def create_batch(self, items: List[Dict[str, Any]], overrides: Optional[Dict[str, Any]] = None,
+                           tag: Optional[str] = None, priority: str = "normal",
+                           api_key: Optional[str] = None, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Viele Prompts auf einmal: jedes Item wird ein normaler Job (eigene job_id, eigener Output),
+        Items mit gleicher Engine- und Sampling-Config teilen sich im Worker generate_batch-Aufrufe.
+        Alles-oder-nichts: ist ein Item ungültig, wird kein Job angelegt.
+        """
         await self.ensure_worker()
+        if not items:
+            raise ValueError("batch needs at least one item")
+        if len(items) > OVI_BATCH_MAX_ITEMS:
+            raise ValueError(f"batch too large ({len(items)} > {OVI_BATCH_MAX_ITEMS})")
+
+        batch_id = uuid.uuid4().hex[:12]
+        jids = [self._make_job_id(it.get("job_id")) for it in items]
+        if len(set(jids)) != len(jids):
+            raise ValueError("duplicate job_id in batch")
+        for jid in jids:
+            if (self.jobs_root / jid).exists():
+                raise FileExistsError(f"job_id already exists: {jid}")
+
+        client = client_id(api_key)
+        jobs: List[Job] = []
+        try:
+            for jid, it in zip(jids, items):
+                merged = {**(overrides or {}), **(it.get("overrides") or {})}
+                jobs.append(self._build_job(it["prompt"], merged, jid, it.get("tag") or tag,
+                                            batch_id=batch_id, priority=it.get("priority") or priority,
+                                            client=client, use_cache=use_cache))
+            hits = [j for j in jobs if self._from_cache(j)]
+            self.admission.admit(client, [(j.id, j.cost) for j in jobs if not j.cached])
+        except Exception:
+            for job in jobs:
+                shutil.rmtree(job.job_dir, ignore_errors=True)
+            if len(jobs) < len(jids):
+                shutil.rmtree(self.jobs_root / jids[len(jobs)], ignore_errors=True)
+            raise
 
-        jid = self._make_job_id(job_id)
+        for i, job in enumerate(jobs):
+            try:
+                if job.cached:
+                    self._persist(job)
+                else:
+                    await self._enqueue(job)
+            except BaseException:
+                # schon eingereihte Jobs laufen normal, die übrigen geben ihren Slot zurück
+                for rest in jobs[i:]:
+                    if not rest.cached:
+                        self._abandon(rest)
+                raise
+
+        groups = {json.dumps(j.engine_group) for j in jobs if not j.cached}
+        return {"batch_id": batch_id, "job_ids": [j.id for j in jobs], "engine_groups": len(groups),
+                "cached": len(hits), "items": [{"id": j.id, "status": j.status} for j in jobs]}
+
+    def _abandon(self, job: Job):
+        # angenommen, aber nie in die Queue gekommen: Admission-Slot freigeben
+        self.jobs.pop(job.id, None)
+        self.admission.release(job.id)
+
+    async def _enqueue(self, job: Job):
+        self.jobs[job.id] = job
+        self._persist(job)
+        self._publish_status(job)
+        await self._put(job)
+
+    def _result_key(self, cfg: Dict[str, Any], prompt: str) -> Optional[str]:
+        """Kanonischer Hash der effektiven run.json (+ Prompt, Startbild, Checkpoints); None = nicht cachebar."""
+        if int(cfg.get("each_example_n_times", 1) or 1) != 1:
+            return None  # mehrere Videos pro Job, Cache hält genau ein Artefakt
+
+        params = {k: v for k, v in cfg.items() if k not in _CACHE_IGNORED_KEYS}
+        params["prompt"] = prompt
+        if str(cfg.get("mode", "")).lower() == "i2v":
+            imgs = cfg.get("image_paths") or [cfg.get("image_path")]
+            digest = file_sha256(str(imgs[0])) if imgs and imgs[0] else None
+            if digest is None:
+                return None
+            params["image_sha256"] = digest
+
+        ckpt_dir = Path(cfg.get("ckpt_dir") or "./ckpts")
+        if not ckpt_dir.is_absolute():
+            ckpt_dir = self.ovi_root / ckpt_dir  # inference läuft mit cwd=OVI_ROOT
+        spec = self._model_specs().get(cfg.get("model_name", "960x960_5s"), {})
+        fusion = "model_fp8_e4m3fn.safetensors" if cfg.get("fp8") else spec.get("path", "")
+        if cfg.get("quant"):
+            fusion = _quant_checkpoint_name(fusion, str(cfg["quant"]), cfg.get("quant_group_size"))
+        params["checkpoints"] = [file_identity(str(ckpt_dir / f)) for f in (f"Ovi/{fusion}",) + _CKPT_FILES]
+        # LoRA: Name + Scale stecken schon in params, die Adapter-Datei selbst kann sich ändern
+        params["lora_files"] = [file_identity(str(p)) for p in self._lora_files(cfg, ckpt_dir)]
+        return cache_key("ovi", params)
+
+    def _lora_files(self, cfg: Dict[str, Any], ckpt_dir: Path) -> List[Path]:
+        # gleiche Auflösung wie ovi.modules.lora.resolve_lora_spec (ohne torch zu importieren)
+        spec = cfg.get("lora")
+        if not spec:
+            return []
+        if isinstance(spec, (str, dict)):
+            spec = [spec]
+        lora_dir = Path(cfg.get("lora_dir") or os.getenv("OVI_LORA_DIR") or ckpt_dir / "loras")
+        if not lora_dir.is_absolute():
+            lora_dir = self.ovi_root / lora_dir
+        files = []
+        for entry in spec:
+            name = str(entry["name"] if isinstance(entry, dict) else entry)
+            path = Path(name) if os.path.isabs(name) else lora_dir / name
+            files.append(path if name.endswith(".safetensors") else path.with_name(path.name + ".safetensors"))
+        return files
+
+    def _from_cache(self, job: Job) -> bool:
+        cache = get_cache()
+        if cache is None or not job.cache_key:
+            return False
+        hit = cache.link_into(job.cache_key, Path(job.output_dir))
+        if hit is None:
+            return False
+
+        now = time.time()
+        job.status = "succeeded"
+        job.started_at = job.finished_at = now
+        job.exit_code = 0
+        job.cached = True
+        job.final_video_path = str(hit)
+        Path(job.log_file).write_text(f"[OVI-API] result cache hit {job.cache_key}\n", encoding="utf-8")
+        return True
+
+    async def _put(self, job: Job):
+        await self._queue.put(job.id, priority=PRIORITY_CLASSES.get(job.priority, 1),
+                              cost=job.cost, enqueued_at=job.created_at)
+
+    def _model_specs(self) -> Dict[str, Any]:
+        # NAME_TO_MODEL_SPECS_MAP direkt aus der Datei laden (ovi-Paket zieht sonst torch in die API)
+        if self._specs is None:
+            path = self.ovi_root / "ovi" / "model_specs.py"
+            try:
+                spec = importlib.util.spec_from_file_location("_ovi_model_specs", path)
+                mod = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(mod)
+                self._specs = dict(mod.NAME_TO_MODEL_SPECS_MAP)
+            except Exception:
+                self._specs = {}
+        return self._specs
+
+    def _estimate_cost(self, cfg: Dict[str, Any]) -> float:
+        """
+        Grobe Rechenkosten eines Jobs: Tokens (Video + Audio) * Schritte * 2 Forwards (CFG) * Samples.
+        Die Engine snappt die Framegröße auf die Modellfläche (video_area) -> Tokens kommen aus den Specs.
+        """
+        specs = self._model_specs().get(cfg.get("model_name", "960x960_5s"))
+        if specs:
+            # VAE-Stride 16 + Patch 2x2 -> 32x32 Pixel pro Video-Token und Latent-Frame
+            v_tokens = specs["video_latent_length"] * specs["video_area"] // (32 * 32)
+            a_tokens = specs["audio_latent_length"]
+        else:
+            v_tokens, a_tokens = _DEFAULT_TOKENS
+
+        per_forward = sum(t * (1.0 + t / _ATTN_BREAK_EVEN_TOKENS) for t in (v_tokens, a_tokens))
+        steps = int(cfg.get("sample_steps", 50) or 50)
+        n_times = int(cfg.get("each_example_n_times", 1) or 1)
+        return float(per_forward * steps * 2 * n_times)
+
+    def _build_job(self, prompt: str, overrides: Dict[str, Any], jid: str,
+                   tag: Optional[str] = None, batch_id: Optional[str] = None, priority: str = "normal",
+                   client: str = "anonymous", use_cache: bool = True) -> Job:
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"invalid priority {priority!r}")
         job_dir = (self.jobs_root / jid).resolve()
         if job_dir.exists():
             raise FileExistsError("job_id already exists")
@@ -174,7 +507,7 @@ class _OVIService:
 
         self._save_json(run_json, cfg)
 
-        job = Job(
+        return Job(
             id=jid,
             status="queued",
             created_at=time.time(),
@@ -183,14 +516,16 @@ class _OVIService:
             prompt_csv=str(prompt_csv),
             output_dir=str(output_dir),
             log_file=str(log_file),
+            tag=tag,
+            batch_id=batch_id,
+            engine_group=[cfg.get(k) for k in ENGINE_GROUP_KEYS],
+            priority=priority,
+            cost=self._estimate_cost(cfg),
+            client=client,
+            cache_key=self._result_key(cfg, prompt) if use_cache else None,
         )
-        self.jobs[jid] = job
-        self._persist(job)
 
-        await self._queue.put(jid)
-        return jid
-
-    # ✅ NEU: Hilfsfunktion um die neueste MP4 im Output zu finden
+    # Nur noch einmalig beim Job-Ende / für Alt-Jobs ohne Index-Eintrag, nicht pro Poll
     def _latest_mp4(self, job_id: str) -> Optional[Path]:
         jd = (self.jobs_root / job_id).resolve()
         out_dir = jd / "output"
@@ -204,29 +539,51 @@ class _OVIService:
         mp4s.sort(key=lambda p: p.stat().st_mtime, reverse=True)
         return mp4s[0]
 
-    def get_status(self, job_id: str) -> Dict[str, Any]:
+    def _load_status(self, job_id: str) -> Dict[str, Any]:
         job = self.jobs.get(job_id)
         if job:
-            data = asdict(job)
-        else:
-            # fallback: nach restart von disk lesen
-            jf = (self.jobs_root / job_id / "job_status.json")
-            if jf.exists():
-                data = self._load_json(jf)
-            else:
-                raise KeyError("job not found")
-
-        # ✅ NEU: finalen MP4-Pfad + Name mitgeben
-        latest = self._latest_mp4(job_id)
-        if latest:
-            data["final_video_path"] = str(latest)
-            data["final_video_name"] = latest.name
-        else:
-            data["final_video_path"] = None
-            data["final_video_name"] = None
+            return asdict(job)
+
+        data = self.store.get("ovi", job_id)
+        if data is not None:
+            return data
+
+        # fallback: Alt-Jobs (vor dem JobStore) einmalig von disk lesen und indexieren
+        jf = (self.jobs_root / job_id / "job_status.json")
+        if not jf.exists():
+            raise KeyError("job not found")
+        data = self._load_json(jf)
+        if not data.get("final_video_path"):
+            latest = self._latest_mp4(job_id)
+            data["final_video_path"] = str(latest) if latest else None
+        self.store.upsert(
+            "ovi", job_id, data.get("status", "unknown"), data,
+            created_at=data.get("created_at"),
+            started_at=data.get("started_at"),
+            finished_at=data.get("finished_at"),
+            tag=data.get("tag"),
+            artifact_path=data.get("final_video_path"),
+        )
+        return data
 
+    def get_status(self, job_id: str) -> Dict[str, Any]:
+        data = self._load_status(job_id)
+        data.pop("artifact_path", None)
+
+        # finalen MP4-Pfad + Name mitgeben (kommt aus dem Index, kein rglob pro Poll)
+        final = data.get("final_video_path")
+        data["final_video_path"] = final
+        data["final_video_name"] = Path(final).name if final else None
+        if data.get("status") == "queued":
+            data["queue_position"] = self._queue.position(job_id)
         return data
 
+    def list_jobs(self, status: Optional[str] = None, tag: Optional[str] = None,
+                  since: Optional[float] = None, until: Optional[float] = None,
+                  limit: int = 100, batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.store.query("ovi", status=status, tag=tag, since=since, until=until, limit=limit,
+                                batch_id=batch_id)
+
     def get_file(self, job_id: str, path: Optional[str]) -> Path:
         jd = (self.jobs_root / job_id).resolve()
         if not jd.exists():
@@ -241,79 +598,297 @@ class _OVIService:
                 raise FileNotFoundError("file not found")
             return target
 
-        # default: newest mp4 from output
-        out_dir = jd / "output"
-        mp4s = list(out_dir.rglob("*.mp4"))
-        if not mp4s:
+        # default: finales mp4 aus dem Index
+        try:
+            final = self._load_status(job_id).get("final_video_path")
+        except KeyError:
+            final = None
+        if not final or not Path(final).is_file():
             raise FileNotFoundError("no mp4 yet")
-        mp4s.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-        return mp4s[0]
+        return Path(final)
+
+    # ---- Progress-Events (SSE) ----
+
+    def _publish(self, job_id: str, event: Dict[str, Any]):
+        hist = self._events.setdefault(job_id, [])
+        hist.append(event)
+        if len(hist) > 1000:
+            del hist[:-1000]
+        for q in self._subscribers.get(job_id, []):
+            q.put_nowait(event)
+
+    def _publish_status(self, job: Job):
+        ev = {"job_id": job.id, "stage": "status", "status": job.status, "ts": time.time()}
+        if job.status in ("succeeded", "failed"):
+            ev.update(error=job.error, final_video_path=job.final_video_path)
+        self._publish(job.id, ev)
+
+    def _close_events(self, job: Job):
+        self._publish_status(job)
+        for q in self._subscribers.pop(job.id, []):
+            q.put_nowait(None)
+        self._events.pop(job.id, None)
+        self._progress_state.pop(job.id, None)
+
+    def _on_worker_event(self, job: Job, ev: Dict[str, Any]):
+        """Worker-Event um Durchsatz + ETA ergänzen und verteilen."""
+        if ev.get("type") != "event":
+            return
+        ev = {k: v for k, v in ev.items() if k != "type"}
+        ts = float(ev.get("ts") or time.time())
+        st = self._progress_state.setdefault(job.id, {"last_ts": ts, "denoise_s": 0.0, "steps": 0})
+
+        if ev.get("stage") == "denoise":
+            total = int(ev.get("total") or 0)
+            num_samples = int(ev.get("num_samples") or 1)
+            sample = int(ev.get("sample") or 0)
+            batch = int(ev.get("batch") or 1)   # batch_size > 1: ein Step treibt mehrere Samples voran
+
+            st["denoise_s"] += max(ts - st["last_ts"], 0.0)
+            st["steps"] += batch
+            done = sample * total + int(ev.get("step") or 0) * batch
+            remaining = num_samples * total - done
+            if st["denoise_s"] > 0:
+                rate = st["steps"] / st["denoise_s"]
+                ev["throughput_steps_per_s"] = round(rate, 4)
+                ev["eta_s"] = round(remaining / rate, 1)
+            if total:
+                ev["progress"] = round(done / (num_samples * total), 4)
+        st["last_ts"] = ts
+
+        job.progress = ev
+        self._publish(job.id, ev)
+
+    def has_job(self, job_id: str) -> bool:
+        if job_id in self.jobs:
+            return True
+        try:
+            self._load_status(job_id)
+            return True
+        except KeyError:
+            return False
+
+    async def events(self, job_id: str) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Replay + Live-Events eines Jobs; None = Keepalive. Endet mit dem finalen Status."""
+        if job_id not in self.jobs:
+            data = self.get_status(job_id)
+            yield {"job_id": job_id, "stage": "status", "status": data.get("status"), "ts": time.time(),
+                   "error": data.get("error"), "final_video_path": data.get("final_video_path")}
+            return
+
+        q: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(q)
+        backlog = list(self._events.get(job_id, []))
+        try:
+            for ev in backlog:
+                yield ev
+            while True:
+                try:
+                    ev = await asyncio.wait_for(q.get(), timeout=OVI_SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if ev is None:
+                    return
+                yield ev
+        finally:
+            subs = self._subscribers.get(job_id)
+            if subs and q in subs:
+                subs.remove(q)
 
     async def _worker_loop(self):
         while True:
             jid = await self._queue.get()
-            try:
-                await self._run_one(jid)
-            finally:
-                self._queue.task_done()
+            await self._run_one(jid)
+
+    def _warm_worker(self) -> WarmWorker:
+        if self._warm is None:
+            self._warm = WarmWorker(
+                name="ovi-worker",
+                cmd=[OVI_PYTHON, str(self.worker_py)],
+                cwd=str(self.ovi_root),
+                env=child_env(str(self.ovi_root)),
+                log_path=self.jobs_root / "_worker" / "ovi_worker.log",
+            )
+        return self._warm
+
+    def _write_log_header(self, job: Job, worker: WarmWorker):
+        log_file = Path(job.log_file)
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        with log_file.open("wb") as lf:
+            lf.write(f"[OVI-API] worker={' '.join(worker.cmd)}\n".encode())
+            lf.write(f"[OVI-API] cwd={OVI_ROOT}\n".encode())
+            if job.batch_id:
+                lf.write(f"[OVI-API] batch={job.batch_id}\n".encode())
+
+    def _apply_result(self, job: Job, res: Dict[str, Any]) -> int:
+        rc = int(res.get("exit_code", 1))
+        job.error = res.get("error") if rc != 0 else None
+        outputs = res.get("outputs") or []
+        if outputs:
+            job.final_video_path = outputs[-1]
+        return rc
+
+    async def _run_warm(self, job: Job) -> int:
+        worker = self._warm_worker()
+        self._write_log_header(job, worker)
 
-    async def _run_one(self, job_id: str):
-        async with self._lock:
-            job = self.jobs.get(job_id)
-            if not job:
+        try:
+            res = await worker.request({
+                "cmd": "run",
+                "job_id": job.id,
+                "run_json": job.run_json,
+                "log_file": job.log_file,
+            }, on_event=lambda ev: self._on_worker_event(job, ev))
+        except WorkerDied as e:
+            # Prozess weg (OOM-Kill o.ä.) -> Job failed, nächster Job startet den Worker neu
+            job.error = f"ovi worker died: {e}"
+            return -1
+
+        return self._apply_result(job, res)
+
+    async def _run_warm_batch(self, group: List[Job]):
+        """Alle Jobs einer Engine-Gruppe in einem run_batch-Request; jeder Job wird beim item_result fertig."""
+        worker = self._warm_worker()
+        by_id = {j.id: j for j in group}
+        for job in group:
+            self._write_log_header(job, worker)
+
+        def on_msg(msg: Dict[str, Any]):
+            job = by_id.get(msg.get("job_id"))
+            if job is None:
                 return
+            if msg.get("type") == "item_result":
+                self._finish(job, self._apply_result(job, msg))
+            else:
+                self._on_worker_event(job, msg)
 
-            job.status = "running"
-            job.started_at = time.time()
-            self._persist(job)
+        try:
+            await worker.request({
+                "cmd": "run_batch",
+                "jobs": [{"job_id": j.id, "run_json": j.run_json, "log_file": j.log_file} for j in group],
+            }, on_event=on_msg)
+        except WorkerDied as e:
+            for job in group:
+                if job.id in self.jobs:
+                    job.error = f"ovi worker died: {e}"
+                    self._finish(job, -1)
+
+    def _run_subprocess(self, job: Job) -> int:
+        run_json = Path(job.run_json)
+        log_file = Path(job.log_file)
+
+        cmd = [OVI_PYTHON, str(self.inference_py), "--config-file", str(run_json)]
+        env = child_env(str(self.ovi_root))
+
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        with log_file.open("wb") as lf:
+            lf.write(f"[OVI-API] cmd={' '.join(cmd)}\n".encode())
+            lf.write(f"[OVI-API] cwd={OVI_ROOT}\n".encode())
+            lf.flush()
+            p = subprocess.Popen(
+                cmd,
+                cwd=str(self.ovi_root),  # ✅ OVI läuft aus Repo-Root (keine relativen Pfad-Probleme)
+                env=env,
+                stdout=lf,
+                stderr=subprocess.STDOUT,
+            )
+            rc = p.wait()
+        job.error = None if rc == 0 else f"inference.py exited with code {rc}"
+        if rc == 0:
+            latest = self._latest_mp4(job.id)
+            job.final_video_path = str(latest) if latest else None
+        return rc
+
+    def _start(self, job: Job):
+        job.status = "running"
+        job.started_at = time.time()
+        job.attempts += 1
+        self._persist(job)
+        self._publish_status(job)
 
-            run_json = Path(job.run_json)
-            log_file = Path(job.log_file)
-
-            cmd = [OVI_PYTHON, str(self.inference_py), "--config-file", str(run_json)]
-            env = os.environ.copy()
-            env["PYTHONPATH"] = str(self.ovi_root) + (":" + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
-
-            def _run_blocking() -> int:
-                log_file.parent.mkdir(parents=True, exist_ok=True)
-                with log_file.open("wb") as lf:
-                    lf.write(f"[OVI-API] cmd={' '.join(cmd)}\n".encode())
-                    lf.write(f"[OVI-API] cwd={OVI_ROOT}\n".encode())
-                    lf.flush()
-                    p = subprocess.Popen(
-                        cmd,
-                        cwd=str(self.ovi_root),  # ✅ OVI läuft aus Repo-Root (keine relativen Pfad-Probleme)
-                        env=env,
-                        stdout=lf,
-                        stderr=subprocess.STDOUT,
-                    )
-                    return p.wait()
+    def _finish(self, job: Job, rc: int):
+        job.exit_code = rc
+        job.finished_at = time.time()
+        job.status = "succeeded" if rc == 0 else "failed"
 
+        # Batch-Gruppen starten gemeinsam -> Laufzeit ab dem vorherigen Job-Ende zählen
+        duration = job.finished_at - max(job.started_at or job.finished_at, self._last_finish)
+        self._last_finish = job.finished_at
+        self.admission.release(job.id, duration if rc == 0 else None, cost=job.cost)
+
+        cache = get_cache()
+        if rc == 0 and cache is not None and job.cache_key and job.final_video_path:
             try:
-                rc = await asyncio.to_thread(_run_blocking)
-                job.exit_code = rc
-                job.finished_at = time.time()
-                if rc == 0:
-                    job.status = "succeeded"
-                    job.error = None
+                cache.put(job.cache_key, "ovi", Path(job.final_video_path))
+            except OSError as e:
+                print(f"[OVI-API] result cache put failed for {job.id}: {e!r}")
+        self._persist(job)
+        self._close_events(job)
+        self.jobs.pop(job.id, None)
+
+    def _batch_group(self, job: Job) -> List[Job]:
+        # nur Jobs, die der Scheduler ohnehin als nächste liefern würde (Priorität + Aging bleiben gültig):
+        # gleicher Batch + Engine-Config, am Stück ab dem Queue-Kopf, max. OVI_BATCH_GROUP_MAX
+        group = [job]
+        for job_id in self._queue.order():
+            if len(group) >= OVI_BATCH_GROUP_MAX:
+                break
+            j = self.jobs.get(job_id)
+            if j is None or j.status != "queued" or j.batch_id != job.batch_id or j.engine_group != job.engine_group:
+                break
+            group.append(j)
+        return group
+
+    async def _run_one(self, job_id: str):
+        async with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job.status != "queued":
+                return  # schon als Teil einer Batch-Gruppe gelaufen
+
+            if OVI_WARM_WORKER and job.batch_id:
+                group = self._batch_group(job)
+                if len(group) > 1:
+                    for j in group:
+                        self._queue.discard(j.id)
+                        self._start(j)
+                    try:
+                        await self._run_warm_batch(group)
+                    except Exception as e:
+                        for j in group:
+                            if j.id in self.jobs:
+                                j.error = repr(e)
+                                self._finish(j, -1)
+                    return
+
+            self._start(job)
+            try:
+                if OVI_WARM_WORKER:
+                    rc = await self._run_warm(job)
                 else:
-                    job.status = "failed"
-                    job.error = f"inference.py exited with code {rc}"
+                    rc = await asyncio.to_thread(self._run_subprocess, job)
             except Exception as e:
-                job.status = "failed"
                 job.error = repr(e)
-                job.finished_at = time.time()
-
-            self._persist(job)
-
+                rc = -1
+            self._finish(job, rc)
 
 _service = _OVIService()
 
 
 # ---- Public functions used by main.py ----
 
-async def submit_job(req: OVIJobRequest) -> str:
-    return await _service.create_job(prompt=req.prompt, overrides=req.overrides, job_id=req.job_id)
+async def submit_job(req: OVIJobRequest, api_key: Optional[str] = None) -> str:
+    return await _service.create_job(prompt=req.prompt, overrides=req.overrides, job_id=req.job_id, tag=req.tag,
+                                     priority=req.priority, api_key=api_key, use_cache=req.cache)
+
+
+async def submit_batch(req: OVIBatchRequest, api_key: Optional[str] = None) -> Dict[str, Any]:
+    return await _service.create_batch([it.model_dump() for it in req.items], overrides=req.overrides, tag=req.tag,
+                                       priority=req.priority, api_key=api_key, use_cache=req.cache)
+
+
+def admission_stats() -> Dict[str, Any]:
+    return _service.admission.stats()
 
 
 def get_status(job_id: str):
@@ -322,3 +897,33 @@ def get_status(job_id: str):
 
 def get_file(job_id: str, path: Optional[str] = None):
     return _service.get_file(job_id, path=path)
+
+
+def _sse(ev: Optional[Dict[str, Any]]) -> str:
+    if ev is None:
+        return ": keepalive\n\n"
+    name = "status" if ev.get("stage") == "status" else "progress"
+    return f"event: {name}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+
+def job_events(job_id: str) -> AsyncIterator[str]:
+    """SSE-Stream für GET /jobs/{id}/events. KeyError sofort, falls der Job nicht existiert."""
+    if not _service.has_job(job_id):
+        raise KeyError("job not found")
+
+    async def _stream():
+        async for ev in _service.events(job_id):
+            yield _sse(ev)
+
+    return _stream()
+
+
+async def startup():
+    # beim API-Start die persistierte Queue wieder aufnehmen
+    await _service.ensure_worker()
+
+
+def list_jobs(status: Optional[str] = None, tag: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, limit: int = 100,
+              batch_id: Optional[str] = None):
+    return _service.list_jobs(status=status, tag=tag, since=since, until=until, limit=limit, batch_id=batch_id)
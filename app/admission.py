@@ -0,0 +1,129 @@
+# /workspace/app/admission.py
+# Admission Control: begrenzt ausstehende Arbeit (queued + running) global und pro API-Key,
+# gemessen in Jobs und/oder geschätzten GPU-Sekunden. Überlast -> 429 mit Retry-After,
+# Requests, die selbst bei leerer Queue nicht ins Limit passen -> 413 (Retry sinnlos).
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+
+class Overloaded(Exception):
+    """Limit überschritten; retry_after in Sekunden (für den Retry-After Header)."""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TooLarge(Exception):
+    """Request allein größer als ein Limit: passt nie, daher kein Retry-After."""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+@dataclass
+class AdmissionLimits:
+    max_jobs: int = 0          # 0 = kein Limit
+    max_gpu_s: float = 0.0
+    key_max_jobs: int = 0
+    key_max_gpu_s: float = 0.0
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "AdmissionLimits":
+        # z.B. OVI_MAX_QUEUED_JOBS, OVI_MAX_QUEUED_GPU_S, OVI_KEY_MAX_QUEUED_JOBS, OVI_KEY_MAX_QUEUED_GPU_S
+        return cls(
+            max_jobs=int(os.getenv(f"{prefix}_MAX_QUEUED_JOBS", "0")),
+            max_gpu_s=float(os.getenv(f"{prefix}_MAX_QUEUED_GPU_S", "0")),
+            key_max_jobs=int(os.getenv(f"{prefix}_KEY_MAX_QUEUED_JOBS", "0")),
+            key_max_gpu_s=float(os.getenv(f"{prefix}_KEY_MAX_QUEUED_GPU_S", "0")),
+        )
+
+
+def client_id(api_key: Optional[str]) -> str:
+    # nur ein Hash landet in Job-Status/Index, nie der Key selbst
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class AdmissionController:
+    """
+    Buchhaltung über ausstehende Jobs: admit() beim Einreihen, release() wenn der Job fertig ist.
+    GPU-Sekunden werden aus den Job-Kosten geschätzt (Sekunden pro Kosteneinheit als EWMA
+    über fertige Jobs, vorher `default_job_s` pro Job). Retry-After = Arbeit, die abfließen muss,
+    bis der Request passt, geteilt durch die Anzahl paralleler Worker.
+    """
+
+    def __init__(self, name: str, limits: AdmissionLimits, concurrency: int = 1,
+                 default_job_s: float = 300.0, alpha: float = 0.2):
+        self.name = name
+        self.limits = limits
+        self.concurrency = max(1, concurrency)
+        self.alpha = alpha
+        self._job_s = default_job_s                  # EWMA Laufzeit pro Job
+        self._s_per_cost: Optional[float] = None     # EWMA Sekunden pro Kosteneinheit
+        self._outstanding: Dict[str, Tuple[str, float]] = {}  # job_id -> (client, geschätzte GPU-s)
+
+    def estimate_s(self, cost: float) -> float:
+        if self._s_per_cost is not None and cost > 0:
+            return cost * self._s_per_cost
+        return self._job_s
+
+    def _totals(self, client: Optional[str] = None) -> Tuple[int, float]:
+        items = [est for c, est in self._outstanding.values() if client is None or c == client]
+        return len(items), sum(items)
+
+    def _retry_after(self, excess_jobs: float, excess_s: float) -> int:
+        wait = max(excess_jobs * self._job_s, excess_s) / self.concurrency
+        return int(min(max(wait, 1.0), 3600.0))
+
+    def _check(self, scope: str, n: int, s: float, add_n: int, add_s: float, max_jobs: int, max_s: float):
+        # erst "passt nie" (auch bei leerer Queue nicht), dann "passt gerade nicht"
+        if max_jobs and add_n > max_jobs:
+            raise TooLarge(f"{self.name}: request has {add_n} jobs, limit is {max_jobs} ({scope})")
+        if max_s and add_s > max_s:
+            raise TooLarge(f"{self.name}: request needs ~{add_s:.0f} GPU-s, limit is {max_s:.0f}s ({scope})")
+        if max_jobs and n + add_n > max_jobs:
+            raise Overloaded(f"{self.name}: too many queued jobs ({scope}: {n}/{max_jobs})",
+                             self._retry_after(n + add_n - max_jobs, 0.0))
+        if max_s and s + add_s > max_s:
+            raise Overloaded(f"{self.name}: queued GPU time over limit ({scope}: {s:.0f}s/{max_s:.0f}s)",
+                             self._retry_after(0, s + add_s - max_s))
+
+    def admit(self, client: str, jobs: Sequence[Tuple[str, float]]):
+        """jobs = [(job_id, cost), ...]; alle oder keiner. Wirft Overloaded (später nochmal) oder TooLarge (nie)."""
+        ests = [(jid, self.estimate_s(cost)) for jid, cost in jobs]
+        add_n, add_s = len(ests), sum(e for _, e in ests)
+
+        lim = self.limits
+        self._check("global", *self._totals(), add_n, add_s, lim.max_jobs, lim.max_gpu_s)
+        self._check("api key", *self._totals(client), add_n, add_s, lim.key_max_jobs, lim.key_max_gpu_s)
+
+        for jid, est in ests:
+            self._outstanding[jid] = (client, est)
+
+    def restore(self, client: str, job_id: str, cost: float):
+        # Recovery nach Neustart: Job ist schon angenommen, nur mitzählen
+        self._outstanding[job_id] = (client, self.estimate_s(cost))
+
+    def release(self, job_id: str, duration_s: Optional[float] = None, cost: float = 0.0):
+        self._outstanding.pop(job_id, None)
+        if duration_s is None or duration_s <= 0:
+            return
+        a = self.alpha
+        self._job_s = (1 - a) * self._job_s + a * duration_s
+        if cost > 0:
+            rate = duration_s / cost
+            self._s_per_cost = rate if self._s_per_cost is None else (1 - a) * self._s_per_cost + a * rate
+
+    def stats(self) -> Dict[str, Any]:
+        n, s = self._totals()
+        return {
+            "queued_jobs": n,
+            "queued_gpu_s": round(s, 1),
+            "job_s_ewma": round(self._job_s, 1),
+        }
@@ -0,0 +1,117 @@
+# /workspace/app/jobstore.py
+# Ein gemeinsamer Job-Index (SQLite, WAL) für OVI + Z-Image.
+# Status-Polls lesen nur noch eine Zeile per Primary Key statt Job-Ordner zu scannen.
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+JOBSTORE_DB = os.getenv("JOBSTORE_DB", "/workspace/jobs/jobs.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    kind          TEXT NOT NULL,      -- ovi | zimage
+    id            TEXT NOT NULL,
+    status        TEXT NOT NULL,      -- queued | running | succeeded | failed
+    tag           TEXT,
+    created_at    REAL NOT NULL,
+    started_at    REAL,
+    finished_at   REAL,
+    artifact_path TEXT,               -- finales mp4/png, gesetzt wenn der Job fertig ist
+    data          TEXT NOT NULL,      -- kompletter Status als JSON
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status  ON jobs (kind, status, created_at);
+CREATE INDEX IF NOT EXISTS ix_jobs_created ON jobs (kind, created_at);
+CREATE INDEX IF NOT EXISTS ix_jobs_tag     ON jobs (kind, tag, created_at);
+"""
+
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()  # FastAPI ruft sync-Endpoints aus dem Threadpool
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def upsert(self, kind: str, job_id: str, status: str, data: Dict[str, Any],
+               created_at: Optional[float] = None, started_at: Optional[float] = None,
+               finished_at: Optional[float] = None, tag: Optional[str] = None,
+               artifact_path: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (kind, id, status, tag, created_at, started_at, finished_at, artifact_path, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, id) DO UPDATE SET
+                    status        = excluded.status,
+                    tag           = COALESCE(excluded.tag, jobs.tag),
+                    started_at    = COALESCE(excluded.started_at, jobs.started_at),
+                    finished_at   = COALESCE(excluded.finished_at, jobs.finished_at),
+                    artifact_path = COALESCE(excluded.artifact_path, jobs.artifact_path),
+                    data          = excluded.data
+                """,
+                (kind, job_id, status, tag, created_at if created_at is not None else time.time(),
+                 started_at, finished_at, artifact_path, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def get(self, kind: str, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND id = ?", (kind, job_id)
+            ).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def query(self, kind: str, status: Optional[str] = None, tag: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: Optional[int] = 100, oldest_first: bool = False,
+              batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM jobs WHERE kind = ?"
+        args: List[Any] = [kind]
+        if status:
+            sql += " AND status = ?"
+            args.append(status)
+        if tag:
+            sql += " AND tag = ?"
+            args.append(tag)
+        if batch_id:
+            sql += " AND json_extract(data, '$.batch_id') = ?"
+            args.append(batch_id)
+        if since is not None:
+            sql += " AND created_at >= ?"
+            args.append(since)
+        if until is not None:
+            sql += " AND created_at < ?"
+            args.append(until)
+        sql += " ORDER BY created_at " + ("ASC" if oldest_first else "DESC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [_row_to_dict(r) for r in rows]
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    data = json.loads(row["data"])
+    data["artifact_path"] = row["artifact_path"]
+    if row["tag"] is not None:
+        data.setdefault("tag", row["tag"])
+    return data
+
+
+_store: Optional[JobStore] = None
+
+
+def get_store() -> JobStore:
+    global _store
+    if _store is None:
+        _store = JobStore(JOBSTORE_DB)
+    return _store
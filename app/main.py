@@ -1,12 +1,15 @@
 import os
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
+from .admission import Overloaded, TooLarge
 from .editor_api import EditRequest, render_edit
-from .OVI import OVIJobRequest, submit_job, get_status, get_file, OVI_ROOT, OVI_CKPT_DIR
+from .resultcache import get_cache
+from .OVI import (OVIJobRequest, OVIBatchRequest, submit_job, submit_batch, get_status, get_file, list_jobs, job_events,
+                  admission_stats, startup as ovi_startup, OVI_ROOT, OVI_CKPT_DIR)
 from .zimage import router as zimage_router
 
 app = FastAPI(title="OVI API", version="1.0")
@@ -21,6 +24,16 @@ app.mount("/exports", StaticFiles(directory=str(EXPORT_DIR), html=False), name="
 # ---- Routers ----
 app.include_router(zimage_router, prefix="/zimage", tags=["zimage"])
 
+# ---- Startup: persistierte OVI-Queue wieder aufnehmen ----
+@app.on_event("startup")
+async def _startup():
+    try:
+        await ovi_startup()
+    except RuntimeError as e:
+        # OVI noch nicht installiert (init.sh läuft noch) -> Recovery passiert beim ersten Job
+        print(f"[OVI-API] startup recovery skipped: {e}")
+
+
 # ---- Ready Flags ----
 OVI_FLAG_FILE = "/workspace/status/ovi_ready"
 ZIMAGE_FLAG_FILE = "/workspace/status/zimage_ready"
@@ -28,7 +41,9 @@ ZIMAGE_FLAG_FILE = "/workspace/status/zimage_ready"
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "OVI_ROOT": OVI_ROOT, "OVI_CKPT_DIR": OVI_CKPT_DIR}
+    cache = get_cache()
+    return {"status": "ok", "OVI_ROOT": OVI_ROOT, "OVI_CKPT_DIR": OVI_CKPT_DIR, "ovi_queue": admission_stats(),
+            "result_cache": cache.stats() if cache else None}
 
 
 @app.get("/DW/ready")
@@ -51,16 +66,46 @@ def editor_render(request: EditRequest):
 
 # ---- OVI Jobs (Polling wie gehabt) ----
 @app.post("/jobs")
-async def create_job(body: OVIJobRequest):
+async def create_job(body: OVIJobRequest, x_api_key: str | None = Header(None)):
     try:
-        jid = await submit_job(body)
-        return {"id": jid, "status": "queued"}
+        jid = await submit_job(body, api_key=x_api_key)
+        # Treffer im Ergebnis-Cache ist sofort "succeeded"
+        return {"id": jid, "status": get_status(jid).get("status", "queued")}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except TooLarge as e:
+        raise HTTPException(status_code=413, detail=e.detail)
     except FileExistsError:
         raise HTTPException(status_code=409, detail="job_id already exists")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/jobs/batch")
+async def create_batch(body: OVIBatchRequest, x_api_key: str | None = Header(None)):
+    # ein Job pro Item; Items mit gleicher Engine-Config laufen zusammen im Worker
+    try:
+        res = await submit_batch(body, api_key=x_api_key)
+        # Status pro Item: Treffer im Ergebnis-Cache sind sofort "succeeded"
+        done = all(it["status"] == "succeeded" for it in res["items"])
+        return {**res, "status": "succeeded" if done else "queued"}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except TooLarge as e:
+        raise HTTPException(status_code=413, detail=e.detail)
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/jobs")
+def jobs_list(status: str | None = None, tag: str | None = None, batch_id: str | None = None,
+              since: float | None = None, until: float | None = None, limit: int = 100):
+    return list_jobs(status=status, tag=tag, since=since, until=until, limit=min(max(limit, 1), 1000),
+                     batch_id=batch_id)
+
+
 @app.get("/jobs/{job_id}")
 def job_status(job_id: str):
     try:
@@ -69,6 +114,17 @@ def job_status(job_id: str):
         raise HTTPException(status_code=404, detail="job not found")
 
 
+@app.get("/jobs/{job_id}/events")
+def job_events_stream(job_id: str):
+    # Server-Sent Events: stage (load, text-encode, vae-encode, denoise i/N, decode, mux), eta_s, Durchsatz
+    try:
+        stream = job_events(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="job not found")
+    return StreamingResponse(stream, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/jobs/{job_id}/file")
 def job_file(job_id: str, path: str | None = None):
     try:
@@ -0,0 +1,170 @@
+# /workspace/app/resultcache.py
+# Content-addressed Ergebnis-Cache für OVI + Z-Image.
+# Key = sha256 über die kanonische (sortierte) effektive Config inkl. Checkpoint-Identität.
+# Artefakte werden per Hardlink abgelegt/ausgeliefert -> ein Treffer kostet weder GPU noch Kopie.
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .jobstore import JOBSTORE_DB
+
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", JOBSTORE_DB)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(JOBSTORE_DB), "_cache"))
+# zählt nur Artefakte, die allein im Cache liegen (st_nlink == 1): solange ein Job-Ordner noch einen Hardlink
+# hält, kostet der Cache-Eintrag keinen zusätzlichen Platz, wird nicht mitgezählt und nicht verdrängt
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv("RESULT_CACHE_MAX_GB", "20")) * 1024 ** 3)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key          TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,      -- ovi | zimage
+    path         TEXT NOT NULL,      -- Datei im Cache-Ordner
+    name         TEXT NOT NULL,      -- ursprünglicher Dateiname (wird beim Treffer wiederverwendet)
+    size         INTEGER NOT NULL,
+    created_at   REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits         INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_result_cache_lru ON result_cache (last_used_at);
+"""
+
+
+def cache_key(kind: str, params: Dict[str, Any]) -> str:
+    blob = json.dumps({"kind": kind, "params": params}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def file_identity(path: str) -> Optional[List[Any]]:
+    # Checkpoint-Identität ohne GBs zu hashen: Pfad + Größe + mtime
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+
+def file_sha256(path: str) -> Optional[str]:
+    # für kleine Inputs (Startbild bei i2v)
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+
+def _link_or_copy(src: Path, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)  # anderes Dateisystem
+
+
+class ResultCache:
+    def __init__(self, db_path: str, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def link_into(self, key: str, dest_dir: Path, name: Optional[str] = None) -> Optional[Path]:
+        """Treffer -> Artefakt nach dest_dir hardlinken und Pfad zurückgeben, sonst None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM result_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            src = Path(row["path"])
+            if not src.is_file():
+                self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE result_cache SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+        dst = dest_dir / (name or row["name"])
+        _link_or_copy(src, dst)
+        return dst
+
+    def put(self, key: str, kind: str, artifact: Path):
+        if not artifact.is_file():
+            return
+        target = self.cache_dir / key[:2] / (key + artifact.suffix)
+        _link_or_copy(artifact, target)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO result_cache (key, kind, path, name, size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    path = excluded.path, name = excluded.name, size = excluded.size, last_used_at = excluded.last_used_at
+                """,
+                (key, kind, str(target), artifact.name, target.stat().st_size, now, now),
+            )
+            self._evict()
+
+    def _owned(self) -> List[Any]:
+        # Aufrufer hält self._lock; [(key, path, size)] der Einträge, deren Datei nur noch der Cache hält
+        # (LRU-Reihenfolge). Einträge mit verschwundener Datei fliegen dabei raus.
+        owned = []
+        for row in self._conn.execute("SELECT key, path FROM result_cache ORDER BY last_used_at").fetchall():
+            try:
+                st = os.stat(row["path"])
+            except OSError:
+                self._conn.execute("DELETE FROM result_cache WHERE key = ?", (row["key"],))
+                continue
+            if st.st_nlink == 1:
+                owned.append((row["key"], row["path"], st.st_size))
+        return owned
+
+    def _evict(self):
+        # Aufrufer hält self._lock; LRU nach last_used_at, bis der nur vom Cache belegte Platz wieder passt.
+        # Noch in Job-Ordnern verlinkte Artefakte zählen nicht: sie zu löschen gäbe keinen Platz frei.
+        owned = self._owned()
+        total = sum(size for _, _, size in owned)
+        for key, path, size in owned:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS size, COALESCE(SUM(hits), 0) AS hits FROM result_cache"
+            ).fetchone()
+            owned = sum(size for _, _, size in self._owned())
+        return {"entries": row["n"], "bytes": row["size"], "owned_bytes": owned, "max_bytes": self.max_bytes,
+                "hits": row["hits"]}
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_cache() -> Optional[ResultCache]:
+    """None wenn per RESULT_CACHE=0 abgeschaltet."""
+    global _cache
+    if not RESULT_CACHE:
+        return None
+    if _cache is None:
+        _cache = ResultCache(RESULT_CACHE_DB, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+    return _cache
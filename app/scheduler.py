@@ -0,0 +1,71 @@
+# /workspace/app/scheduler.py
+# Prioritäts-Queue statt FIFO: Prioritätsklasse zuerst, innerhalb der Klasse kürzester Job zuerst.
+# Aging: wer lange wartet, steigt in der Klasse auf und seine Kosten zählen weniger -> kein Verhungern.
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+PRIORITY_CLASSES = {"high": 0, "normal": 1, "low": 2}
+
+
+@dataclass
+class _Entry:
+    job_id: str
+    priority: int
+    cost: float
+    enqueued_at: float
+
+
+class PriorityScheduler:
+    """
+    get() liefert die Job-ID mit dem kleinsten (Klasse, Kosten, Einreihzeit) nach Aging:
+      - pro `class_age_s` Wartezeit eine Klasse nach oben (bis "high")
+      - Kosten werden mit 1 / (1 + wait / cost_age_s) gewichtet
+    Die Queue ist klein (einzelne GPU), daher linearer Scan statt Heap: das Aging ändert
+    die Reihenfolge ohnehin laufend.
+    """
+
+    def __init__(self, class_age_s: float = 600.0, cost_age_s: float = 300.0):
+        self.class_age_s = class_age_s
+        self.cost_age_s = cost_age_s
+        self._entries: Dict[str, _Entry] = {}
+        self._cond = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._entries
+
+    async def put(self, job_id: str, priority: int = 1, cost: float = 0.0, enqueued_at: Optional[float] = None):
+        async with self._cond:
+            self._entries[job_id] = _Entry(job_id, priority, cost, enqueued_at if enqueued_at is not None else time.time())
+            self._cond.notify()
+
+    def discard(self, job_id: str):
+        self._entries.pop(job_id, None)
+
+    async def get(self) -> str:
+        async with self._cond:
+            await self._cond.wait_for(lambda: bool(self._entries))
+            job_id = self.order()[0]
+            del self._entries[job_id]
+            return job_id
+
+    def _key(self, e: _Entry, now: float) -> Tuple[int, float, float]:
+        wait = max(now - e.enqueued_at, 0.0)
+        prio = max(0, e.priority - int(wait // self.class_age_s)) if self.class_age_s > 0 else e.priority
+        cost = e.cost / (1.0 + wait / self.cost_age_s) if self.cost_age_s > 0 else e.cost
+        return prio, cost, e.enqueued_at
+
+    def order(self) -> List[str]:
+        """Job-IDs in der Reihenfolge, in der sie jetzt drankämen."""
+        now = time.time()
+        return [e.job_id for e in sorted(self._entries.values(), key=lambda e: self._key(e, now))]
+
+    def position(self, job_id: str) -> Optional[int]:
+        try:
+            return self.order().index(job_id)
+        except ValueError:
+            return None
@@ -0,0 +1,127 @@
+# /workspace/app/warm_worker.py
+# Resident Child-Prozess (Modell bleibt geladen), Kommunikation über stdin/stdout als JSON-Lines.
+import asyncio
+import ctypes
+import json
+import os
+import signal
+import sys
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class WorkerDied(RuntimeError):
+    pass
+
+
+class WarmWorker:
+    """
+    Startet `cmd` einmal und schickt danach beliebig viele Requests als JSON-Zeile.
+    Der Worker antwortet mit Zeilen {"type": ...}; alles bis zur {"type": "result"}-Zeile
+    wird an on_event weitergereicht.
+    """
+
+    def __init__(self, name: str, cmd: List[str], cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None, log_path: Optional[Path] = None):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.log_path = log_path
+
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._log_fh = None
+        self._lock = asyncio.Lock()  # ein Request gleichzeitig pro Prozess
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._proc.pid if self._proc else None
+
+    async def start(self):
+        if self.alive:
+            return
+        await self._cleanup()
+
+        if self.log_path:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._log_fh = self.log_path.open("ab")
+
+        self._proc = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            cwd=self.cwd,
+            env=self.env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=self._log_fh if self._log_fh else asyncio.subprocess.DEVNULL,
+            limit=16 * 1024 * 1024,
+            preexec_fn=_die_with_parent if sys.platform.startswith("linux") else None,
+        )
+
+        msg = await self._read_msg()
+        if msg.get("type") != "ready":
+            raise WorkerDied(f"{self.name}: unexpected hello {msg}")
+
+    async def request(self, payload: Dict[str, Any],
+                      on_event: Optional[Callable[[Dict[str, Any]], Optional[Awaitable[None]]]] = None) -> Dict[str, Any]:
+        async with self._lock:
+            await self.start()
+            try:
+                self._proc.stdin.write((json.dumps(payload, ensure_ascii=False) + "\n").encode())
+                await self._proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError) as e:
+                raise WorkerDied(f"{self.name}: {e!r}")
+
+            while True:
+                msg = await self._read_msg()
+                if msg.get("type") == "result":
+                    return msg
+                if on_event is not None:
+                    res = on_event(msg)
+                    if asyncio.iscoroutine(res):
+                        await res
+
+    async def stop(self):
+        if self.alive:
+            try:
+                self._proc.stdin.write(b'{"cmd": "shutdown"}\n')
+                await self._proc.stdin.drain()
+                await asyncio.wait_for(self._proc.wait(), timeout=30)
+            except Exception:
+                self._proc.kill()
+        await self._cleanup()
+
+    async def _read_msg(self) -> Dict[str, Any]:
+        line = await self._proc.stdout.readline()
+        if not line:
+            rc = await self._proc.wait()
+            await self._cleanup()
+            raise WorkerDied(f"{self.name} exited with code {rc}")
+        return json.loads(line)
+
+    async def _cleanup(self):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+        self._proc = None
+        if self._log_fh:
+            self._log_fh.close()
+            self._log_fh = None
+
+
+def _die_with_parent():
+    # Stirbt die API (uvicorn restart), darf kein verwaister Worker den Job weiterrechnen,
+    # sonst läuft derselbe Job nach der Recovery doppelt auf der GPU.
+    PR_SET_PDEATHSIG = 1
+    ctypes.CDLL("libc.so.6", use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+
+
+def child_env(pythonpath: Optional[str] = None, **extra: str) -> Dict[str, str]:
+    env = os.environ.copy()
+    if pythonpath:
+        env["PYTHONPATH"] = pythonpath + (":" + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    env.update(extra)
+    return env
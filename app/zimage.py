@@ -3,13 +3,19 @@ import json
 import os
 import time
 import uuid
+from collections import deque
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Deque, List, Optional, Dict, Any
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
 
+from .admission import AdmissionController, AdmissionLimits, Overloaded, TooLarge, client_id
+from .jobstore import get_store
+from .resultcache import cache_key, get_cache
+from .warm_worker import WarmWorker, WorkerDied, child_env
+
 router = APIRouter()
 
 # ---- Config ----
@@ -23,6 +29,17 @@ ZIMAGE_READY_FLAG = Path(os.environ.get("ZIMAGE_READY_FLAG", str(STATUS_DIR / "z
 
 JOBS_ROOT = Path(os.environ.get("ZIMAGE_JOBS_ROOT", "/workspace/jobs/zimage"))
 
+# Anzahl residenter Pipelines (jede hält das komplette Modell im VRAM!)
+ZIMAGE_CONCURRENCY = max(1, int(os.environ.get("ZIMAGE_CONCURRENCY", "1")))
+ZIMAGE_WORKER_PY = Path(__file__).resolve().with_name("zimage_worker.py")
+
+# Micro-Batching: kompatible Jobs (width/height/steps/guidance_scale) laufen als ein Pipeline-Call
+ZIMAGE_BATCH_MAX_SIZE = max(1, int(os.environ.get("ZIMAGE_BATCH_MAX_SIZE", "4")))
+ZIMAGE_BATCH_MAX_WAIT_MS = max(0, int(os.environ.get("ZIMAGE_BATCH_MAX_WAIT_MS", "25")))
+
+# Admission: ZIMAGE_MAX_QUEUED_JOBS, ZIMAGE_MAX_QUEUED_GPU_S, ZIMAGE_KEY_MAX_QUEUED_* (0 = kein Limit)
+ZIMAGE_DEFAULT_JOB_S = float(os.environ.get("ZIMAGE_DEFAULT_JOB_S", "10"))
+
 
 class ZImageJobRequest(BaseModel):
     prompt: str = Field(..., min_length=1)
@@ -32,27 +49,46 @@ class ZImageJobRequest(BaseModel):
     guidance_scale: float = Field(0.0, ge=0.0, le=20.0)
     seed: Optional[int] = Field(42, ge=0)
     job_id: Optional[str] = None
+    tag: Optional[str] = Field(None, max_length=128)
+    cache: bool = True   # nur wirksam mit festem seed
 
 
 def _job_dir(job_id: str) -> Path:
     return JOBS_ROOT / job_id
 
 
-def _write_status(job_id: str, state: str, extra: Optional[Dict[str, Any]] = None) -> None:
+def _write_status(job_id: str, state: str, extra: Optional[Dict[str, Any]] = None,
+                  tag: Optional[str] = None) -> None:
     d = _job_dir(job_id)
     d.mkdir(parents=True, exist_ok=True)
-    payload = {"job_id": job_id, "state": state, "ts": time.time()}
+    now = time.time()
+    payload = {"job_id": job_id, "state": state, "ts": now}
     if extra:
         payload.update(extra)
     (d / "status.json").write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
 
+    get_store().upsert(
+        "zimage", job_id, state, payload,
+        created_at=now,  # bleibt beim Update erhalten
+        started_at=now if state == "running" else None,
+        finished_at=now if state in ("succeeded", "failed") else None,
+        tag=tag,
+        artifact_path=payload.get("output_path"),
+    )
+
 
 def _read_status(job_id: str) -> Dict[str, Any]:
-    p = _job_dir(job_id) / "status.json"
-    if not p.exists():
-        raise FileNotFoundError
-    
-    data = json.loads(p.read_text(encoding="utf-8"))
+    data = get_store().get("zimage", job_id)
+    if data is None:
+        # Alt-Jobs (vor dem JobStore)
+        p = _job_dir(job_id) / "status.json"
+        if not p.exists():
+            raise FileNotFoundError
+        data = json.loads(p.read_text(encoding="utf-8"))
+    data.pop("artifact_path", None)
+
+    # Live-Position aus der Queue (nur solange der Job im Speicher-Pool ist)
+    data.update(_pool.position(job_id))
     
     # ✅ DYNAMISCHE URL ERZEUGEN
     # Wenn der Job erfolgreich war, bauen wir den absoluten Link zusammen
@@ -62,93 +98,188 @@ def _read_status(job_id: str) -> Dict[str, Any]:
     return data
 
 
-async def _run_job(job_id: str) -> None:
-    d = _job_dir(job_id)
-    req_path = d / "request.json"
-    out_path = d / "out.png"
-    stdout_path = d / "stdout.log"
-    stderr_path = d / "stderr.log"
-
-    _write_status(job_id, "running")
-
-    worker = r"""
-import os, json, torch
-from diffusers import ZImagePipeline
-
-with open(os.environ["JOB_JSON"], "r", encoding="utf-8") as f:
-    req = json.load(f)
-
-prompt = req["prompt"]
-width = int(req["width"])
-height = int(req["height"])
-steps = int(req["steps"])
-guidance = float(req["guidance_scale"])
-seed = req.get("seed", None)
-out_path = req["out_path"]
-
-dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float16
-
-pipe = ZImagePipeline.from_pretrained(
-    "Tongyi-MAI/Z-Image-Turbo",
-    torch_dtype=dtype,
-    low_cpu_mem_usage=False,
-)
-
-if torch.cuda.is_available():
-    pipe = pipe.to("cuda")
-
-gen = None
-if seed is not None:
-    gen = torch.Generator("cuda" if torch.cuda.is_available() else "cpu").manual_seed(int(seed))
-
-img = pipe(
-    prompt=prompt,
-    height=height,
-    width=width,
-    num_inference_steps=steps,
-    guidance_scale=guidance,
-    generator=gen,
-).images[0]
-
-os.makedirs(os.path.dirname(out_path), exist_ok=True)
-img.save(out_path)
-print(out_path)
-"""
-
-    env = os.environ.copy()
-    env["HF_HOME"] = HF_HOME
-    env["JOB_JSON"] = str(req_path)
-
-    proc = await asyncio.create_subprocess_exec(
-        ZIMAGE_PY, "-c", worker,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=env,
-    )
+class _ZImagePool:
+    """
+    Feste Anzahl residenter Z-Image Worker + echte FIFO-Queue.
+    Jeder Worker lädt ZImagePipeline einmal und bleibt dann warm.
+    """
+
+    def __init__(self, size: int, max_batch: int = 1, max_wait_ms: int = 0):
+        self.size = size
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: Deque[str] = deque()
+        self._keys: Dict[str, tuple] = {}
+        self._running: List[str] = []
+        self._cond: Optional[asyncio.Condition] = None
+        self._workers: List[WarmWorker] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._cond = asyncio.Condition()
+        for i in range(self.size):
+            self._workers.append(WarmWorker(
+                name=f"zimage-worker-{i}",
+                cmd=[ZIMAGE_PY, str(ZIMAGE_WORKER_PY)],
+                env=child_env(HF_HOME=HF_HOME),
+                log_path=JOBS_ROOT / "_worker" / f"zimage_worker_{i}.log",
+            ))
+            self._tasks.append(asyncio.create_task(self._loop(i)))
+
+    async def submit(self, job_id: str, batch_key: tuple):
+        self._ensure_started()
+        async with self._cond:
+            self._pending.append(job_id)
+            self._keys[job_id] = batch_key
+            self._cond.notify_all()
+
+    def _take_compatible(self, batch: List[str]):
+        key = self._keys[batch[0]]
+        for jid in list(self._pending):
+            if len(batch) >= self.max_batch:
+                break
+            if self._keys.get(jid) == key:
+                self._pending.remove(jid)
+                batch.append(jid)
+
+    async def _next_batch(self) -> List[str]:
+        # Aufrufer hält self._cond
+        while not self._pending:
+            await self._cond.wait()
+        batch = [self._pending.popleft()]
+        self._take_compatible(batch)
+
+        # Batching-Fenster: kurz auf weitere kompatible Jobs warten
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._cond.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            self._take_compatible(batch)
+        return batch
+
+    def position(self, job_id: str) -> Dict[str, Any]:
+        if job_id in self._running:
+            return {"running": len(self._running), "concurrency": self.size}
+        if job_id in self._pending:
+            return {
+                "queue_position": list(self._pending).index(job_id) + 1,
+                "queue_length": len(self._pending),
+                "running": len(self._running),
+                "concurrency": self.size,
+            }
+        return {}
+
+    async def _loop(self, idx: int):
+        worker = self._workers[idx]
+        while True:
+            async with self._cond:
+                batch = await self._next_batch()
+                self._running.extend(batch)
+            t0 = time.monotonic()
+            ok = False
+            try:
+                ok = await _run_batch(worker, batch)
+            except Exception as e:
+                for job_id in batch:
+                    _write_status(job_id, "failed", extra={"error": repr(e)})
+            finally:
+                per_job_s = (time.monotonic() - t0) / len(batch) if ok else None
+                for job_id in batch:
+                    self._running.remove(job_id)
+                    key = self._keys.pop(job_id, None)
+                    _admission.release(job_id, per_job_s, cost=_cost(*key[:3]) if key else 0.0)
+
+
+_pool = _ZImagePool(ZIMAGE_CONCURRENCY, max_batch=ZIMAGE_BATCH_MAX_SIZE, max_wait_ms=ZIMAGE_BATCH_MAX_WAIT_MS)
+_admission = AdmissionController("zimage", AdmissionLimits.from_env("ZIMAGE"), concurrency=ZIMAGE_CONCURRENCY,
+                                 default_job_s=ZIMAGE_DEFAULT_JOB_S)
+
+
+def _model_identity() -> Dict[str, Any]:
+    # gleiche Quelle wie zimage_worker.load_pipeline; HF-Snapshot (refs/main) macht Modell-Updates sichtbar
+    model_id = os.environ.get("ZIMAGE_MODEL_ID", "Tongyi-MAI/Z-Image-Turbo")
+    ref = Path(HF_HOME) / "hub" / f"models--{model_id.replace('/', '--')}" / "refs" / "main"
+    try:
+        revision = ref.read_text(encoding="utf-8").strip()
+    except OSError:
+        revision = None
+    return {"model_id": model_id, "revision": revision}
 
-    out_b, err_b = await proc.communicate()
-    stdout_path.write_bytes(out_b or b"")
-    stderr_path.write_bytes(err_b or b"")
 
-    if proc.returncode != 0:
-        _write_status(job_id, "failed", extra={
-            "error": f"zimage subprocess exit code {proc.returncode}",
-            "stderr_log": str(stderr_path),
-        })
-        return
+def _result_key(req: ZImageJobRequest) -> Optional[str]:
+    if not req.cache or req.seed is None:
+        return None  # ohne seed nicht deterministisch
+    params = req.model_dump(exclude={"job_id", "tag", "cache"})
+    params["model"] = _model_identity()
+    return cache_key("zimage", params)
 
-    if not out_path.exists():
-        _write_status(job_id, "failed", extra={
-            "error": "out.png missing after generation",
-            "stdout_log": str(stdout_path),
-            "stderr_log": str(stderr_path),
-        })
-        return
 
-    _write_status(job_id, "succeeded", extra={
-        "output_path": str(out_path),
-        "file_endpoint": f"/zimage/jobs/{job_id}/file",
-    })
+def _cost(width: int, height: int, steps: int) -> float:
+    # Pixel * Schritte; Sekunden pro Einheit lernt der AdmissionController
+    return float(width * height * steps)
+
+
+def _batch_key(req: "ZImageJobRequest") -> tuple:
+    return (req.width, req.height, req.steps, req.guidance_scale)
+
+
+async def _run_batch(worker: WarmWorker, job_ids: List[str]) -> bool:
+    reqs = []
+    for job_id in job_ids:
+        _write_status(job_id, "running", extra={"batch_size": len(job_ids)})
+        reqs.append(json.loads((_job_dir(job_id) / "request.json").read_text(encoding="utf-8")))
+
+    try:
+        res = await worker.request({"cmd": "generate", "jobs": reqs})
+    except WorkerDied as e:
+        # Worker wird beim nächsten Job automatisch neu gestartet
+        for job_id in job_ids:
+            _write_status(job_id, "failed", extra={
+                "error": f"zimage worker died: {e}",
+                "worker_log": str(worker.log_path),
+            })
+        return False
+
+    cache = get_cache()
+    for job_id, req in zip(job_ids, reqs):
+        d = _job_dir(job_id)
+        out_path = d / "out.png"
+        stdout_path = d / "stdout.log"
+        stderr_path = d / "stderr.log"
+
+        if not res.get("ok"):
+            _write_status(job_id, "failed", extra={
+                "error": res.get("error") or "zimage generation failed",
+                "stderr_log": str(stderr_path),
+            })
+            continue
+
+        if not out_path.exists():
+            _write_status(job_id, "failed", extra={
+                "error": "out.png missing after generation",
+                "stdout_log": str(stdout_path),
+                "stderr_log": str(stderr_path),
+            })
+            continue
+
+        _write_status(job_id, "succeeded", extra={
+            "output_path": str(out_path),
+            "file_endpoint": f"/zimage/jobs/{job_id}/file",
+            "batch_size": len(job_ids),
+        })
+        if cache is not None and req.get("cache_key"):
+            try:
+                cache.put(req["cache_key"], "zimage", out_path)
+            except OSError as e:
+                print(f"[ZIMAGE] result cache put failed for {job_id}: {e!r}")
+    return bool(res.get("ok"))
 
 
 @router.get("/ready")
@@ -158,28 +289,68 @@ def zimage_ready():
 
 
 @router.post("/jobs")
-async def zimage_submit(req: ZImageJobRequest):
+async def zimage_submit(req: ZImageJobRequest, x_api_key: Optional[str] = Header(None)):
     if not ZIMAGE_READY_FLAG.exists():
         raise HTTPException(status_code=503, detail="Z-Image not ready (flag missing).")
 
     job_id = req.job_id or f"zimg_{uuid.uuid4().hex[:12]}"
-    d = _job_dir(job_id)
-    d.mkdir(parents=True, exist_ok=True)
 
-    request_payload = req.model_dump()
-    request_payload["out_path"] = str(d / "out.png")
-    (d / "request.json").write_text(json.dumps(request_payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    key = _result_key(req)
+    cache = get_cache()
+    if key and cache is not None:
+        hit = cache.link_into(key, _job_dir(job_id), name="out.png")
+        if hit is not None:
+            _write_status(job_id, "succeeded", extra={
+                "output_path": str(hit),
+                "file_endpoint": f"/zimage/jobs/{job_id}/file",
+                "cached": True,
+            }, tag=req.tag)
+            return {
+                "job_id": job_id,
+                "status_url": f"{BASE_URL}/zimage/jobs/{job_id}",
+                "state": "succeeded",
+                "cached": True,
+            }
+
+    # vor mkdir prüfen: abgelehnte Requests hinterlassen keine Job-Ordner
+    try:
+        _admission.admit(client_id(x_api_key), [(job_id, _cost(req.width, req.height, req.steps))])
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except TooLarge as e:
+        raise HTTPException(status_code=413, detail=e.detail)
+
+    # Slot ist gebucht: scheitert das Anlegen (Platte voll, Rechte), muss er wieder frei werden
+    try:
+        d = _job_dir(job_id)
+        d.mkdir(parents=True, exist_ok=True)
 
-    _write_status(job_id, "queued")
-    asyncio.create_task(_run_job(job_id))
+        request_payload = req.model_dump()
+        request_payload["out_path"] = str(d / "out.png")
+        request_payload["cache_key"] = key
+        (d / "request.json").write_text(json.dumps(request_payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        _write_status(job_id, "queued", tag=req.tag)
+        await _pool.submit(job_id, _batch_key(req))
+    except BaseException:
+        _admission.release(job_id)
+        raise
 
     return {
         "job_id": job_id,
         "status_url": f"{BASE_URL}/zimage/jobs/{job_id}",
         "state": "queued",
+        **_pool.position(job_id),
     }
 
 
+@router.get("/jobs")
+def zimage_list(state: Optional[str] = None, tag: Optional[str] = None,
+                since: Optional[float] = None, until: Optional[float] = None, limit: int = 100):
+    return get_store().query("zimage", status=state, tag=tag, since=since, until=until,
+                             limit=min(max(limit, 1), 1000))
+
+
 @router.get("/jobs/{job_id}")
 def zimage_status(job_id: str):
     try:
@@ -0,0 +1,140 @@
+# /workspace/app/zimage_worker.py
+# Läuft im Z-Image venv (ZIMAGE_PY), NICHT im API-Prozess -> keine Imports aus app.*
+#
+# Protokoll (eine JSON-Zeile pro Nachricht):
+#   <- {"type": "ready", "pid": ...}                         (Pipeline ist geladen)
+#   -> {"cmd": "generate", "jobs": [{...request.json...}, ...]}  (kompatible Jobs = ein Batch)
+#   <- {"type": "result", "ok": true, "out_paths": ["...", ...]}  bzw. {"ok": false, "error": "..."}
+#   -> {"cmd": "shutdown"}
+import contextlib
+import json
+import os
+import shutil
+import sys
+import traceback
+
+import torch
+from diffusers import ZImagePipeline
+
+MODEL_ID = os.environ.get("ZIMAGE_MODEL_ID", "Tongyi-MAI/Z-Image-Turbo")
+CPU_OFFLOAD = os.environ.get("ZIMAGE_CPU_OFFLOAD", "0") == "1"
+
+
+def load_pipeline():
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float16
+
+    pipe = ZImagePipeline.from_pretrained(
+        MODEL_ID,
+        torch_dtype=dtype,
+        low_cpu_mem_usage=False,
+    )
+
+    if torch.cuda.is_available():
+        if CPU_OFFLOAD:
+            pipe.enable_model_cpu_offload()
+        else:
+            pipe = pipe.to("cuda")
+    return pipe
+
+
+def _generator(seed):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    gen = torch.Generator(device)
+    if seed is None:
+        gen.seed()
+    else:
+        gen.manual_seed(int(seed))
+    return gen
+
+
+def generate(pipe, reqs):
+    """Ein Forward-Pass für alle reqs (gleiche width/height/steps/guidance_scale), ein Generator pro Sample."""
+    first = reqs[0]
+
+    images = pipe(
+        prompt=[r["prompt"] for r in reqs],
+        height=int(first["height"]),
+        width=int(first["width"]),
+        num_inference_steps=int(first["steps"]),
+        guidance_scale=float(first["guidance_scale"]),
+        generator=[_generator(r.get("seed", None)) for r in reqs],
+    ).images
+
+    out_paths = []
+    for req, img in zip(reqs, images):
+        out_path = req["out_path"]
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        img.save(out_path)
+        print(out_path)
+        out_paths.append(out_path)
+    return out_paths
+
+
+@contextlib.contextmanager
+def job_output(stdout_path, stderr_path):
+    # stdout.log / stderr.log pro Job wie beim alten `python -c` Aufruf
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_out, saved_err = os.dup(1), os.dup(2)
+    with open(stdout_path, "wb") as fo, open(stderr_path, "wb") as fe:
+        os.dup2(fo.fileno(), 1)
+        os.dup2(fe.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_out, 1)
+            os.dup2(saved_err, 2)
+            os.close(saved_out)
+            os.close(saved_err)
+
+
+def main():
+    # echtes stdout nur fürs Protokoll, alle prints landen im Worker-Log (stderr)
+    proto = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+
+    def send(payload):
+        proto.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        proto.flush()
+
+    pipe = load_pipeline()
+    send({"type": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        msg = json.loads(line)
+        cmd = msg.get("cmd")
+
+        if cmd == "shutdown":
+            break
+        if cmd != "generate":
+            send({"type": "result", "ok": False, "error": f"unknown cmd {cmd!r}"})
+            continue
+
+        reqs = msg["jobs"]
+        job_dirs = [os.path.dirname(r["out_path"]) for r in reqs]
+        try:
+            with job_output(os.path.join(job_dirs[0], "stdout.log"), os.path.join(job_dirs[0], "stderr.log")):
+                try:
+                    out_paths = generate(pipe, reqs)
+                except Exception:
+                    traceback.print_exc()
+                    raise
+        except Exception as e:
+            send({"type": "result", "ok": False, "error": repr(e)})
+            continue
+        finally:
+            # Batch-Log in jeden Job-Ordner spiegeln
+            for d in job_dirs[1:]:
+                for name in ("stdout.log", "stderr.log"):
+                    with contextlib.suppress(OSError):
+                        shutil.copyfile(os.path.join(job_dirs[0], name), os.path.join(d, name))
+        send({"type": "result", "ok": True, "out_paths": out_paths})
+
+
+if __name__ == "__main__":
+    main()